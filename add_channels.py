@@ -7,6 +7,7 @@ import asyncio
 import os
 from dotenv import load_dotenv
 from telegram_monitor import TelegramChannelMonitor
+from log_config import setup_logging
 
 # Загружаем переменные окружения
 load_dotenv('telega.env')
@@ -106,6 +107,7 @@ if __name__ == "__main__":
     response = input("\nХотите добавить каналы сейчас? (y/n): ")
     
     if response.lower() in ['y', 'yes', 'да', 'д']:
+        setup_logging()
         asyncio.run(add_channels())
     else:
         print("\nДля добавления каналов запустите скрипт снова или используйте примеры выше.") 
\ No newline at end of file
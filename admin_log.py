@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Подписки и отписки из журнала действий администраторов канала
+
+Для каналов, где аккаунт — администратор, журнал действий (GetAdminLog)
+содержит подписки и отписки с временем на сервере, в том числе
+случившиеся, пока монитор не работал. Журнал читается постранично от
+последнего обработанного ID события (таблица admin_log_state), события
+записываются в real_time_changes одной транзакцией с ключом log:<id>.
+
+Событие, уже записанное живым обработчиком, догрузкой или сверкой, не
+дублируется: ищется строка того же канала, пользователя и типа с временем
+в пределах LIVE_MATCH_SECONDS (у сверки время записи позже события, до
+RECONCILED_MATCH_HOURS). Сервер хранит журнал 48 часов, поэтому запускать
+чтение нужно чаще (см. задачу admin_log в scheduler.py).
+
+Запуск: python admin_log.py channel1 channel2
+"""
+
+import sys
+import asyncio
+import logging
+import argparse
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from telethon.errors import ChatAdminRequiredError
+from telethon.tl import types
+from telethon.tl.functions.channels import GetAdminLogRequest
+
+from metrics import api_call
+from telegram_monitor import ChangeRow, write_changes
+from channel_difference import local_time
+
+logger = logging.getLogger(__name__)
+
+ADMIN_LOG_PAGE = 100
+ADMIN_LOG_CONCURRENCY = 2
+LIVE_MATCH_SECONDS = 300
+RECONCILED_MATCH_HOURS = 48
+# Пользователей в одном запросе поиска уже записанных событий
+MATCH_BATCH_USERS = 500
+
+EVENTS_FILTER = types.ChannelAdminLogEventsFilter(join=True, leave=True, invite=True)
+
+
+class AdminLogResult(NamedTuple):
+    """Итог чтения журнала канала"""
+    channel_id: int
+    fetched: int
+    written: int
+    last_event_id: int
+
+
+def init_admin_log(conn):
+    """Последний обработанный ID события журнала по каналам"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS admin_log_state (
+            channel_id INTEGER PRIMARY KEY,
+            last_event_id INTEGER,
+            updated_at TIMESTAMP
+        )
+    ''')
+
+
+def read_last_event_id(conn, channel_id: int) -> int:
+    row = conn.execute('SELECT last_event_id FROM admin_log_state WHERE channel_id = ?', (channel_id,)).fetchone()
+    return row[0] if row else 0
+
+
+def event_change(event) -> Optional[Tuple[int, str]]:
+    """(user_id, 'joined' | 'left') для события журнала; None для прочих действий"""
+    action = event.action
+    if isinstance(action, types.ChannelAdminLogEventActionParticipantInvite):
+        # user_id события — пригласивший, подписчик — в participant
+        return getattr(action.participant, 'user_id', None), 'joined'
+    if isinstance(action, (types.ChannelAdminLogEventActionParticipantJoin,
+                           types.ChannelAdminLogEventActionParticipantJoinByInvite,
+                           types.ChannelAdminLogEventActionParticipantJoinByRequest)):
+        return event.user_id, 'joined'
+    if isinstance(action, types.ChannelAdminLogEventActionParticipantLeave):
+        return event.user_id, 'left'
+    return None
+
+
+def admin_log_rows(channel_id: int, events, users: Dict[int, tuple]) -> List[ChangeRow]:
+    """Строки изменений из событий журнала в порядке времени"""
+    rows = []
+    for event in sorted(events, key=lambda event: event.id):
+        change = event_change(event)
+        if change is None or change[0] is None:
+            continue
+        user_id, change_type = change
+        rows.append(ChangeRow(channel_id, user_id, change_type, local_time(event.date),
+                              *users.get(user_id, (None, None, None)), event_key=f'log:{event.id}'))
+    return rows
+
+
+async def fetch_admin_log(client, channel, min_id: int = 0) -> Tuple[list, Dict[int, tuple]]:
+    """События подписок и отписок с ID больше min_id и профили их участников
+
+    Сервер отдает журнал от новых событий к старым; следующая страница
+    запрашивается с max_id, равным самому старому ID предыдущей.
+    """
+    events, users, max_id = [], {}, 0
+    while True:
+        result = await api_call(client, GetAdminLogRequest(
+            channel=channel,
+            q='',
+            max_id=max_id,
+            min_id=min_id,
+            limit=ADMIN_LOG_PAGE,
+            events_filter=EVENTS_FILTER
+        ))
+        users.update((user.id, (user.username, user.first_name, user.last_name))
+                     for user in result.users if isinstance(user, types.User))
+        page = [event for event in result.events if event.id > min_id]
+        events.extend(page)
+        if len(result.events) < ADMIN_LOG_PAGE or not page:
+            return events, users
+        max_id = min(event.id for event in page)
+
+
+def drop_known(conn, rows: List[ChangeRow]) -> List[ChangeRow]:
+    """Строки журнала без событий, уже записанных другим путем
+
+    Каждая записанная строка покрывает не больше одного события журнала:
+    повторные подписки одного пользователя остаются разными событиями.
+    """
+    if not rows:
+        return rows
+    live_window = timedelta(seconds=LIVE_MATCH_SECONDS)
+    reconciled_window = timedelta(hours=RECONCILED_MATCH_HOURS)
+    since = min(row.change_date for row in rows) - live_window
+    until = max(row.change_date for row in rows) + reconciled_window
+
+    known: Dict[tuple, List[list]] = {}
+    for channel_id in {row.channel_id for row in rows}:
+        user_ids = sorted({row.user_id for row in rows if row.channel_id == channel_id})
+        for begin in range(0, len(user_ids), MATCH_BATCH_USERS):
+            batch = user_ids[begin:begin + MATCH_BATCH_USERS]
+            for user_id, change_type, change_date, is_reconciled in conn.execute(f'''
+                SELECT user_id, change_type, change_date, is_reconciled FROM real_time_changes
+                WHERE channel_id = ? AND change_date BETWEEN ? AND ?
+                  AND user_id IN ({', '.join('?' * len(batch))})
+                ORDER BY change_date
+            ''', [channel_id, since, until, *batch]):
+                known.setdefault((channel_id, user_id, change_type), []).append(
+                    [datetime.fromisoformat(str(change_date)), bool(is_reconciled)])
+
+    fresh = []
+    for row in rows:
+        candidates = known.get((row.channel_id, row.user_id, row.change_type), [])
+        for index, (change_date, is_reconciled) in enumerate(candidates):
+            if abs(change_date - row.change_date) <= live_window or (
+                    is_reconciled and row.change_date <= change_date <= row.change_date + reconciled_window):
+                del candidates[index]
+                break
+        else:
+            fresh.append(row)
+    return fresh
+
+
+async def ingest_channel(client, db_path: str, channel) -> AdminLogResult:
+    """Чтение новых событий журнала канала и их запись одной транзакцией"""
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        init_admin_log(conn)
+        last_event_id = read_last_event_id(conn, channel.id)
+        events, users = await fetch_admin_log(client, channel, last_event_id)
+        if not events:
+            return AdminLogResult(channel.id, 0, 0, last_event_id)
+        last_event_id = max(event.id for event in events)
+        rows = drop_known(conn, admin_log_rows(channel.id, events, users))
+        conn.execute('''
+            INSERT INTO admin_log_state (channel_id, last_event_id, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(channel_id) DO UPDATE SET
+                last_event_id = excluded.last_event_id, updated_at = excluded.updated_at
+        ''', (channel.id, last_event_id, datetime.now()))
+        # write_changes фиксирует транзакцию вместе с новым ID; без строк фиксируем сами
+        written = write_changes(conn, rows)
+        if not rows:
+            conn.commit()
+    finally:
+        conn.close()
+    return AdminLogResult(channel.id, len(events), len(written), last_event_id)
+
+
+async def ingest_admin_logs(client, db_path: str, channels, concurrency: int = ADMIN_LOG_CONCURRENCY) -> List[AdminLogResult]:
+    """Чтение журналов нескольких каналов; каналы без прав администратора пропускаются"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def ingest(channel) -> Optional[AdminLogResult]:
+        async with semaphore:
+            try:
+                result = await ingest_channel(client, db_path, channel)
+            except ChatAdminRequiredError:
+                logger.warning("Нет прав администратора для журнала канала %s", channel.id,
+                               extra={'channel_id': channel.id})
+                return None
+            except Exception:
+                logger.exception("Ошибка при чтении журнала канала %s", channel.id)
+                return None
+            if result.written:
+                logger.info("Из журнала канала %s записано изменений: %s", channel.id, result.written,
+                            extra={'channel_id': channel.id, 'fetched': result.fetched, 'written': result.written})
+            return result
+
+    results = await asyncio.gather(*(ingest(channel) for channel in channels))
+    return [result for result in results if result is not None]
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    from storage import default_db_path
+
+    parser = argparse.ArgumentParser(description='Подписки и отписки из журнала администраторов каналов')
+    parser.add_argument('channels', nargs='+', help='username каналов, где аккаунт — администратор')
+    parser.add_argument('--db', default=default_db_path(), help='база SQLite монитора')
+    return parser.parse_args(argv)
+
+
+async def run(args) -> List[AdminLogResult]:
+    from telegram_monitor import TelegramChannelMonitor
+
+    monitor = TelegramChannelMonitor(args.db)
+    await monitor.connect()
+    try:
+        channels = [await monitor.client.get_entity(channel) for channel in args.channels]
+        return await ingest_admin_logs(monitor.client, args.db, channels)
+    finally:
+        await monitor.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from log_config import setup_logging
+
+    args = parse_args(argv)
+    setup_logging()
+    results = asyncio.run(run(args))
+    for result in results:
+        print(f"Канал {result.channel_id}: событий {result.fetched}, записано {result.written}")
+    return 0 if len(results) == len(args.channels) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
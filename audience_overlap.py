@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Пересечение аудиторий каналов
+
+Для каждого канала в audience_sets хранится отсортированный массив ID
+участников из channel_members (дельта-кодирование + zlib, как member_state)
+и MinHash-сигнатура. После каждого сбора добавляются только строки
+channel_members с id больше отметки в rollup_state: массив объединяется с
+новыми ID, сигнатура — поэлементным минимумом с сигнатурой новых ID.
+
+Точные пересечения всех пар считаются за один проход по членствам,
+отсортированным по пользователю (диапазоны пользователей — в потоках).
+Для сотен крупных каналов есть оценка по MinHash: все пары сравниваются
+векторными операциями над матрицей сигнатур.
+
+Запуск: python audience_overlap.py [channel ...] [--method minhash] [--top 20]
+"""
+
+import os
+import sys
+import logging
+import argparse
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import combinations
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from member_ids import ID_DTYPE, mix64, pack_ids, unpack_ids
+from channel_rollups import init_rollups, read_watermark, table_exists
+
+logger = logging.getLogger(__name__)
+
+# Число корзин одноперестановочного MinHash: ошибка оценки Jaccard ~ 1/sqrt(MINHASH_BINS)
+MINHASH_BINS = 256
+EMPTY_BIN = np.iinfo(np.uint64).max
+OVERLAP_METHODS = ('exact', 'minhash')
+
+
+class OverlapRow(NamedTuple):
+    """Пересечение аудиторий пары каналов (для minhash — оценка)"""
+    channel_a: int
+    channel_b: int
+    size_a: int
+    size_b: int
+    intersection: int
+    jaccard: float
+
+
+def init_audiences(conn):
+    """Таблица составов каналов (вызывается из init_database сборщика)"""
+    init_rollups(conn)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS audience_sets (
+            channel_id INTEGER PRIMARY KEY,
+            member_ids BLOB,
+            member_count INTEGER,
+            minhash BLOB,
+            updated_at TIMESTAMP
+        )
+    ''')
+
+
+def minhash(ids: np.ndarray, bins: int = MINHASH_BINS) -> np.ndarray:
+    """Сигнатура: минимальный хеш в каждой из bins корзин (одна хеш-функция)"""
+    signature = np.full(bins, EMPTY_BIN, dtype=np.uint64)
+    if len(ids):
+        hashes = mix64(ids)
+        np.minimum.at(signature, (hashes % np.uint64(bins)).astype(np.intp), hashes // np.uint64(bins))
+    return signature
+
+
+def minhash_jaccard(a: np.ndarray, b: np.ndarray) -> float:
+    """Оценка Jaccard по двум сигнатурам"""
+    filled = (a != EMPTY_BIN) | (b != EMPTY_BIN)
+    total = int(filled.sum())
+    return int(((a == b) & filled).sum()) / total if total else 0.0
+
+
+def channel_filter(channel_ids: Optional[Sequence[int]]) -> Tuple[str, List[int]]:
+    """Условие WHERE по списку каналов (None — все каналы)"""
+    if channel_ids is None:
+        return '', []
+    return f"WHERE channel_id IN ({', '.join('?' * len(channel_ids))})" if channel_ids else 'WHERE 0', list(channel_ids)
+
+
+def load_audiences(conn, channel_ids: Optional[Sequence[int]] = None) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+    """channel_id -> (отсортированные ID, сигнатура) из audience_sets"""
+    where, params = channel_filter(channel_ids)
+    query = f'SELECT channel_id, member_ids, minhash FROM audience_sets {where}'
+    return {
+        channel_id: (unpack_ids(member_ids), np.frombuffer(signature, dtype='<u8').astype(np.uint64))
+        for channel_id, member_ids, signature in conn.execute(query, params)
+    }
+
+
+def load_signatures(conn, channel_ids: Optional[Sequence[int]] = None) -> Dict[int, Tuple[int, np.ndarray]]:
+    """channel_id -> (число участников, сигнатура) без распаковки массивов ID"""
+    where, params = channel_filter(channel_ids)
+    query = f'SELECT channel_id, member_count, minhash FROM audience_sets {where}'
+    return {
+        channel_id: (count, np.frombuffer(signature, dtype='<u8').astype(np.uint64))
+        for channel_id, count, signature in conn.execute(query, params)
+    }
+
+
+def refresh_audiences(conn) -> Dict[int, int]:
+    """Добавление участников, записанных после прошлого обновления
+
+    Транзакцией управляет вызывающий код. Возвращает число новых ID по каналам.
+    """
+    init_audiences(conn)
+    if not table_exists(conn, 'channel_members'):
+        return {}
+    start = read_watermark(conn, 'channel_members')
+    end = conn.execute('SELECT COALESCE(MAX(id), 0) FROM channel_members').fetchone()[0]
+    if end <= start:
+        return {}
+
+    rows = np.array(conn.execute('''
+        SELECT channel_id, user_id FROM channel_members
+        WHERE id > ? AND id <= ? AND is_active = 1
+    ''', (start, end)).fetchall(), dtype=np.int64).reshape(-1, 2)
+    added = {}
+    if len(rows):
+        rows = rows[np.lexsort((rows[:, 1], rows[:, 0]))]
+        channel_ids, first = np.unique(rows[:, 0], return_index=True)
+        known = load_audiences(conn, channel_ids.tolist())
+        updates = []
+        for channel_id, ids in zip(channel_ids.tolist(), np.split(rows[:, 1], first[1:])):
+            ids = np.unique(ids).astype(ID_DTYPE)
+            members, signature = known.get(channel_id, (np.empty(0, dtype=ID_DTYPE), minhash(ids[:0])))
+            fresh = ids[~np.isin(ids, members, assume_unique=True)] if len(members) else ids
+            if not len(fresh):
+                continue
+            members = np.union1d(members, fresh)
+            signature = np.minimum(signature, minhash(fresh))
+            added[channel_id] = len(fresh)
+            updates.append((channel_id, pack_ids(members, 1), len(members), signature.astype('<u8').tobytes(), datetime.now()))
+        conn.executemany('''
+            INSERT INTO audience_sets (channel_id, member_ids, member_count, minhash, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(channel_id) DO UPDATE SET
+                member_ids = excluded.member_ids, member_count = excluded.member_count,
+                minhash = excluded.minhash, updated_at = excluded.updated_at
+        ''', updates)
+    conn.execute('INSERT OR REPLACE INTO rollup_state (source, last_id) VALUES (?, ?)', ('channel_members', end))
+    logger.info("Составы каналов обновлены", extra={'channels': len(added), 'members': sum(added.values())})
+    return added
+
+
+def cooccurrence(users: np.ndarray, channels: np.ndarray, size: int) -> np.ndarray:
+    """Число общих пользователей для пар позиций каналов (a < b) по членствам,
+    отсортированным по (пользователь, позиция канала)"""
+    counts = np.zeros(size * size, dtype=np.int64)
+    # i — членство, за которым через distance позиций идет членство того же пользователя
+    candidates = np.flatnonzero(users[:-1] == users[1:])
+    distance = 1
+    while len(candidates):
+        counts += np.bincount(channels[candidates] * size + channels[candidates + distance], minlength=size * size)
+        distance += 1
+        candidates = candidates[candidates + distance < len(users)]
+        candidates = candidates[users[candidates + distance] == users[candidates]]
+    return counts.reshape(size, size)
+
+
+def exact_overlaps(audiences: Dict[int, Tuple[np.ndarray, np.ndarray]], workers: Optional[int] = None) -> List[OverlapRow]:
+    """Точные пересечения всех пар за один проход по членствам
+
+    Членства сортируются по пользователю, и для каждого пользователя
+    учитываются все пары его каналов; сумма по пользователям — матрица
+    пересечений. Диапазоны пользователей считаются параллельно.
+    """
+    channel_ids = sorted(audiences)
+    size = len(channel_ids)
+    if size < 2:
+        return []
+    sizes = np.array([len(audiences[channel_id][0]) for channel_id in channel_ids])
+    users = np.concatenate([audiences[channel_id][0] for channel_id in channel_ids])
+    channels = np.repeat(np.arange(size, dtype=np.int64), sizes)
+    # Каналы уже идут по возрастанию позиции: устойчивая сортировка по пользователю сохраняет их порядок
+    order = np.argsort(users, kind='stable')
+    users, channels = users[order], channels[order]
+
+    # Границы частей проходят между пользователями: пара каналов не делится
+    parts = workers or min(os.cpu_count() or 1, 8)
+    bounds = np.searchsorted(users, users[np.linspace(0, len(users), parts, endpoint=False).astype(np.intp)])
+    bounds = np.unique(np.append(bounds, len(users)))
+    with ThreadPoolExecutor(max_workers=parts) as executor:
+        matrix = sum(executor.map(lambda begin, end: cooccurrence(users[begin:end], channels[begin:end], size),
+                                  bounds[:-1], bounds[1:]))
+
+    rows = []
+    for a, b in combinations(range(size), 2):
+        common = int(matrix[a, b])
+        union = int(sizes[a] + sizes[b]) - common
+        rows.append(OverlapRow(channel_ids[a], channel_ids[b], int(sizes[a]), int(sizes[b]), common,
+                               common / union if union else 0.0))
+    return rows
+
+
+def minhash_overlaps(signatures: Dict[int, Tuple[int, np.ndarray]], min_jaccard: float = 0.0) -> List[OverlapRow]:
+    """Оценка по сигнатурам для всех пар каналов"""
+    channel_ids = sorted(signatures)
+    if len(channel_ids) < 2:
+        return []
+    sizes = np.array([signatures[channel_id][0] for channel_id in channel_ids])
+    matrix = np.stack([signatures[channel_id][1] for channel_id in channel_ids])
+    filled = matrix != EMPTY_BIN
+
+    rows = []
+    # Строка на канал: сравнение со всеми следующими за одну операцию
+    for index in range(len(channel_ids) - 1):
+        rest = matrix[index + 1:]
+        union = (filled[index] | filled[index + 1:]).sum(axis=1)
+        same = ((rest == matrix[index]) & filled[index]).sum(axis=1)
+        jaccard = np.divide(same, union, out=np.zeros(len(rest)), where=union > 0)
+        for offset in np.flatnonzero(jaccard >= min_jaccard).tolist():
+            other = index + 1 + offset
+            # |A ∩ B| = J / (1 + J) * (|A| + |B|)
+            estimate = jaccard[offset] / (1 + jaccard[offset]) * (sizes[index] + sizes[other])
+            rows.append(OverlapRow(channel_ids[index], channel_ids[other], int(sizes[index]), int(sizes[other]),
+                                   int(round(estimate)), float(jaccard[offset])))
+    return rows
+
+
+def pairwise_overlap(conn, channel_ids: Optional[Sequence[int]] = None, method: str = 'exact',
+                     workers: Optional[int] = None, min_jaccard: float = 0.0) -> List[OverlapRow]:
+    """Пересечения всех пар каналов (или выбранных), по убыванию Jaccard"""
+    if method not in OVERLAP_METHODS:
+        raise ValueError(f"Неизвестный метод: {method}")
+    init_audiences(conn)
+    if method == 'minhash':
+        rows = minhash_overlaps(load_signatures(conn, channel_ids), min_jaccard)
+    else:
+        rows = [row for row in exact_overlaps(load_audiences(conn, channel_ids), workers) if row.jaccard >= min_jaccard]
+    return sorted(rows, key=lambda row: row.jaccard, reverse=True)
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    from storage import default_db_path
+
+    parser = argparse.ArgumentParser(description='Пересечение аудиторий каналов')
+    parser.add_argument('channels', nargs='*', help='username каналов (по умолчанию все собранные)')
+    parser.add_argument('--db', default=default_db_path(), help='база SQLite сборщика')
+    parser.add_argument('--method', choices=OVERLAP_METHODS, default='exact', help='точно или оценка MinHash')
+    parser.add_argument('--top', type=int, default=20, help='число пар в выводе')
+    parser.add_argument('--workers', type=int, default=None, help='потоков для точного расчета')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from log_config import setup_logging
+    from channel_rollups import resolve_channel_id
+
+    args = parse_args(argv)
+    setup_logging()
+    conn = sqlite3.connect(args.db, timeout=30)
+    try:
+        channel_ids = None
+        if args.channels:
+            channel_ids = [resolve_channel_id(conn, channel) for channel in args.channels]
+            missing = [channel for channel, channel_id in zip(args.channels, channel_ids) if channel_id is None]
+            if missing:
+                print(f"Каналы не найдены: {', '.join(missing)}", file=sys.stderr)
+                return 1
+        refresh_audiences(conn)
+        conn.commit()
+        rows = pairwise_overlap(conn, channel_ids, args.method, args.workers)
+        names = dict(conn.execute('SELECT channel_id, channel_username FROM channels'))
+    finally:
+        conn.close()
+
+    for row in rows[:args.top]:
+        print(f"{names.get(row.channel_a, row.channel_a)} ∩ {names.get(row.channel_b, row.channel_b)}: "
+              f"{row.intersection:,} общих из {row.size_a:,} и {row.size_b:,}, Jaccard {row.jaccard:.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
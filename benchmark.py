@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+"""
+Офлайн-бенчмарк сборщика, монитора и экспорта (без аккаунта Telegram)
+
+Запуск: python benchmark.py --channels 3 --members 20000 --events 5000 --output bench.json
+Сравнение с прошлым результатом: python benchmark.py --baseline bench.json
+Время импорта точек входа: python benchmark.py --imports --import-target-ms 800
+Отчеты на SQLite и DuckDB: python generate_data.py --changes 50000000 --db big.db
+                           python benchmark.py --engines --db big.db
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import asyncio
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import numpy as np
+from telethon import utils
+from telethon.errors import FloodWaitError
+from telethon.tl.functions.channels import GetParticipantsRequest
+from telethon.tl.types import PeerChannel
+
+from log_config import setup_logging
+
+
+class FakeTelegramClient:
+    """Локальная замена TelegramClient с синтетическими страницами участников
+
+    Каждый flood_wait_every-й запрос получает FloodWait на flood_wait_seconds.
+    Как и TelegramClient, короткие ожидания (не дольше flood_sleep_threshold)
+    выдерживаются внутри клиента, длинные поднимаются как FloodWaitError.
+    Секунды ожидания и задержка ответа масштабируются time_scale.
+    """
+
+    def __init__(self, members_per_channel: int = 10000, response_latency: float = 0.0,
+                 flood_wait_every: int = 0, flood_wait_seconds: int = 1, flood_sleep_threshold: int = 60,
+                 time_scale: float = 0.001):
+        self.members_per_channel = members_per_channel
+        self.response_latency = response_latency
+        self.flood_wait_every = flood_wait_every
+        self.flood_wait_seconds = flood_wait_seconds
+        self.flood_sleep_threshold = flood_sleep_threshold
+        self.time_scale = time_scale
+        self.channels: Dict[str, SimpleNamespace] = {}
+        self.requests = 0
+        self.flood_waits = 0
+
+    async def get_entity(self, username: str):
+        if username not in self.channels:
+            channel_id = 1_000_000 + len(self.channels)
+            self.channels[username] = SimpleNamespace(id=channel_id, username=username, title=username)
+        return self.channels[username]
+
+    async def __call__(self, request):
+        self.requests += 1
+        if self.flood_wait_every and self.requests % self.flood_wait_every == 0:
+            self.flood_waits += 1
+            if self.flood_wait_seconds > self.flood_sleep_threshold:
+                raise FloodWaitError(request, capture=self.flood_wait_seconds)
+            await asyncio.sleep(self.flood_wait_seconds * self.time_scale)
+
+        if self.response_latency:
+            await asyncio.sleep(self.response_latency)
+
+        if isinstance(request, GetParticipantsRequest):
+            return self.participants_page(request.channel.id, request.offset, request.limit)
+        raise NotImplementedError(type(request).__name__)
+
+    def participants_page(self, channel_id: int, offset: int, limit: int):
+        """Страница участников: детерминированные пользователи канала"""
+        end = min(offset + limit, self.members_per_channel)
+        users = [
+            SimpleNamespace(id=channel_id * 10_000_000 + i, username=f'user{i}' if i % 3 else None,
+                            first_name=f'Имя{i}', last_name=None)
+            for i in range(offset, end)
+        ]
+        return SimpleNamespace(users=users, count=self.members_per_channel)
+
+    async def disconnect(self):
+        pass
+
+
+def make_chat_action_event(channel_id: int, user_id: int, joined: bool, message_id: int):
+    """Событие ChatAction с полями, которые использует монитор"""
+    return SimpleNamespace(
+        user_added=False,
+        user_joined=joined,
+        user_kicked=False,
+        user_left=not joined,
+        user=SimpleNamespace(id=user_id, username=f'user{user_id}', first_name='Имя', last_name=None),
+        chat_id=utils.get_peer_id(PeerChannel(channel_id)),
+        action_message=SimpleNamespace(id=message_id),
+        original_update=None,
+    )
+
+
+async def chat_action_stream(count: int, rate: float, channel_ids: List[int], seed: int = 0):
+    """Поток событий с заданной частотой (событий в секунду, 0 — без ограничения)
+
+    Возвращает пары (плановое время поступления, событие); при перегрузке
+    обработчика события не пропускаются, а накапливают задержку.
+    """
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    for i in range(count):
+        scheduled = start + i / rate if rate else time.perf_counter()
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        channel_id = channel_ids[i % len(channel_ids)]
+        yield scheduled, make_chat_action_event(channel_id, rng.randrange(1, 10_000_000), rng.random() < 0.6, i + 1)
+
+
+def summarize(latencies: List[float], items: int, seconds: float, peak_memory: int, **extra) -> Dict:
+    """Пропускная способность, перцентили задержки (мс) и пиковая память"""
+    result = {
+        'operations': len(latencies),
+        'items': items,
+        'seconds': round(seconds, 6),
+        'throughput_per_s': round(items / seconds, 2) if seconds else None,
+        'peak_memory_bytes': peak_memory,
+    }
+    if latencies:
+        p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+        result['latency_ms'] = {
+            'p50': round(float(p50), 3),
+            'p95': round(float(p95), 3),
+            'p99': round(float(p99), 3),
+            'max': round(max(latencies) * 1000, 3),
+        }
+    result.update(extra)
+    return result
+
+
+@contextmanager
+def measure():
+    """Замер времени и пиковой памяти Python (tracemalloc) блока"""
+    stats = {}
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        stats['seconds'] = time.perf_counter() - start
+        stats['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+
+async def bench_collect_members(client: FakeTelegramClient, channels: List[str], repeat: int) -> Dict:
+    """Сбор участников StatsCollector.collect_members"""
+    from stats_collector import StatsCollector
+
+    collector = StatsCollector()
+    collector.client = client
+    latencies = []
+    requests_before, floods_before = client.requests, client.flood_waits
+    with measure() as stats:
+        for _ in range(repeat):
+            for channel in channels:
+                start = time.perf_counter()
+                await collector.collect_members(channel)
+                latencies.append(time.perf_counter() - start)
+    return summarize(
+        latencies, client.members_per_channel * len(channels) * repeat, stats['seconds'], stats['peak_memory'],
+        api_requests=client.requests - requests_before, flood_waits=client.flood_waits - floods_before
+    )
+
+
+async def bench_process_chat_action(count: int, rate: float, channel_ids: List[int], seed: int) -> Dict:
+    """Обработка событий TelegramChannelMonitor.process_chat_action
+
+    Задержка считается от планового времени поступления события, поэтому
+    при частоте выше пропускной способности она растет с очередью.
+    """
+    from telegram_monitor import TelegramChannelMonitor
+
+    monitor = TelegramChannelMonitor()
+    monitor.monitored_channels.update(channel_ids)
+    latencies = []
+    with measure() as stats:
+        async for scheduled, event in chat_action_stream(count, rate, channel_ids, seed):
+            await monitor.process_chat_action(event)
+            latencies.append(time.perf_counter() - scheduled)
+    return summarize(latencies, count, stats['seconds'], stats['peak_memory'], target_rate=rate)
+
+
+async def bench_take_snapshot(client: FakeTelegramClient, channels: List[str], repeat: int) -> Dict:
+    """Снимки TelegramChannelMonitor.take_snapshot"""
+    from telegram_monitor import TelegramChannelMonitor
+
+    monitor = TelegramChannelMonitor()
+    monitor.client = client
+    latencies = []
+    with measure() as stats:
+        for _ in range(repeat):
+            for channel in channels:
+                start = time.perf_counter()
+                await monitor.take_snapshot(channel)
+                latencies.append(time.perf_counter() - start)
+    return summarize(latencies, len(latencies), stats['seconds'], stats['peak_memory'])
+
+
+def exporter_calls(channel: str) -> Dict[str, tuple]:
+    """Методы DataExporter и их аргументы"""
+    now = datetime.now()
+    return {
+        'export_members_to_csv': (channel,),
+        'export_changes_to_csv': (channel, now - timedelta(days=30), now),
+        'export_stats_to_json': (channel,),
+        'export_growth_report': (channel,),
+        'create_summary_report': (channel,),
+    }
+
+
+def bench_exporter(db_path: str, channel: str, repeat: int, output_dir: str) -> Dict[str, Dict]:
+    """Методы DataExporter; ошибка метода попадает в отчет вместо результата"""
+    from export_data import DataExporter
+
+    exporter = DataExporter(db_path)
+    results = {}
+    for method_name, args in exporter_calls(channel).items():
+        method = getattr(exporter, method_name)
+        latencies = []
+        try:
+            with measure() as stats:
+                for i in range(repeat):
+                    filename = os.path.join(output_dir, f'{method_name}_{i}.out')
+                    start = time.perf_counter()
+                    method(*args, filename=filename)
+                    latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            results[f'export.{method_name}'] = {'error': f'{type(e).__name__}: {" ".join(str(e).split())}'}
+            continue
+        results[f'export.{method_name}'] = summarize(latencies, len(latencies), stats['seconds'], stats['peak_memory'])
+    return results
+
+
+async def run_benchmarks(args) -> Dict:
+    """Прогон всех сценариев во временном каталоге"""
+    client = FakeTelegramClient(
+        members_per_channel=args.members,
+        response_latency=args.latency,
+        flood_wait_every=args.flood_wait_every,
+        flood_wait_seconds=args.flood_wait_seconds,
+        time_scale=args.time_scale,
+    )
+    channels = [f'bench_channel_{i}' for i in range(args.channels)]
+    channel_ids = [(await client.get_entity(channel)).id for channel in channels]
+
+    results = {}
+    results['collect_members'] = await bench_collect_members(client, channels, args.repeat)
+    results['process_chat_action'] = await bench_process_chat_action(args.events, args.rate, channel_ids, args.seed)
+    results['take_snapshot'] = await bench_take_snapshot(client, channels, args.repeat)
+
+    db_path = os.path.abspath(args.db) if args.db else os.path.abspath('telegram_stats.db')
+    results.update(bench_exporter(db_path, channels[0], args.repeat, os.getcwd()))
+    if args.api_requests:
+        results['read_api'] = await bench_read_api(db_path, channels[0], args.api_requests, args.api_concurrency)
+    return results
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Сценарии, пропускная способность которых упала больше чем на tolerance"""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get('results', {}).get(name, {})
+        current_rate, previous_rate = result.get('throughput_per_s'), previous.get('throughput_per_s')
+        if current_rate and previous_rate and current_rate < previous_rate * (1 - tolerance):
+            regressions.append(f'{name}: {previous_rate} -> {current_rate} в секунду')
+    return regressions
+
+
+# Модули точек входа и тяжелые библиотеки, которые они не должны загружать без необходимости
+ENTRY_MODULES = ('telegram_monitor', 'sharded_monitor', 'add_channels', 'export_data', 'telegram_stats')
+COLD_START_MODULES = ('telegram_monitor', 'sharded_monitor')
+HEAVY_MODULES = ('pandas', 'plotly', 'streamlit')
+
+
+def import_time(module: str, repeat: int = 5) -> Dict:
+    """Время холодного импорта модуля в отдельном интерпретаторе (python -X importtime)"""
+    wall, cumulative = [], []
+    imported = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+        )
+        wall.append(time.perf_counter() - start)
+        imported = {}
+        for line in completed.stderr.splitlines():
+            if not line.startswith('import time:') or '|' not in line:
+                continue
+            _, total, name = line.split('|')
+            if total.strip().isdigit():
+                imported[name.strip()] = int(total)
+        cumulative.append(imported.get(module, 0) / 1_000_000)
+
+    top_level = {name: total for name, total in imported.items() if '.' not in name and name != module}
+    slowest = sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:5]
+    return {
+        'wall_ms': round(statistics.median(wall) * 1000, 1),
+        'import_ms': round(statistics.median(cumulative) * 1000, 1),
+        'slowest_imports_ms': {name: round(total / 1000, 1) for name, total in slowest},
+        'heavy_loaded': [name for name in HEAVY_MODULES if name in imported],
+    }
+
+
+async def bench_read_api(db_path: str, channel: str, requests: int, concurrency: int) -> Dict:
+    """Нагрузка на HTTP API чтения: одновременные запросы к разным обработчикам"""
+    from aiohttp import ClientSession
+    from aiohttp.test_utils import TestServer
+    from read_api import create_app
+
+    paths = [f'/api/channels/{channel}/{endpoint}' for endpoint in ('stats', 'growth', 'changes?limit=100')]
+    latencies, statuses = [], {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(session: ClientSession, path: str):
+        async with semaphore:
+            start = time.perf_counter()
+            async with session.get(path) as response:
+                await response.read()
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+
+    async with TestServer(create_app(db_path)) as server:
+        async with ClientSession(base_url=server.make_url('/')) as session:
+            with measure() as stats:
+                await asyncio.gather(*(fetch(session, paths[i % len(paths)]) for i in range(requests)))
+    return summarize(latencies, len(latencies), stats['seconds'], stats['peak_memory'],
+                     concurrency=concurrency, statuses=statuses)
+
+
+REPORT_METHODS = ('export_stats_to_json', 'export_growth_report', 'create_summary_report')
+
+
+def busiest_channel(db_path: str) -> str:
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute('''
+            SELECT ch.channel_username
+            FROM member_changes mc JOIN channels ch ON ch.channel_id = mc.channel_id
+            GROUP BY mc.channel_id ORDER BY COUNT(*) DESC LIMIT 1
+        ''').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def bench_export_engines(db_path: str, repeat: int, output_dir: str) -> Dict[str, Dict]:
+    """Отчеты DataExporter на SQLite и DuckDB по одной базе
+
+    Первичное наполнение копии DuckDB замеряется отдельно (export_engine.duckdb.sync,
+    без пиковой памяти), в замерах отчетов остается только дозагрузка новых строк.
+    """
+    from export_data import DataExporter
+    from storage import AnalyticsReplica, SQLiteStorage
+
+    channel = busiest_channel(db_path)
+    results = {}
+    for engine in ('sqlite', 'duckdb'):
+        exporter = DataExporter(db_path, engine=engine, analytics_path=os.path.join(output_dir, 'bench.duckdb'))
+        if exporter.analytics is not None:
+            # Без tracemalloc: на миллионах строк он замедляет копирование в разы
+            start = time.perf_counter()
+            copied = AnalyticsReplica(SQLiteStorage(db_path), exporter.analytics).sync()
+            seconds = time.perf_counter() - start
+            results['export_engine.duckdb.sync'] = summarize([seconds], sum(copied.values()), seconds, None)
+        for method_name in REPORT_METHODS:
+            latencies = []
+            with measure() as stats:
+                for i in range(repeat):
+                    start = time.perf_counter()
+                    getattr(exporter, method_name)(channel, filename=os.path.join(output_dir, f'{engine}_{method_name}_{i}.out'))
+                    latencies.append(time.perf_counter() - start)
+            results[f'export_engine.{engine}.{method_name}'] = summarize(
+                latencies, len(latencies), stats['seconds'], stats['peak_memory'], channel=channel)
+    return results
+
+
+def check_cold_start(results: Dict, target_ms: float) -> List[str]:
+    """Модули мониторинга, холодный старт которых дольше целевого"""
+    return [
+        f'{module}: холодный старт {results[f"import.{module}"]["wall_ms"]} мс > {target_ms} мс'
+        for module in COLD_START_MODULES
+        if results[f'import.{module}']['wall_ms'] > target_ms
+    ]
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Офлайн-бенчмарк сборщика, монитора и экспорта')
+    parser.add_argument('--channels', type=int, default=3, help='число синтетических каналов')
+    parser.add_argument('--members', type=int, default=10000, help='участников в канале')
+    parser.add_argument('--events', type=int, default=2000, help='событий ChatAction')
+    parser.add_argument('--rate', type=float, default=0, help='частота событий в секунду (0 — без ограничения)')
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка ответа API, с')
+    parser.add_argument('--flood-wait-every', type=int, default=0, help='FloodWait на каждый N-й запрос (0 — нет)')
+    parser.add_argument('--flood-wait-seconds', type=int, default=1, help='длительность FloodWait, с')
+    parser.add_argument('--time-scale', type=float, default=0.001, help='масштаб секунд FloodWait')
+    parser.add_argument('--repeat', type=int, default=3, help='повторов сбора, снимков и экспорта')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--db', help='база для сценариев экспорта (по умолчанию — заполненная бенчмарком)')
+    parser.add_argument('--api-requests', type=int, default=300, help='запросов к HTTP API чтения (0 — пропустить)')
+    parser.add_argument('--api-concurrency', type=int, default=20, help='одновременных запросов к API')
+    parser.add_argument('--output', help='файл для JSON-отчета (по умолчанию stdout)')
+    parser.add_argument('--baseline', help='JSON-отчет прошлого прогона для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='допустимое падение пропускной способности')
+    parser.add_argument('--imports', action='store_true', help='замер времени импорта точек входа вместо сценариев')
+    parser.add_argument('--engines', action='store_true', help='сравнение отчетов экспорта на SQLite и DuckDB по --db')
+    parser.add_argument('--import-target-ms', type=float, default=float(os.getenv('IMPORT_TARGET_MS', '1000')),
+                        help='целевой холодный старт монитора, мс')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    setup_logging(level=os.getenv('LOG_LEVEL', 'WARNING'))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    regressions = []
+    if args.imports:
+        results = {f'import.{module}': import_time(module, args.repeat) for module in ENTRY_MODULES}
+        regressions.extend(check_cold_start(results, args.import_target_ms))
+    elif args.engines:
+        if not args.db:
+            print("Для сравнения движков укажите --db (например, база generate_data.py)", file=sys.stderr)
+            return 2
+        workdir = tempfile.mkdtemp(prefix='telegram_bench_')
+        try:
+            results = bench_export_engines(os.path.abspath(args.db), args.repeat, workdir)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    else:
+        cwd = os.getcwd()
+        if args.db:
+            args.db = os.path.abspath(args.db)
+        workdir = tempfile.mkdtemp(prefix='telegram_bench_')
+        try:
+            os.chdir(workdir)
+            results = asyncio.run(run_benchmarks(args))
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'date': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'params': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        },
+        'results': results,
+    }
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if baseline is not None:
+        regressions.extend(compare(results, baseline, args.tolerance))
+    for line in regressions:
+        print(f"Регрессия: {line}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
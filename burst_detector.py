@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Обнаружение всплесков подписок (волн ботов)
+
+Детектор работает в памяти монитора и получает каждую записанную подписку.
+Для канала держится кольцевой буфер посекундных счетчиков за последнюю
+минуту (память не зависит от числа событий) и экспоненциально сглаженные
+среднее и дисперсия подписок за минуту. Всплеск начинается, когда подписок
+за последние WINDOW_SECONDS больше порога от этой базы, и заканчивается
+после COOLDOWN_SECONDS ниже порога. Пока всплеск идет, база не обновляется,
+а ID подписавшихся собираются и при закрытии сохраняются в join_bursts для
+последующей чистки.
+
+Последние всплески: python burst_detector.py [username]
+"""
+
+import sys
+import math
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from member_ids import to_id_array, pack_ids, unpack_ids
+
+logger = logging.getLogger(__name__)
+
+# Окно подсчета и длительность затишья, после которой всплеск закрывается
+WINDOW_SECONDS = 60
+COOLDOWN_SECONDS = 120
+# Порог: не меньше MIN_JOINS за окно и выше базы на SIGMAS отклонений и в RATIO раз
+MIN_JOINS = 30
+SIGMAS = 4.0
+RATIO = 5.0
+# Вес новой минуты в сглаженной базе (~ последние полчаса)
+BASELINE_ALPHA = 0.05
+# Минут наблюдения, после которых база участвует в пороге
+WARMUP_MINUTES = 10
+
+
+class RingCounter:
+    """Счетчик событий за последние slots * slot_seconds секунд
+
+    Старые ячейки обнуляются при продвижении времени, сумма окна
+    поддерживается приращениями.
+    """
+
+    def __init__(self, slots: int, slot_seconds: float = 1.0):
+        self.counts = [0] * slots
+        self.slot_seconds = slot_seconds
+        self.head: Optional[int] = None
+        self.total = 0
+
+    def advance(self, timestamp: float):
+        slot = int(timestamp // self.slot_seconds)
+        if self.head is None:
+            self.head = slot
+            return
+        steps = slot - self.head
+        if steps <= 0:
+            return
+        slots = len(self.counts)
+        if steps >= slots:
+            self.counts = [0] * slots
+            self.total = 0
+        else:
+            for step in range(1, steps + 1):
+                index = (self.head + step) % slots
+                self.total -= self.counts[index]
+                self.counts[index] = 0
+        self.head = slot
+
+    def add(self, timestamp: float, count: int = 1):
+        self.advance(timestamp)
+        slot = int(timestamp // self.slot_seconds)
+        # События старше окна (запоздавшие) не учитываются
+        if slot <= self.head - len(self.counts):
+            return
+        self.counts[slot % len(self.counts)] += count
+        self.total += count
+
+    def value(self, timestamp: float) -> int:
+        """Сумма окна на момент timestamp"""
+        self.advance(timestamp)
+        return self.total
+
+
+class Burst:
+    """Идущий или завершенный всплеск подписок в канале"""
+
+    def __init__(self, channel_id: int, started_at: float, baseline: float, threshold: float):
+        self.channel_id = channel_id
+        self.started_at = started_at
+        self.last_join_at = started_at
+        self.baseline = baseline
+        self.threshold = threshold
+        self.peak = 0
+        self.user_ids: Set[int] = set()
+        self.quiet_since: Optional[float] = None
+
+    @property
+    def joins(self) -> int:
+        return len(self.user_ids)
+
+    def __repr__(self):
+        return f'Burst(channel_id={self.channel_id}, joins={self.joins}, peak={self.peak})'
+
+
+class ChannelWindow:
+    """Состояние канала: окно подсчета, база и последние подписавшиеся"""
+
+    def __init__(self, window_seconds: int):
+        self.window = RingCounter(window_seconds)
+        self.minute: Optional[int] = None
+        self.minute_joins = 0
+        self.minutes_seen = 0
+        self.mean = 0.0
+        self.variance = 0.0
+        # Подписки внутри окна: при начале всплеска попадают в его набор
+        self.recent: Deque[Tuple[float, int]] = deque()
+        self.burst: Optional[Burst] = None
+
+
+class BurstDetector:
+    """Потоковый детектор всплесков по каналам"""
+
+    def __init__(self, window_seconds: int = WINDOW_SECONDS, min_joins: int = MIN_JOINS,
+                 sigmas: float = SIGMAS, ratio: float = RATIO, alpha: float = BASELINE_ALPHA,
+                 cooldown_seconds: float = COOLDOWN_SECONDS, warmup_minutes: int = WARMUP_MINUTES):
+        self.window_seconds = window_seconds
+        self.min_joins = min_joins
+        self.sigmas = sigmas
+        self.ratio = ratio
+        self.alpha = alpha
+        self.cooldown_seconds = cooldown_seconds
+        self.warmup_minutes = warmup_minutes
+        self.channels: Dict[int, ChannelWindow] = {}
+
+    def threshold(self, state: ChannelWindow) -> float:
+        """Подписок за окно, начиная с которых фиксируется всплеск"""
+        if state.minutes_seen < self.warmup_minutes:
+            return self.min_joins
+        # База поминутная, окно может быть другой длины
+        scale = self.window_seconds / 60
+        mean = state.mean * scale
+        std = math.sqrt(state.variance) * scale
+        return max(self.min_joins, mean + self.sigmas * std, mean * self.ratio)
+
+    def roll_baseline(self, state: ChannelWindow, timestamp: float):
+        """Перенос завершенных минут в сглаженную базу"""
+        minute = int(timestamp // 60)
+        if state.minute is None:
+            state.minute = minute
+            return
+        elapsed = minute - state.minute
+        if elapsed <= 0:
+            return
+        # Во время всплеска база заморожена, иначе волна поднимет порог сама себе
+        if state.burst is None:
+            # Пустые минуты после завершенной; дальше база уже почти не меняется
+            for joins in [state.minute_joins] + [0] * min(elapsed - 1, 240):
+                delta = joins - state.mean
+                state.mean += self.alpha * delta
+                state.variance = (1 - self.alpha) * (state.variance + self.alpha * delta * delta)
+                state.minutes_seen += 1
+        state.minute = minute
+        state.minute_joins = 0
+
+    def observe(self, channel_id: int, user_id: int, timestamp: float) -> Optional[Burst]:
+        """Учет подписки; возвращает всплеск, если он начался на этом событии"""
+        state = self.channels.get(channel_id)
+        if state is None:
+            state = self.channels[channel_id] = ChannelWindow(self.window_seconds)
+
+        self.roll_baseline(state, timestamp)
+        state.minute_joins += 1
+        state.window.add(timestamp)
+        state.recent.append((timestamp, user_id))
+        while state.recent and state.recent[0][0] <= timestamp - self.window_seconds:
+            state.recent.popleft()
+
+        count = state.window.total
+        burst = state.burst
+        if burst is not None:
+            burst.user_ids.add(user_id)
+            burst.last_join_at = timestamp
+            burst.peak = max(burst.peak, count)
+            if count >= burst.threshold:
+                burst.quiet_since = None
+            return None
+
+        threshold = self.threshold(state)
+        if count < threshold:
+            return None
+        burst = state.burst = Burst(channel_id, state.recent[0][0], state.mean, threshold)
+        burst.user_ids.update(user for _, user in state.recent)
+        burst.last_join_at = timestamp
+        burst.peak = count
+        state.recent.clear()
+        return burst
+
+    def expire(self, timestamp: float) -> List[Burst]:
+        """Закрытие всплесков, затихших не меньше cooldown_seconds назад"""
+        closed = []
+        for state in self.channels.values():
+            burst = state.burst
+            if burst is None:
+                continue
+            if state.window.value(timestamp) >= burst.threshold:
+                burst.quiet_since = None
+                continue
+            if burst.quiet_since is None:
+                burst.quiet_since = timestamp
+            if timestamp - burst.quiet_since >= self.cooldown_seconds:
+                closed.append(burst)
+                state.burst = None
+        return closed
+
+    def close_all(self) -> List[Burst]:
+        """Закрытие всех идущих всплесков (при остановке монитора)"""
+        closed = [state.burst for state in self.channels.values() if state.burst is not None]
+        for state in self.channels.values():
+            state.burst = None
+        return closed
+
+
+class BurstRecord(NamedTuple):
+    """Строка join_bursts без набора ID"""
+    id: int
+    channel_id: int
+    started_at: str
+    ended_at: str
+    joins: int
+    peak_per_window: int
+    baseline_per_minute: float
+
+
+def init_bursts(conn):
+    """Таблица завершенных всплесков (вызывается из init_database монитора)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS join_bursts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel_id INTEGER,
+            started_at TIMESTAMP,
+            ended_at TIMESTAMP,
+            joins INTEGER,
+            peak_per_window INTEGER,
+            baseline_per_minute REAL,
+            user_ids BLOB
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_join_bursts_channel ON join_bursts (channel_id, started_at)')
+
+
+def save_bursts(conn, bursts: Sequence[Burst]) -> int:
+    """Запись завершенных всплесков; транзакцией управляет вызывающий код"""
+    conn.executemany('''
+        INSERT INTO join_bursts (channel_id, started_at, ended_at, joins, peak_per_window, baseline_per_minute, user_ids)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(
+        burst.channel_id,
+        datetime.fromtimestamp(burst.started_at),
+        datetime.fromtimestamp(burst.last_join_at),
+        burst.joins,
+        burst.peak,
+        burst.baseline,
+        pack_ids(to_id_array(burst.user_ids)),
+    ) for burst in bursts])
+    return len(bursts)
+
+
+def recent_bursts(conn, channel_id: Optional[int] = None, limit: int = 20) -> List[BurstRecord]:
+    """Последние всплески (всех каналов или одного)"""
+    where, params = ('WHERE channel_id = ?', [channel_id]) if channel_id is not None else ('', [])
+    return [BurstRecord(*row) for row in conn.execute(f'''
+        SELECT id, channel_id, started_at, ended_at, joins, peak_per_window, baseline_per_minute
+        FROM join_bursts
+        {where}
+        ORDER BY started_at DESC
+        LIMIT ?
+    ''', params + [limit])]
+
+
+def burst_members(conn, burst_id: int) -> np.ndarray:
+    """Отсортированные ID подписавшихся во время всплеска"""
+    row = conn.execute('SELECT user_ids FROM join_bursts WHERE id = ?', (burst_id,)).fetchone()
+    return unpack_ids(row[0] if row else None)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    import sqlite3
+    from storage import default_db_path
+    from channel_rollups import resolve_channel_id
+
+    argv = sys.argv[1:] if argv is None else argv
+    conn = sqlite3.connect(default_db_path())
+    try:
+        init_bursts(conn)
+        channel_id = resolve_channel_id(conn, argv[0]) if argv else None
+        if argv and channel_id is None:
+            print(f"Канал {argv[0]} не найден")
+            return 1
+        for burst in recent_bursts(conn, channel_id):
+            print(f"#{burst.id} канал {burst.channel_id}: {burst.started_at} — {burst.ended_at}, "
+                  f"подписок {burst.joins}, пик {burst.peak_per_window} за окно, "
+                  f"база {burst.baseline_per_minute:.1f}/мин")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""
+Догрузка пропущенных обновлений каналов после переподключения
+
+Для каждого отслеживаемого канала в channel_pts хранится последний
+известный pts. После переподключения монитор запрашивает у сервера разницу
+(GetChannelDifference) от этого pts и записывает найденные подписки и
+отписки с серверным временем. Ключи событий те же, что у живых обновлений
+(msg:<id>, qts:<qts>), поэтому события, уже записанные до обрыва, не
+дублируются. Каналы обрабатываются параллельно, не больше concurrency
+одновременно. Если разница слишком велика (ChannelDifferenceTooLong),
+канал догружается сверкой состава.
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional
+
+from telethon.errors import FloodWaitError
+from telethon.tl import types
+from telethon.tl.functions.channels import GetFullChannelRequest
+from telethon.tl.functions.updates import GetChannelDifferenceRequest
+
+from metrics import api_call
+
+logger = logging.getLogger(__name__)
+
+CATCH_UP_CONCURRENCY = 4
+DIFFERENCE_LIMIT = 100
+# Страниц разницы на канал за одну догрузку; остаток догрузится в следующий раз
+MAX_DIFFERENCE_PAGES = 50
+# Повторы после FloodWait; длинное ожидание оставляет канал до следующей догрузки
+MAX_FLOOD_RETRIES = 3
+MAX_FLOOD_WAIT_SECONDS = 300
+
+
+class CatchUpResult(NamedTuple):
+    """Итог догрузки канала: rows — ChangeRow, too_long — нужна сверка состава"""
+    channel_id: int
+    rows: list
+    pts: int
+    too_long: bool = False
+
+
+def init_channel_pts(conn):
+    """Таблица последних pts каналов (вызывается из init_database монитора)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS channel_pts (
+            channel_id INTEGER PRIMARY KEY,
+            pts INTEGER,
+            updated_at TIMESTAMP
+        )
+    ''')
+
+
+def load_channel_pts(conn) -> Dict[int, int]:
+    return dict(conn.execute('SELECT channel_id, pts FROM channel_pts'))
+
+
+def save_channel_pts(conn, pts: Dict[int, int]):
+    """Запись pts без отката назад; транзакцией управляет вызывающий код"""
+    conn.executemany('''
+        INSERT INTO channel_pts (channel_id, pts, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(channel_id) DO UPDATE SET
+            pts = MAX(pts, excluded.pts), updated_at = excluded.updated_at
+    ''', [(channel_id, value, datetime.now()) for channel_id, value in pts.items()])
+
+
+def local_time(moment: datetime) -> datetime:
+    """Серверное время (UTC) в местном без часового пояса, как datetime.now() в остальных записях"""
+    return moment.astimezone().replace(tzinfo=None)
+
+
+def difference_rows(difference) -> list:
+    """Строки изменений из ChannelDifference со временем событий на сервере"""
+    # sharded_monitor импортирует telegram_monitor, который импортирует этот модуль
+    from sharded_monitor import RAW_UPDATE_TYPES, changes_from_update
+
+    users = {user.id: (user.username, user.first_name, user.last_name)
+             for user in difference.users if isinstance(user, types.User)}
+    updates = [types.UpdateNewChannelMessage(message, difference.pts, 0)
+               for message in difference.new_messages if isinstance(message, types.MessageService)]
+    updates += [update for update in difference.other_updates if isinstance(update, RAW_UPDATE_TYPES)]
+
+    rows = []
+    for update in updates:
+        date = update.date if isinstance(update, types.UpdateChannelParticipant) else update.message.date
+        rows.extend(changes_from_update(update, users, local_time(date) if date else datetime.now()))
+    return rows
+
+
+async def current_pts(client, channel) -> int:
+    """pts канала сейчас: начальная точка для будущих догрузок"""
+    full = await api_call(client, GetFullChannelRequest(channel))
+    return full.full_chat.pts
+
+
+async def channel_difference(client, channel, pts: int) -> CatchUpResult:
+    """Все изменения канала после pts (не больше MAX_DIFFERENCE_PAGES страниц)"""
+    rows = []
+    for _ in range(MAX_DIFFERENCE_PAGES):
+        difference = await api_call(client, GetChannelDifferenceRequest(
+            channel=channel,
+            filter=types.ChannelMessagesFilterEmpty(),
+            pts=pts,
+            limit=DIFFERENCE_LIMIT,
+            force=True
+        ))
+        if isinstance(difference, types.updates.ChannelDifferenceTooLong):
+            return CatchUpResult(channel.id, rows, difference.dialog.pts, too_long=True)
+        if isinstance(difference, types.updates.ChannelDifference):
+            rows.extend(difference_rows(difference))
+        pts = difference.pts
+        if difference.final:
+            break
+    return CatchUpResult(channel.id, rows, pts)
+
+
+async def catch_up_channel(client, channel, pts: Optional[int]) -> CatchUpResult:
+    """Догрузка одного канала с ожиданием коротких FloodWait"""
+    for attempt in range(MAX_FLOOD_RETRIES + 1):
+        try:
+            if pts is None:
+                return CatchUpResult(channel.id, [], await current_pts(client, channel))
+            return await channel_difference(client, channel, pts)
+        except FloodWaitError as e:
+            if attempt == MAX_FLOOD_RETRIES or e.seconds > MAX_FLOOD_WAIT_SECONDS:
+                raise
+            logger.warning("FloodWait %s с при догрузке канала %s", e.seconds, channel.id,
+                           extra={'channel_id': channel.id})
+            await asyncio.sleep(e.seconds)
+
+
+async def catch_up_channels(client, channels: Dict[int, object], pts: Dict[int, int],
+                            concurrency: int = CATCH_UP_CONCURRENCY) -> List[CatchUpResult]:
+    """Догрузка каналов, не больше concurrency одновременно
+
+    Каналы без сохраненного pts получают текущий pts без строк. Ошибки
+    по отдельным каналам логируются, такие каналы в результат не попадают.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def catch_up(channel) -> Optional[CatchUpResult]:
+        async with semaphore:
+            try:
+                return await catch_up_channel(client, channel, pts.get(channel.id))
+            except Exception:
+                logger.exception("Ошибка при догрузке обновлений канала %s", channel.id)
+                return None
+
+    results = await asyncio.gather(*(catch_up(channel) for channel in channels.values()))
+    return [result for result in results if result is not None]
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Агрегаты по каналам для обзорной панели
+
+channel_daily_stats хранит подписки и отписки по каналам и дням,
+channel_summary — последний снимок численности. Обе таблицы обновляются
+инкрементально: обрабатываются только строки real_time_changes и
+channel_snapshots с id больше сохраненной отметки.
+
+Первичное построение: python channel_rollups.py [путь к базе]
+"""
+
+import sys
+import sqlite3
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Порядок сортировки обзора (значение — выражение ORDER BY)
+OVERVIEW_SORTS = {
+    'growth': 'net_growth DESC',
+    'churn': 'churn_rate DESC NULLS LAST',
+    'size': 'member_count DESC NULLS LAST',
+    'joined': 'joined DESC',
+    'left': 'left_count DESC',
+}
+
+
+class ChannelOverviewRow(NamedTuple):
+    """Строка обзора каналов за период"""
+    channel_id: int
+    channel_username: Optional[str]
+    member_count: Optional[int]
+    joined: int
+    left_count: int
+    net_growth: int
+    churn_rate: Optional[float]
+
+
+def init_rollups(conn):
+    """Таблицы каналов и агрегатов (вызывается из init_database сборщика и монитора)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS channels (
+            channel_id INTEGER PRIMARY KEY,
+            channel_username TEXT,
+            updated_at TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS channel_daily_stats (
+            channel_id INTEGER,
+            day TEXT,
+            joined_count INTEGER DEFAULT 0,
+            left_count INTEGER DEFAULT 0,
+            PRIMARY KEY (channel_id, day)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS channel_summary (
+            channel_id INTEGER PRIMARY KEY,
+            member_count INTEGER,
+            snapshot_date TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            source TEXT PRIMARY KEY,
+            last_id INTEGER
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_channel_daily_stats_day ON channel_daily_stats (day)')
+
+
+def table_exists(conn, name: str) -> bool:
+    """Таблицы изменений и снимков создает монитор; в базе только сборщика их нет"""
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+
+def remember_channel(conn, channel_id: int, channel_username: str):
+    """Запоминание username канала (без префикса -100 в channel_id)"""
+    conn.execute('''
+        INSERT INTO channels (channel_id, channel_username, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(channel_id) DO UPDATE SET
+            channel_username = excluded.channel_username, updated_at = excluded.updated_at
+    ''', (channel_id, channel_username, datetime.now()))
+
+
+def resolve_channel_id(conn, channel_username: str) -> Optional[int]:
+    """ID канала по username: из справочника каналов, затем из снимков"""
+    row = conn.execute(
+        'SELECT channel_id FROM channels WHERE channel_username = ? COLLATE NOCASE', (channel_username,)
+    ).fetchone()
+    if row is None and table_exists(conn, 'channel_snapshots'):
+        row = conn.execute(
+            'SELECT channel_id FROM channel_snapshots WHERE channel_username = ? COLLATE NOCASE '
+            'ORDER BY id DESC LIMIT 1', (channel_username,)
+        ).fetchone()
+    return row[0] if row else None
+
+
+def read_watermark(conn, source: str) -> int:
+    row = conn.execute('SELECT last_id FROM rollup_state WHERE source = ?', (source,)).fetchone()
+    return row[0] if row else 0
+
+
+def refresh_rollups(conn) -> Dict[str, int]:
+    """Добавление в агрегаты строк, появившихся после прошлого обновления
+
+    Верхняя граница фиксируется в начале: запись в SQLite идет одним
+    писателем, поэтому строки, зафиксированные позже, получат большие id
+    и попадут в следующее обновление. Возвращает число обработанных строк.
+    """
+    processed = {'real_time_changes': 0, 'channel_snapshots': 0}
+    if not table_exists(conn, 'real_time_changes'):
+        return processed
+
+    with conn:
+        changes_from = read_watermark(conn, 'real_time_changes')
+        changes_to = conn.execute('SELECT COALESCE(MAX(id), 0) FROM real_time_changes').fetchone()[0]
+        if changes_to > changes_from:
+            conn.execute('''
+                INSERT INTO channel_daily_stats (channel_id, day, joined_count, left_count)
+                SELECT channel_id, DATE(change_date),
+                       SUM(change_type = 'joined'), SUM(change_type = 'left')
+                FROM real_time_changes
+                WHERE id > ? AND id <= ?
+                GROUP BY channel_id, DATE(change_date)
+                ON CONFLICT(channel_id, day) DO UPDATE SET
+                    joined_count = joined_count + excluded.joined_count,
+                    left_count = left_count + excluded.left_count
+            ''', (changes_from, changes_to))
+            # Каналы без снимков тоже попадают в обзор
+            conn.execute('''
+                INSERT OR IGNORE INTO channel_summary (channel_id)
+                SELECT DISTINCT channel_id FROM real_time_changes WHERE id > ? AND id <= ?
+            ''', (changes_from, changes_to))
+            conn.execute('INSERT OR REPLACE INTO rollup_state (source, last_id) VALUES (?, ?)',
+                         ('real_time_changes', changes_to))
+        processed['real_time_changes'] = changes_to - changes_from
+
+        snapshots_from = read_watermark(conn, 'channel_snapshots')
+        snapshots_to = conn.execute('SELECT COALESCE(MAX(id), 0) FROM channel_snapshots').fetchone()[0]
+        if snapshots_to > snapshots_from:
+            conn.execute('''
+                INSERT INTO channel_summary (channel_id, member_count, snapshot_date)
+                SELECT channel_id, member_count, snapshot_date
+                FROM channel_snapshots
+                WHERE id IN (
+                    SELECT MAX(id) FROM channel_snapshots WHERE id > ? AND id <= ? GROUP BY channel_id
+                )
+                ON CONFLICT(channel_id) DO UPDATE SET
+                    member_count = excluded.member_count, snapshot_date = excluded.snapshot_date
+            ''', (snapshots_from, snapshots_to))
+            conn.execute('''
+                INSERT INTO channels (channel_id, channel_username, updated_at)
+                SELECT channel_id, channel_username, MAX(snapshot_date)
+                FROM channel_snapshots
+                WHERE id > ? AND id <= ? AND channel_username IS NOT NULL
+                GROUP BY channel_id
+                ON CONFLICT(channel_id) DO NOTHING
+            ''', (snapshots_from, snapshots_to))
+            conn.execute('INSERT OR REPLACE INTO rollup_state (source, last_id) VALUES (?, ?)',
+                         ('channel_snapshots', snapshots_to))
+        processed['channel_snapshots'] = snapshots_to - snapshots_from
+    return processed
+
+
+def channel_overview(conn, days: int = 30, sort: str = 'growth', search: Optional[str] = None,
+                     channel_ids: Optional[Sequence[int]] = None, limit: int = 50,
+                     offset: int = 0) -> Tuple[List[ChannelOverviewRow], int]:
+    """Страница рейтинга каналов за период и общее число каналов под фильтром
+
+    Один агрегирующий запрос по channel_daily_stats: фильтр, сортировка и
+    постраничный вывод выполняются в SQLite.
+    """
+    if sort not in OVERVIEW_SORTS:
+        raise ValueError(f"Неизвестная сортировка: {sort}")
+
+    since_day = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+    conditions, params = [], [since_day]
+    if search:
+        escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        conditions.append("ch.channel_username LIKE ? ESCAPE '\\'")
+        params.append(f'%{escaped}%')
+    if channel_ids is not None:
+        conditions.append(f"s.channel_id IN ({', '.join('?' * len(channel_ids))})")
+        params.extend(channel_ids)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    rows = conn.execute(f'''
+        WITH period AS (
+            SELECT channel_id, SUM(joined_count) AS joined, SUM(left_count) AS left_count
+            FROM channel_daily_stats
+            WHERE day >= ?
+            GROUP BY channel_id
+        )
+        SELECT
+            s.channel_id,
+            ch.channel_username,
+            s.member_count,
+            COALESCE(p.joined, 0) AS joined,
+            COALESCE(p.left_count, 0) AS left_count,
+            COALESCE(p.joined, 0) - COALESCE(p.left_count, 0) AS net_growth,
+            CAST(COALESCE(p.left_count, 0) AS REAL) / NULLIF(s.member_count, 0) AS churn_rate,
+            COUNT(*) OVER () AS total
+        FROM channel_summary s
+        LEFT JOIN channels ch ON ch.channel_id = s.channel_id
+        LEFT JOIN period p ON p.channel_id = s.channel_id
+        {where}
+        ORDER BY {OVERVIEW_SORTS[sort]}, s.channel_id
+        LIMIT ? OFFSET ?
+    ''', params + [limit, offset]).fetchall()
+
+    total = rows[0][-1] if rows else 0
+    return [ChannelOverviewRow(*row[:-1]) for row in rows], total
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from log_config import setup_logging
+    from storage import default_db_path
+
+    argv = sys.argv[1:] if argv is None else argv
+    setup_logging()
+    db_path = argv[0] if argv else default_db_path()
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        init_rollups(conn)
+        processed = refresh_rollups(conn)
+    finally:
+        conn.close()
+    logger.info("Агрегаты обновлены", extra=processed)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
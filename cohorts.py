@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Когортный анализ удержания
+
+Когорта — неделя (с понедельника) первой подписки пользователя на канал.
+Пользователь удержан на неделе k, если через k недель после подписки он еще
+не отписался (учитывается первая отписка после первой подписки). Клетка
+заполняется только по пользователям, для которых эти k недель уже прошли.
+
+Для канала хранится сжатое состояние в cohort_state: отсортированные ID,
+время первой подписки и первой отписки каждого пользователя и последний
+учтенный id изменений. Обновление читает только новые изменения и сливает
+их с состоянием операциями над массивами; матрица строится из состояния
+одним проходом (bincount + накопленная сумма).
+
+Запуск: python cohorts.py channel [--weeks 26] [--output cohorts.parquet]
+"""
+
+import sys
+import zlib
+import logging
+import argparse
+import calendar
+import sqlite3
+from datetime import datetime
+from typing import TYPE_CHECKING, List, NamedTuple, Optional
+
+import numpy as np
+
+from member_ids import ID_DTYPE, pack_ids, unpack_ids
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DAY_SECONDS = 86400
+WEEK_SECONDS = 7 * DAY_SECONDS
+# 1970-01-01 — четверг: сдвиг делает началом недели понедельник
+EPOCH_WEEKDAY = 3
+NO_LEAVE = np.iinfo(np.int64).max
+# Таблицы изменений, по которым строятся когорты
+COHORT_SOURCES = ('member_changes', 'real_time_changes')
+
+
+class CohortState(NamedTuple):
+    """Первая подписка и первая отписка после нее для каждого пользователя канала"""
+    user_ids: np.ndarray
+    first_join: np.ndarray
+    first_leave: np.ndarray
+    last_change_id: int
+
+
+class CohortMatrix(NamedTuple):
+    """Неделя когорты × недель удержания
+
+    retained[c, k] — удержанные на неделе k, observable[c, k] — пользователи
+    когорты c, для которых прошло k недель.
+    """
+    cohorts: np.ndarray
+    retained: np.ndarray
+    observable: np.ndarray
+
+    @property
+    def sizes(self) -> np.ndarray:
+        return self.observable[:, 0] if self.observable.size else np.zeros(0, dtype=np.int64)
+
+    def rates(self) -> np.ndarray:
+        """Доля удержанных; NaN там, где неделя еще не наступила"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.observable > 0, self.retained / np.maximum(self.observable, 1), np.nan)
+
+    def pooled_rate(self, week: int) -> Optional[float]:
+        """Удержание на неделе week по всем когортам, для которых она наступила"""
+        if week >= self.observable.shape[1]:
+            return None
+        observable = int(self.observable[:, week].sum())
+        return int(self.retained[:, week].sum()) / observable if observable else None
+
+
+def empty_state() -> CohortState:
+    empty = np.empty(0, dtype=np.int64)
+    return CohortState(empty.astype(ID_DTYPE), empty, empty, 0)
+
+
+def init_cohorts(conn):
+    """Таблица состояния когорт (вызывается из init_database сборщика)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS cohort_state (
+            channel_id INTEGER,
+            source TEXT,
+            last_change_id INTEGER,
+            user_ids BLOB,
+            first_join BLOB,
+            first_leave BLOB,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (channel_id, source)
+        )
+    ''')
+
+
+def pack_times(values: np.ndarray) -> bytes:
+    # Времена сжимаются слабо: быстрый уровень почти не уступает по размеру
+    return zlib.compress(values.astype('<i8').tobytes(), 1)
+
+
+def unpack_times(blob: bytes) -> np.ndarray:
+    return np.frombuffer(zlib.decompress(blob), dtype='<i8').astype(np.int64) if blob else np.empty(0, dtype=np.int64)
+
+
+def to_timestamp(moment: datetime) -> int:
+    """Секунды эпохи для наивного времени так же, как strftime('%s') в SQLite"""
+    return calendar.timegm(moment.timetuple())
+
+
+def week_of(timestamps: np.ndarray) -> np.ndarray:
+    """Номер недели (с понедельника) от начала эпохи"""
+    return (timestamps // DAY_SECONDS + EPOCH_WEEKDAY) // 7
+
+
+def summarize_events(user_ids: np.ndarray, times: np.ndarray, joined: np.ndarray) -> CohortState:
+    """Первая подписка и первая отписка после нее по событиям (в любом порядке)"""
+    order = np.lexsort((times, user_ids))
+    user_ids, times, joined = user_ids[order], times[order], joined[order]
+
+    # Первая подписка: после сортировки по (пользователь, время) — первое вхождение пользователя
+    users, first = np.unique(user_ids[joined], return_index=True)
+    first_join = times[joined][first]
+
+    # Отписки пользователей без подписки (подписались до начала наблюдения) не учитываются
+    first_leave = np.full(len(users), NO_LEAVE, dtype=np.int64)
+    leave_users, leave_times = user_ids[~joined], times[~joined]
+    position = np.searchsorted(users, leave_users)
+    known = position < len(users)
+    known[known] = users[position[known]] == leave_users[known]
+    after_join = np.zeros(len(leave_users), dtype=bool)
+    after_join[known] = leave_times[known] >= first_join[position[known]]
+    leave_positions, first = np.unique(position[after_join], return_index=True)
+    first_leave[leave_positions] = leave_times[after_join][first]
+    return CohortState(users.astype(ID_DTYPE), first_join, first_leave, 0)
+
+
+def merge_state(state: CohortState, user_ids: np.ndarray, times: np.ndarray, joined: np.ndarray,
+                last_change_id: int) -> CohortState:
+    """Добавление новых изменений к состоянию
+
+    Для известных пользователей важна только первая отписка после подписки,
+    новые пользователи сводятся отдельно и вставляются по позициям, поэтому
+    стоимость зависит от числа новых изменений, а не от размера канала.
+    Результат тот же, что при пересчете по всей истории, если новые изменения
+    не старше уже учтенных (id изменений растут вместе со временем записи).
+    """
+    position = np.searchsorted(state.user_ids, user_ids)
+    known = position < len(state.user_ids)
+    known[known] = state.user_ids[position[known]] == user_ids[known]
+
+    first_leave = state.first_leave.copy()
+    leaves = known & ~joined
+    leaves[leaves] = (first_leave[position[leaves]] == NO_LEAVE) & (times[leaves] >= state.first_join[position[leaves]])
+    # У отобранных пользователей first_leave == NO_LEAVE: минимум дает первую отписку
+    np.minimum.at(first_leave, position[leaves], times[leaves])
+
+    fresh = summarize_events(user_ids[~known], times[~known], joined[~known])
+    at = np.searchsorted(state.user_ids, fresh.user_ids)
+    return CohortState(
+        np.insert(state.user_ids, at, fresh.user_ids),
+        np.insert(state.first_join, at, fresh.first_join),
+        np.insert(first_leave, at, fresh.first_leave),
+        last_change_id,
+    )
+
+
+def load_state(conn, channel_id: int, source: str) -> CohortState:
+    row = conn.execute('''
+        SELECT user_ids, first_join, first_leave, last_change_id FROM cohort_state
+        WHERE channel_id = ? AND source = ?
+    ''', (channel_id, source)).fetchone()
+    if row is None:
+        return empty_state()
+    return CohortState(unpack_ids(row[0]), unpack_times(row[1]), unpack_times(row[2]), row[3])
+
+
+def save_state(conn, channel_id: int, source: str, state: CohortState):
+    conn.execute('''
+        INSERT INTO cohort_state (channel_id, source, last_change_id, user_ids, first_join, first_leave, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(channel_id, source) DO UPDATE SET
+            last_change_id = excluded.last_change_id,
+            user_ids = excluded.user_ids,
+            first_join = excluded.first_join,
+            first_leave = excluded.first_leave,
+            updated_at = excluded.updated_at
+    ''', (channel_id, source, state.last_change_id, pack_ids(state.user_ids),
+          pack_times(state.first_join), pack_times(state.first_leave), datetime.now()))
+
+
+def update_cohort_state(conn, channel_id: int, source: str = 'member_changes') -> CohortState:
+    """Состояние когорт канала с учетом изменений, записанных после прошлого обновления"""
+    if source not in COHORT_SOURCES:
+        raise ValueError(f"Неизвестный источник изменений: {source}")
+    init_cohorts(conn)
+    state = load_state(conn, channel_id, source)
+    # Граница фиксируется заранее: строки, записанные во время чтения, войдут в следующее обновление
+    end = conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {source}').fetchone()[0]
+    if end <= state.last_change_id:
+        return state
+
+    rows = conn.execute(f'''
+        SELECT user_id, CAST(strftime('%s', change_date) AS INTEGER), change_type = 'joined'
+        FROM {source}
+        WHERE channel_id = ? AND id > ? AND id <= ? AND change_date IS NOT NULL
+    ''', (channel_id, state.last_change_id, end)).fetchall()
+    if rows or not len(state.user_ids):
+        events = np.array(rows, dtype=np.int64).reshape(-1, 3)
+        state = merge_state(state, events[:, 0], events[:, 1], events[:, 2].astype(bool), end)
+        save_state(conn, channel_id, source, state)
+    else:
+        # Новые изменения только в других каналах: состояние не перепаковывается
+        state = state._replace(last_change_id=end)
+        conn.execute('UPDATE cohort_state SET last_change_id = ? WHERE channel_id = ? AND source = ?',
+                     (end, channel_id, source))
+    conn.commit()
+    logger.info("Когорты канала обновлены", extra={'channel_id': channel_id, 'changes': len(rows),
+                                                    'users': len(state.user_ids)})
+    return state
+
+
+def cohort_matrix(state: CohortState, now: Optional[datetime] = None, max_weeks: Optional[int] = None,
+                  since: Optional[datetime] = None) -> CohortMatrix:
+    """Матрица удержания по состоянию когорт
+
+    max_weeks ограничивает число столбцов, since — первую когорту.
+    """
+    now_ts = to_timestamp(now or datetime.now())
+    first_join, first_leave = state.first_join, state.first_leave
+    keep = first_join <= now_ts
+    if since is not None:
+        keep &= first_join >= to_timestamp(since)
+    first_join, first_leave = first_join[keep], first_leave[keep]
+    if not len(first_join):
+        empty = np.zeros((0, 1), dtype=np.int64)
+        return CohortMatrix(np.empty(0, dtype='datetime64[D]'), empty, empty)
+
+    cohort = week_of(first_join)
+    first_week = int(cohort.min())
+    rows = int(cohort.max()) - first_week + 1
+    # Прошедшие полные недели с подписки и недели до отписки
+    observed = (now_ts - first_join) // WEEK_SECONDS
+    stayed = np.where(first_leave == NO_LEAVE, observed, (first_leave - first_join) // WEEK_SECONDS)
+    retained = np.minimum(stayed, observed)
+    weeks = int(observed.max()) + 1 if max_weeks is None else max_weeks + 1
+
+    def counts(last_week: np.ndarray) -> np.ndarray:
+        # Пользователь учитывается в столбцах 0..last_week: гистограмма и накопленная сумма справа налево
+        index = (cohort - first_week) * weeks + np.minimum(last_week, weeks - 1)
+        histogram = np.bincount(index, minlength=rows * weeks).reshape(rows, weeks)
+        return np.cumsum(histogram[:, ::-1], axis=1)[:, ::-1]
+
+    starts = (np.arange(first_week, first_week + rows) * 7 - EPOCH_WEEKDAY).astype('datetime64[D]')
+    return CohortMatrix(starts, counts(retained), counts(observed))
+
+
+def cohort_frame(matrix: CohortMatrix) -> 'pd.DataFrame':
+    """Таблица для панели и выгрузки: когорта, размер, удержание по неделям (доли)"""
+    import pandas as pd
+
+    rates = matrix.rates()
+    df = pd.DataFrame(rates.round(4), columns=[f'week_{week}' for week in range(rates.shape[1])])
+    df.insert(0, 'users', matrix.sizes)
+    df.insert(0, 'cohort', pd.to_datetime(matrix.cohorts))
+    # Пустые недели между когортами не показываются
+    return df[df['users'] > 0].reset_index(drop=True)
+
+
+def export_cohorts(matrix: CohortMatrix, filename: str) -> str:
+    """Выгрузка в Parquet (.parquet, нужен pyarrow) или CSV"""
+    df = cohort_frame(matrix)
+    if filename.endswith('.parquet'):
+        try:
+            df.to_parquet(filename, index=False)
+        except ImportError as e:
+            raise ImportError("Для выгрузки в Parquet установите пакет pyarrow") from e
+    else:
+        df.to_csv(filename, index=False, encoding='utf-8')
+    logger.info("Когорты выгружены: %s", filename)
+    return filename
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    from storage import default_db_path
+
+    parser = argparse.ArgumentParser(description='Когортный анализ удержания подписчиков')
+    parser.add_argument('channel', help='username канала')
+    parser.add_argument('--db', default=default_db_path(), help='база SQLite монитора и сборщика')
+    parser.add_argument('--source', choices=COHORT_SOURCES, default='member_changes', help='таблица изменений')
+    parser.add_argument('--weeks', type=int, default=26, help='столбцов удержания')
+    parser.add_argument('--output', help='файл .parquet или .csv (по умолчанию вывод в консоль)')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from log_config import setup_logging
+    from channel_rollups import resolve_channel_id
+
+    args = parse_args(argv)
+    setup_logging()
+    conn = sqlite3.connect(args.db, timeout=30)
+    try:
+        channel_id = resolve_channel_id(conn, args.channel)
+        if channel_id is None:
+            print(f"Канал {args.channel} не найден", file=sys.stderr)
+            return 1
+        matrix = cohort_matrix(update_cohort_state(conn, channel_id, args.source), max_weeks=args.weeks)
+    finally:
+        conn.close()
+
+    if args.output:
+        export_cohorts(matrix, args.output)
+    else:
+        print(cohort_frame(matrix).to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
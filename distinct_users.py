@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Приблизительный подсчет уникальных пользователей (HyperLogLog)
+
+Для каждого канала, дня и типа изменения в channel_daily_hll хранится
+HyperLogLog-скетч из 2**HLL_PRECISION регистров (сжатых zlib: в тихие дни
+почти все регистры нулевые). Монитор обновляет скетчи в той же транзакции,
+что и записанные изменения. Скетчи объединяются поэлементным максимумом,
+а channel_monthly_hll хранит их объединение по месяцам: «уникальные
+подписчики любого из 50 каналов за квартал» — это максимум по 150 месячным
+скетчам без чтения сырых строк. Ошибка около 1.04 / sqrt(2**HLL_PRECISION),
+то есть ~1.6%.
+
+Повторное добавление пользователя скетч не меняет, поэтому перестроение
+по истории (--backfill) можно запускать поверх уже собранных скетчей.
+
+Запуск: python distinct_users.py [channel ...] [--since 2024-07-01] [--until 2024-09-30] [--type left]
+"""
+
+import sys
+import zlib
+import logging
+import argparse
+import sqlite3
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from member_ids import mix64
+
+logger = logging.getLogger(__name__)
+
+HLL_PRECISION = 12
+HLL_REGISTERS = 1 << HLL_PRECISION
+# Соль хеша: регистры не коррелируют с корзинами MinHash по тем же ID
+HLL_SEED = 0x5851F42D4C957F2D
+BACKFILL_BATCH_ROWS = 200_000
+
+
+def init_sketches(conn):
+    """Таблица скетчей (вызывается из init_database монитора)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS channel_daily_hll (
+            channel_id INTEGER,
+            day TEXT,
+            change_type TEXT,
+            registers BLOB,
+            PRIMARY KEY (channel_id, day, change_type)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_channel_daily_hll_day ON channel_daily_hll (change_type, day)')
+    # Объединение дневных скетчей по месяцам: длинный период читает месяцы целиком
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS channel_monthly_hll (
+            channel_id INTEGER,
+            month TEXT,
+            change_type TEXT,
+            registers BLOB,
+            PRIMARY KEY (channel_id, month, change_type)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_channel_monthly_hll_month ON channel_monthly_hll (change_type, month)')
+
+
+def bit_length(values: np.ndarray) -> np.ndarray:
+    """Число значащих бит для uint64 (через 32-битные половины, точно в float64)"""
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(high > 0, 32 + np.frexp(high)[1], np.frexp(low)[1])
+
+
+def register_updates(user_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(номер регистра, ранг) для каждого ID"""
+    hashes = mix64(user_ids, HLL_SEED)
+    width = 64 - HLL_PRECISION
+    index = (hashes >> np.uint64(width)).astype(np.intp)
+    rest = hashes & np.uint64((1 << width) - 1)
+    # Ранг — позиция первой единицы в оставшихся битах
+    rank = (width - bit_length(rest) + 1).astype(np.uint8)
+    return index, rank
+
+
+def add_users(registers: np.ndarray, user_ids: np.ndarray) -> np.ndarray:
+    """Добавление ID в скетч (на месте)"""
+    if len(user_ids):
+        index, rank = register_updates(np.asarray(user_ids, dtype=np.int64))
+        np.maximum.at(registers, index, rank)
+    return registers
+
+
+def empty_registers() -> np.ndarray:
+    return np.zeros(HLL_REGISTERS, dtype=np.uint8)
+
+
+def pack_registers(registers: np.ndarray) -> bytes:
+    return zlib.compress(registers.tobytes(), 1)
+
+
+def unpack_registers(blob: bytes) -> np.ndarray:
+    return np.frombuffer(zlib.decompress(blob), dtype=np.uint8)
+
+
+def estimate(registers: np.ndarray) -> float:
+    """Оценка числа уникальных ID по регистрам"""
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int64)))
+    zeros = int(np.count_nonzero(registers == 0))
+    # Малые значения точнее считаются по доле пустых регистров
+    if raw <= 2.5 * m and zeros:
+        return m * np.log(m / zeros)
+    return float(raw)
+
+
+def merge_sketches(conn, table: str, period: str, groups: Dict[Tuple[int, str, str], List[int]]) -> int:
+    """Добавление ID в скетчи таблицы; перезаписываются только изменившиеся"""
+    updates = []
+    for (channel_id, key, change_type), user_ids in groups.items():
+        row = conn.execute(
+            f'SELECT registers FROM {table} WHERE channel_id = ? AND {period} = ? AND change_type = ?',
+            (channel_id, key, change_type)
+        ).fetchone()
+        registers = unpack_registers(row[0]).copy() if row else empty_registers()
+        before = registers.copy() if row else None
+        add_users(registers, np.array(user_ids, dtype=np.int64))
+        # Пользователи уже учтены: скетч не перезаписывается
+        if before is not None and np.array_equal(before, registers):
+            continue
+        updates.append((channel_id, key, change_type, pack_registers(registers)))
+    conn.executemany(f'''
+        INSERT INTO {table} (channel_id, {period}, change_type, registers) VALUES (?, ?, ?, ?)
+        ON CONFLICT(channel_id, {period}, change_type) DO UPDATE SET registers = excluded.registers
+    ''', updates)
+    return len(updates)
+
+
+def update_sketches(conn, changes: Iterable[Tuple[int, str, str, int]]) -> int:
+    """Добавление изменений (channel_id, 'YYYY-MM-DD', change_type, user_id) в скетчи
+
+    Транзакцией управляет вызывающий код. Возвращает число обновленных дневных скетчей.
+    """
+    days: Dict[Tuple[int, str, str], List[int]] = {}
+    months: Dict[Tuple[int, str, str], List[int]] = {}
+    for channel_id, day, change_type, user_id in changes:
+        days.setdefault((channel_id, day, change_type), []).append(user_id)
+        months.setdefault((channel_id, day[:7], change_type), []).append(user_id)
+    merge_sketches(conn, 'channel_monthly_hll', 'month', months)
+    return merge_sketches(conn, 'channel_daily_hll', 'day', days)
+
+
+def split_period(since: date, until: date) -> Tuple[List[Tuple[date, date]], Optional[Tuple[str, str]]]:
+    """Дни по краям периода и диапазон месяцев, вошедших в него целиком"""
+    first_month = since if since.day == 1 else (since.replace(day=28) + timedelta(days=4)).replace(day=1)
+    after_last = until + timedelta(days=1)
+    end_month = after_last.replace(day=1)
+    if first_month >= end_month:
+        return [(since, until)], None
+    edges = [(since, first_month - timedelta(days=1)), (end_month, until)]
+    last_month = end_month - timedelta(days=1)
+    return [(start, end) for start, end in edges if start <= end], (first_month.strftime('%Y-%m'), last_month.strftime('%Y-%m'))
+
+
+def merged_registers(conn, channel_ids: Optional[Sequence[int]] = None, since: Optional[date] = None,
+                     until: Optional[date] = None, change_type: str = 'joined') -> np.ndarray:
+    """Объединение скетчей каналов за дни [since, until]
+
+    Месяцы, вошедшие в период целиком, берутся из channel_monthly_hll,
+    остальные дни — из channel_daily_hll.
+    """
+    channel_filter, channel_params = '', []
+    if channel_ids is not None:
+        channel_filter = f" AND channel_id IN ({', '.join('?' * len(channel_ids))})" if channel_ids else ' AND 0'
+        channel_params = list(channel_ids)
+
+    if since is None or until is None:
+        first, last = conn.execute(
+            'SELECT MIN(day), MAX(day) FROM channel_daily_hll WHERE change_type = ?', (change_type,)).fetchone()
+        if first is None:
+            return empty_registers()
+        since = since or date.fromisoformat(first)
+        until = until or date.fromisoformat(last)
+    if since > until:
+        return empty_registers()
+
+    days, months = split_period(since, until)
+    queries = [(f'SELECT registers FROM channel_daily_hll WHERE change_type = ? AND day BETWEEN ? AND ?{channel_filter}',
+                [change_type, str(start), str(end)] + channel_params) for start, end in days]
+    if months:
+        queries.append((f'SELECT registers FROM channel_monthly_hll WHERE change_type = ? AND month BETWEEN ? AND ?{channel_filter}',
+                        [change_type, *months] + channel_params))
+
+    blobs = [zlib.decompress(blob) for query, params in queries for (blob,) in conn.execute(query, params)]
+    if not blobs:
+        return empty_registers()
+    # Одна операция максимума по матрице скетчей
+    return np.frombuffer(b''.join(blobs), dtype=np.uint8).reshape(len(blobs), HLL_REGISTERS).max(axis=0)
+
+
+def distinct_users(conn, channel_ids: Optional[Sequence[int]] = None, since: Optional[date] = None,
+                   until: Optional[date] = None, change_type: str = 'joined') -> int:
+    """Приблизительное число уникальных пользователей с изменением change_type"""
+    return int(round(estimate(merged_registers(conn, channel_ids, since, until, change_type))))
+
+
+def backfill_sketches(conn, source: str = 'real_time_changes') -> int:
+    """Построение скетчей по уже записанным изменениям; возвращает число строк"""
+    init_sketches(conn)
+    cursor = conn.execute(f'SELECT channel_id, DATE(change_date), change_type, user_id FROM {source}')
+    processed = 0
+    while True:
+        rows = cursor.fetchmany(BACKFILL_BATCH_ROWS)
+        if not rows:
+            break
+        update_sketches(conn, rows)
+        processed += len(rows)
+    conn.commit()
+    logger.info("Скетчи уникальных пользователей построены", extra={'source': source, 'rows': processed})
+    return processed
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    from storage import default_db_path
+
+    parser = argparse.ArgumentParser(description='Уникальные пользователи по каналам и периодам (оценка HyperLogLog)')
+    parser.add_argument('channels', nargs='*', help='username каналов (по умолчанию все)')
+    parser.add_argument('--db', default=default_db_path(), help='база SQLite монитора')
+    parser.add_argument('--since', type=date.fromisoformat, help='первый день, YYYY-MM-DD')
+    parser.add_argument('--until', type=date.fromisoformat, help='последний день, YYYY-MM-DD')
+    parser.add_argument('--type', dest='change_type', choices=('joined', 'left'), default='joined')
+    parser.add_argument('--backfill', action='store_true', help='построить скетчи по real_time_changes')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from log_config import setup_logging
+    from channel_rollups import resolve_channel_id
+
+    args = parse_args(argv)
+    setup_logging()
+    conn = sqlite3.connect(args.db, timeout=30)
+    try:
+        if args.backfill:
+            backfill_sketches(conn)
+        channel_ids = None
+        if args.channels:
+            channel_ids = [resolve_channel_id(conn, channel) for channel in args.channels]
+            missing = [channel for channel, channel_id in zip(args.channels, channel_ids) if channel_id is None]
+            if missing:
+                print(f"Каналы не найдены: {', '.join(missing)}", file=sys.stderr)
+                return 1
+        init_sketches(conn)
+        count = distinct_users(conn, channel_ids, args.since, args.until, args.change_type)
+    finally:
+        conn.close()
+    action = 'подписавшихся' if args.change_type == 'joined' else 'отписавшихся'
+    print(f"Уникальных {action}: ~{count:,}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+"""
+Прореживание временных рядов для графиков
+
+На график шириной в несколько сотен пикселей нет смысла передавать больше
+точек, чем пикселей: lttb оставляет заданное число точек, сохраняя форму ряда
+(пики и провалы), minmax_indices — минимум и максимум каждого интервала.
+"""
+
+import numpy as np
+
+# Точек на график: примерно по одной на пиксель ширины графика
+CHART_WIDTH_PX = 1200
+MAX_CHART_POINTS = CHART_WIDTH_PX // 2
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Индексы точек по алгоритму Largest-Triangle-Three-Buckets
+
+    Первая и последняя точки сохраняются всегда; из каждого промежуточного
+    интервала берется точка, образующая наибольший треугольник с выбранной
+    точкой предыдущего интервала и средним следующего.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax_indices(y: np.ndarray, buckets: int) -> np.ndarray:
+    """Индексы минимума и максимума в каждом из buckets равных интервалов"""
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n <= 2 * buckets:
+        return np.arange(n)
+
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    indices = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        chunk = y[start:end]
+        indices.extend((start + int(np.argmin(chunk)), start + int(np.argmax(chunk))))
+    return np.unique(indices)
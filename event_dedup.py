@@ -0,0 +1,52 @@
+"""
+Дедупликация повторно доставленных обновлений Telegram
+"""
+
+from collections import OrderedDict
+from typing import Optional
+
+
+def event_key(event) -> Optional[str]:
+    """Стабильный ключ обновления, одинаковый при повторной доставке
+
+    Приоритет: id служебного сообщения, затем qts и pts обновления. Без них
+    ключ не формируется (None) и событие записывается без дедупликации:
+    время с точностью до секунды склеило бы быстрые повторные подписки.
+    """
+    message = getattr(event, 'action_message', None)
+    if message is not None and getattr(message, 'id', None):
+        return f"msg:{message.id}"
+
+    update = getattr(event, 'original_update', None)
+    qts = getattr(update, 'qts', None)
+    if qts:
+        return f"qts:{qts}"
+    pts = getattr(update, 'pts', None)
+    if pts:
+        return f"pts:{pts}"
+    return None
+
+
+class RecentEventCache:
+    """Ограниченный кэш недавних событий с вытеснением самых старых
+
+    Проверка и добавление выполняются за O(1). Ключи добавляются
+    только после успешной записи события, поэтому проверка и добавление
+    разделены.
+    """
+
+    def __init__(self, maxsize: int = 100_000):
+        self.maxsize = maxsize
+        self.keys = OrderedDict()
+
+    def __contains__(self, key) -> bool:
+        return key is not None and key in self.keys
+
+    def add(self, key):
+        """Запоминание ключа с вытеснением самого старого при переполнении"""
+        self.keys[key] = None
+        if len(self.keys) > self.maxsize:
+            self.keys.popitem(last=False)
+
+    def __len__(self):
+        return len(self.keys)
@@ -1,16 +1,78 @@
 import sqlite3
-import pandas as pd
+import logging
 from datetime import datetime, timedelta
 import json
 import csv
 import os
+from typing import TYPE_CHECKING, Optional, Sequence
+from log_config import setup_logging
+from storage import default_db_path, AnalyticsReplica, DuckDBStorage, SQLiteStorage
+from channel_rollups import resolve_channel_id
+from cohorts import cohort_matrix, empty_state, update_cohort_state
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Выражение дня в формате 'YYYY-MM-DD' для каждого движка
+DAY_SQL = {
+    'sqlite': 'DATE({column})',
+    'duckdb': "strftime({column}, '%Y-%m-%d')",
+}
+
+SUMMARY_PERIODS = (7, 30, 90)
+# Недели после подписки, удержание на которых выводится в сводном отчете
+SUMMARY_RETENTION_WEEKS = (1, 4, 12)
 
 class DataExporter:
-    def __init__(self, db_path='telegram_stats.db'):
-        self.db_path = db_path
+    """Экспорт данных и отчетов
+
+    engine='sqlite' считает отчеты запросами к базе монитора, engine='duckdb' —
+    в колоночной копии (файл analytics_path, по умолчанию рядом с базой),
+    которая перед отчетом дополняется новыми строками. Результаты одинаковы.
+    """
+
+    def __init__(self, db_path=None, engine: str = 'sqlite', analytics_path: Optional[str] = None):
+        if engine not in DAY_SQL:
+            raise ValueError(f"Неизвестный движок: {engine}")
+        self.db_path = db_path or default_db_path()
+        self.engine = engine
+        self.analytics = None
+        if engine == 'duckdb':
+            self.analytics = DuckDBStorage(analytics_path or os.path.splitext(self.db_path)[0] + '.duckdb')
+
+    def prepare(self, channel_username: str) -> Optional[int]:
+        """ID канала; для DuckDB — перенос в копию строк, записанных после прошлого отчета"""
+        if self.analytics is not None:
+            AnalyticsReplica(SQLiteStorage(self.db_path), self.analytics).sync()
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return resolve_channel_id(conn, channel_username)
+        finally:
+            conn.close()
+
+    def read_sql(self, query: str, params: Sequence = ()) -> 'pd.DataFrame':
+        """Запрос выбранным движком; {day} в тексте заменяется выражением дня"""
+        import pandas as pd
+
+        query = query.replace('{day}', DAY_SQL[self.engine].format(column='change_date'))
+        if self.analytics is not None:
+            conn = self.analytics.connect(read_only=True)
+            try:
+                return conn.execute(query, list(params)).df()
+            finally:
+                conn.close()
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return pd.read_sql_query(query, conn, params=list(params))
+        finally:
+            conn.close()
     
     def export_members_to_csv(self, channel_username: str, filename: str = None):
         """Экспорт участников канала в CSV"""
+        import pandas as pd
+        
         if not filename:
             filename = f"members_{channel_username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
         
@@ -32,11 +94,13 @@ class DataExporter:
         conn.close()
         
         df.to_csv(filename, index=False, encoding='utf-8')
-        print(f"Данные экспортированы в {filename}")
+        logger.info("Данные экспортированы в %s", filename)
         return filename
     
     def export_changes_to_csv(self, channel_username: str, start_date: datetime, end_date: datetime, filename: str = None):
         """Экспорт изменений за период в CSV"""
+        import pandas as pd
+        
         if not filename:
             filename = f"changes_{channel_username}_{start_date.strftime('%Y%m%d')}_{end_date.strftime('%Y%m%d')}.csv"
         
@@ -58,7 +122,7 @@ class DataExporter:
         conn.close()
         
         df.to_csv(filename, index=False, encoding='utf-8')
-        print(f"Изменения экспортированы в {filename}")
+        logger.info("Изменения экспортированы в %s", filename)
         return filename
     
     def export_stats_to_json(self, channel_username: str, filename: str = None):
@@ -66,58 +130,52 @@ class DataExporter:
         if not filename:
             filename = f"stats_{channel_username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
         
-        conn = sqlite3.connect(self.db_path)
-        
-        # Общая статистика
-        total_members = pd.read_sql_query(
-            'SELECT COUNT(*) as count FROM channel_members WHERE is_active = 1', 
-            conn
-        ).iloc[0]['count']
+        channel_id = self.prepare(channel_username)
         
-        # Статистика за последние 30 дней
+        # Общая статистика и статистика за последние 30 дней
         thirty_days_ago = datetime.now() - timedelta(days=30)
-        new_members_30d = pd.read_sql_query(
-            'SELECT COUNT(*) as count FROM channel_members WHERE joined_date >= ? AND is_active = 1',
-            conn,
-            params=[thirty_days_ago]
-        ).iloc[0]['count']
-        
-        left_members_30d = pd.read_sql_query(
-            'SELECT COUNT(*) as count FROM member_changes WHERE change_type = "left" AND change_date >= ?',
-            conn,
-            params=[thirty_days_ago]
-        ).iloc[0]['count']
+        members = self.read_sql('''
+            SELECT
+                COUNT(*) as total,
+                CAST(COALESCE(SUM(CASE WHEN joined_date >= ? THEN 1 ELSE 0 END), 0) AS BIGINT) as new_members
+            FROM channel_members
+            WHERE channel_id = ? AND is_active
+        ''', [thirty_days_ago, channel_id]).iloc[0]
         
         # Статистика по дням
-        daily_stats = pd.read_sql_query('''
+        daily_stats = self.read_sql('''
             SELECT 
-                DATE(change_date) as date,
+                {day} as date,
                 change_type,
                 COUNT(*) as count
             FROM member_changes
-            WHERE change_date >= ?
-            GROUP BY DATE(change_date), change_type
-            ORDER BY date
-        ''', conn, params=[thirty_days_ago])
+            WHERE channel_id = ? AND change_date >= ?
+            GROUP BY {day}, change_type
+            ORDER BY date, change_type
+        ''', [channel_id, thirty_days_ago])
         
-        conn.close()
+        new_members_30d = int(members['new_members'])
+        left_members_30d = int(daily_stats.loc[daily_stats['change_type'] == 'left', 'count'].sum())
         
         stats = {
             'channel_username': channel_username,
             'export_date': datetime.now().isoformat(),
-            'total_members': total_members,
+            'total_members': int(members['total']),
             'last_30_days': {
                 'new_members': new_members_30d,
                 'left_members': left_members_30d,
                 'net_growth': new_members_30d - left_members_30d
             },
-            'daily_stats': daily_stats.to_dict('records')
+            'daily_stats': [
+                {'date': row.date, 'change_type': row.change_type, 'count': int(row.count)}
+                for row in daily_stats.itertuples(index=False)
+            ]
         }
         
         with open(filename, 'w', encoding='utf-8') as f:
             json.dump(stats, f, ensure_ascii=False, indent=2)
         
-        print(f"Статистика экспортирована в {filename}")
+        logger.info("Статистика экспортирована в %s", filename)
         return filename
     
     def export_growth_report(self, channel_username: str, days: int = 30, filename: str = None):
@@ -125,24 +183,21 @@ class DataExporter:
         if not filename:
             filename = f"growth_report_{channel_username}_{days}days_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
         
-        conn = sqlite3.connect(self.db_path)
-        
+        channel_id = self.prepare(channel_username)
         since_date = datetime.now() - timedelta(days=days)
         
         # Ежедневная статистика
-        daily_growth = pd.read_sql_query('''
+        daily_growth = self.read_sql('''
             SELECT 
-                DATE(change_date) as date,
-                SUM(CASE WHEN change_type = 'joined' THEN 1 ELSE 0 END) as joined,
-                SUM(CASE WHEN change_type = 'left' THEN 1 ELSE 0 END) as left,
-                SUM(CASE WHEN change_type = 'joined' THEN 1 ELSE -1 END) as net_change
+                {day} as date,
+                CAST(SUM(CASE WHEN change_type = 'joined' THEN 1 ELSE 0 END) AS BIGINT) as joined,
+                CAST(SUM(CASE WHEN change_type = 'left' THEN 1 ELSE 0 END) AS BIGINT) as "left",
+                CAST(SUM(CASE WHEN change_type = 'joined' THEN 1 ELSE -1 END) AS BIGINT) as net_change
             FROM member_changes
-            WHERE change_date >= ?
-            GROUP BY DATE(change_date)
+            WHERE channel_id = ? AND change_date >= ?
+            GROUP BY {day}
             ORDER BY date
-        ''', conn, params=[since_date])
-        
-        conn.close()
+        ''', [channel_id, since_date])
         
         # Добавляем кумулятивные значения
         daily_growth['cumulative_joined'] = daily_growth['joined'].cumsum()
@@ -150,52 +205,57 @@ class DataExporter:
         daily_growth['cumulative_net'] = daily_growth['net_change'].cumsum()
         
         daily_growth.to_csv(filename, index=False, encoding='utf-8')
-        print(f"Отчет о росте экспортирован в {filename}")
+        logger.info("Отчет о росте экспортирован в %s", filename)
         return filename
     
+    def cohort_matrix(self, channel_id: Optional[int], max_weeks: Optional[int] = None):
+        """Матрица удержания канала по member_changes"""
+        if channel_id is None:
+            return cohort_matrix(empty_state(), max_weeks=max_weeks)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            return cohort_matrix(update_cohort_state(conn, channel_id), max_weeks=max_weeks)
+        finally:
+            conn.close()
+
     def create_summary_report(self, channel_username: str, filename: str = None):
         """Создание сводного отчета"""
         if not filename:
             filename = f"summary_report_{channel_username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
         
-        conn = sqlite3.connect(self.db_path)
+        channel_id = self.prepare(channel_username)
+        now = datetime.now()
+        since = [now - timedelta(days=days) for days in SUMMARY_PERIODS]
         
-        # Общая статистика
-        total_members = pd.read_sql_query(
-            'SELECT COUNT(*) as count FROM channel_members WHERE is_active = 1', 
-            conn
-        ).iloc[0]['count']
+        # Все периоды считаются за один проход по каждой таблице
+        members = self.read_sql(f'''
+            SELECT
+                COUNT(*) as total,
+                {', '.join(f"CAST(COALESCE(SUM(CASE WHEN joined_date >= ? THEN 1 ELSE 0 END), 0) AS BIGINT) as new_{days}" for days in SUMMARY_PERIODS)}
+            FROM channel_members
+            WHERE channel_id = ? AND is_active
+        ''', since + [channel_id]).iloc[0]
+        left = self.read_sql(f'''
+            SELECT
+                {', '.join(f"CAST(COALESCE(SUM(CASE WHEN change_date >= ? THEN 1 ELSE 0 END), 0) AS BIGINT) as left_{days}" for days in SUMMARY_PERIODS)}
+            FROM member_changes
+            WHERE channel_id = ? AND change_type = 'left' AND change_date >= ?
+        ''', since + [channel_id, min(since)]).iloc[0]
         
-        # Статистика за разные периоды
-        periods = [7, 30, 90]
+        total_members = int(members['total'])
         period_stats = {}
-        
-        for days in periods:
-            since_date = datetime.now() - timedelta(days=days)
-            new_members = pd.read_sql_query(
-                'SELECT COUNT(*) as count FROM channel_members WHERE joined_date >= ? AND is_active = 1',
-                conn,
-                params=[since_date]
-            ).iloc[0]['count']
-            
-            left_members = pd.read_sql_query(
-                'SELECT COUNT(*) as count FROM member_changes WHERE change_type = "left" AND change_date >= ?',
-                conn,
-                params=[since_date]
-            ).iloc[0]['count']
-            
+        for days in SUMMARY_PERIODS:
+            new_members, left_members = int(members[f'new_{days}']), int(left[f'left_{days}'])
             period_stats[days] = {
                 'new': new_members,
                 'left': left_members,
                 'net': new_members - left_members
             }
         
-        conn.close()
-        
         # Создание отчета
         report = f"""
 СВОДНЫЙ ОТЧЕТ ПО КАНАЛУ @{channel_username}
-Дата создания: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+Дата создания: {now.strftime('%Y-%m-%d %H:%M:%S')}
 
 ОБЩАЯ СТАТИСТИКА:
 - Всего участников: {total_members:,}
@@ -203,7 +263,7 @@ class DataExporter:
 СТАТИСТИКА ЗА ПОСЛЕДНИЕ ПЕРИОДЫ:
 """
         
-        for days in periods:
+        for days in SUMMARY_PERIODS:
             stats = period_stats[days]
             report += f"""
 За последние {days} дней:
@@ -212,20 +272,30 @@ class DataExporter:
 - Чистый прирост: {stats['net']:,}
 """
         
+        month = period_stats[30]
+        retention = f"{(month['new'] - month['left']) / month['new'] * 100:.1f}%" if month['new'] else 'н/д'
         report += f"""
 РЕКОМЕНДАЦИИ:
-- Средний прирост в день: {period_stats[30]['net'] / 30:.1f}
-- Коэффициент удержания: {(period_stats[30]['new'] - period_stats[30]['left']) / period_stats[30]['new'] * 100:.1f}%
+- Средний прирост в день: {month['net'] / 30:.1f}
+- Коэффициент удержания: {retention}
 """
         
+        # Удержание по недельным когортам (состояние когорт хранится в базе монитора)
+        matrix = self.cohort_matrix(channel_id, max_weeks=max(SUMMARY_RETENTION_WEEKS))
+        report += "\nУДЕРЖАНИЕ ПО КОГОРТАМ (доля подписавшихся, оставшихся через N недель):\n"
+        for week in SUMMARY_RETENTION_WEEKS:
+            rate = matrix.pooled_rate(week)
+            report += f"- Через {week} нед.: {'н/д' if rate is None else f'{rate * 100:.1f}%'}\n"
+        
         with open(filename, 'w', encoding='utf-8') as f:
             f.write(report)
         
-        print(f"Сводный отчет создан: {filename}")
+        logger.info("Сводный отчет создан: %s", filename)
         return filename
 
 def main():
     """Пример использования экспортера"""
+    setup_logging()
     exporter = DataExporter()
     
     # Пример экспорта данных
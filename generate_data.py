@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Генератор синтетической базы telegram_stats.db для нагрузочных проверок
+
+Заполняет все таблицы сборщика и монитора: участники, изменения, снимки,
+сохраненный состав, справочник каналов и агрегаты. Размеры каналов
+распределены логнормально, события имеют суточную и недельную сезонность и
+всплески. Результат воспроизводим при одинаковом --seed.
+
+Запуск: python generate_data.py --db bench.db --size 500MB --seed 1
+"""
+
+import os
+import re
+import sys
+import sqlite3
+import logging
+import argparse
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from member_ids import pack_ids
+from channel_rollups import refresh_rollups
+from log_config import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# Примерный объем строки на диске (байт, с учетом индексов), для пересчета --size в число строк
+MEMBER_ROW_BYTES = 110
+MEMBER_CHANGE_ROW_BYTES = 115
+REAL_TIME_CHANGE_ROW_BYTES = 140
+
+# Доли объема базы по таблицам
+MEMBERS_SHARE = 0.4
+MEMBER_CHANGES_SHARE = 0.2
+REAL_TIME_CHANGES_SHARE = 0.35
+
+# Средний размер канала при автоматическом выборе числа каналов
+AVERAGE_CHANNEL_SIZE = 2000
+
+# Относительная активность по часам суток (пик вечером) и дням недели (пн..вс)
+HOUR_WEIGHTS = np.array([2, 1, 1, 1, 1, 1, 2, 4, 6, 7, 7, 7, 8, 8, 7, 7, 8, 9, 11, 13, 14, 12, 8, 4], dtype=float)
+WEEKDAY_WEIGHTS = np.array([1.0, 1.0, 1.0, 1.0, 0.95, 0.8, 0.85])
+
+FIRST_NAMES = ['Анна', 'Иван', 'Мария', 'Алексей', 'Елена', 'Дмитрий', 'Ольга', 'Сергей', 'Alex', 'Maria']
+LAST_NAMES = [None, None, 'Иванов', 'Петрова', 'Smith', 'Сидоров']
+
+CHUNK_ROWS = 200_000
+MICROSECONDS_PER_DAY = 86_400 * 1_000_000
+MICROSECONDS_PER_HOUR = 3_600 * 1_000_000
+
+
+def parse_size(text: str) -> int:
+    """Размер вида 10MB, 1.5GB, 200K в байтах"""
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMG]?)B?\s*', text.upper())
+    if not match:
+        raise ValueError(f"Неверный размер: {text}")
+    number, unit = match.groups()
+    return int(float(number) * {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}[unit])
+
+
+def plan_rows(size_bytes: int) -> Tuple[int, int, int]:
+    """Число участников, строк member_changes и real_time_changes для целевого размера"""
+    return (
+        int(size_bytes * MEMBERS_SHARE / MEMBER_ROW_BYTES),
+        int(size_bytes * MEMBER_CHANGES_SHARE / MEMBER_CHANGE_ROW_BYTES),
+        int(size_bytes * REAL_TIME_CHANGES_SHARE / REAL_TIME_CHANGE_ROW_BYTES),
+    )
+
+
+def split_total(rng: np.random.Generator, total: int, weights: np.ndarray) -> np.ndarray:
+    """Целочисленное разбиение total пропорционально весам (сумма сохраняется)"""
+    return rng.multinomial(total, weights / weights.sum())
+
+
+def channel_sizes(rng: np.random.Generator, num_channels: int, total_members: int) -> np.ndarray:
+    """Логнормальные размеры каналов: немного крупных, много мелких"""
+    weights = rng.lognormal(mean=0.0, sigma=1.5, size=num_channels)
+    return np.maximum(split_total(rng, total_members, weights), 1)
+
+
+def day_weights(rng: np.random.Generator, start: datetime, days: int) -> np.ndarray:
+    """Активность канала по дням: недельный цикл, шум, рост и редкие всплески"""
+    weekdays = (start.weekday() + np.arange(days)) % 7
+    weights = WEEKDAY_WEIGHTS[weekdays] * rng.lognormal(0.0, 0.3, days) * np.linspace(0.7, 1.3, days)
+    bursts = rng.random(days) < 0.03
+    weights[bursts] *= rng.uniform(5, 30, bursts.sum())
+    return weights / weights.sum()
+
+
+def event_times(rng: np.random.Generator, count: int, start: datetime, weights: np.ndarray) -> np.ndarray:
+    """Отсортированные моменты событий (datetime64[us]) с суточной сезонностью"""
+    day = rng.choice(len(weights), size=count, p=weights)
+    hour = rng.choice(24, size=count, p=HOUR_WEIGHTS / HOUR_WEIGHTS.sum())
+    offset = (day * MICROSECONDS_PER_DAY + hour * MICROSECONDS_PER_HOUR
+              + rng.integers(0, MICROSECONDS_PER_HOUR, size=count))
+    offset.sort()
+    return np.datetime64(start, 'us') + offset.astype('timedelta64[us]')
+
+
+def to_sql_dates(times: np.ndarray) -> List[str]:
+    """Даты в формате, в котором sqlite3 сохраняет datetime"""
+    return np.char.replace(np.datetime_as_string(times, unit='us'), 'T', ' ').tolist()
+
+
+def chunks(count: int) -> Iterator[Tuple[int, int]]:
+    for begin in range(0, count, CHUNK_ROWS):
+        yield begin, min(begin + CHUNK_ROWS, count)
+
+
+class SyntheticDataGenerator:
+    """Пакетная загрузка синтетических данных в базу сборщика и монитора"""
+
+    def __init__(self, db_path: str, seed: int = 0, days: int = 180, end_date: Optional[datetime] = None):
+        self.db_path = db_path
+        self.rng = np.random.default_rng(seed)
+        self.days = days
+        end_date = end_date or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.start_date = end_date - timedelta(days=days)
+        self.next_message_id = 1
+
+    def create_schema(self):
+        """Таблицы создаются теми же init_database, что и в приложении"""
+        from stats_collector import StatsCollector
+        from telegram_monitor import TelegramChannelMonitor
+
+        for cls in (StatsCollector, TelegramChannelMonitor):
+            owner = cls.__new__(cls)
+            owner.db_path = self.db_path
+            owner.init_database()
+
+    def connect(self) -> sqlite3.Connection:
+        """Соединение для массовой загрузки: без журнала и fsync"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('PRAGMA journal_mode=OFF')
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.execute('PRAGMA cache_size=-262144')
+        conn.execute('PRAGMA locking_mode=EXCLUSIVE')
+        return conn
+
+    def generate(self, total_members: int, member_change_rows: int, real_time_rows: int,
+                 num_channels: Optional[int] = None) -> dict:
+        """Заполнение всех таблиц; возвращает число строк по таблицам"""
+        self.create_schema()
+        num_channels = num_channels or max(1, total_members // AVERAGE_CHANNEL_SIZE)
+        sizes = channel_sizes(self.rng, num_channels, total_members)
+        channel_ids = 1_000_000_000 + np.arange(num_channels, dtype=np.int64) * 7
+        # Аудитории каналов пересекаются: пользователи берутся из общего пула
+        user_pool = max(int(sizes.sum() * 0.6), 1)
+
+        # Активность канала пропорциональна размеру с шумом
+        activity = sizes * self.rng.lognormal(0.0, 0.5, num_channels)
+        change_counts = split_total(self.rng, member_change_rows, activity)
+        real_time_counts = split_total(self.rng, real_time_rows, activity)
+
+        conn = self.connect()
+        try:
+            # Индексы строятся один раз после загрузки
+            for (index_name,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"
+            ).fetchall():
+                conn.execute(f'DROP INDEX {index_name}')
+            counts = {'channel_members': 0, 'member_changes': 0, 'real_time_changes': 0,
+                      'channel_snapshots': 0, 'member_state': 0, 'channels': 0}
+
+            for index, channel_id in enumerate(channel_ids.tolist()):
+                weights = day_weights(self.rng, self.start_date, self.days)
+                members = np.unique(self.rng.integers(1, user_pool + 1, size=int(sizes[index])))
+                counts['channel_members'] += self.insert_members(conn, channel_id, members, weights)
+                counts['member_changes'] += self.insert_member_changes(
+                    conn, channel_id, members, int(change_counts[index]), weights, user_pool)
+                counts['real_time_changes'] += self.insert_real_time_changes(
+                    conn, channel_id, members, int(real_time_counts[index]), weights, user_pool)
+                counts['channel_snapshots'] += self.insert_snapshots(conn, channel_id, len(members), weights)
+                counts['member_state'] += self.insert_member_state(conn, channel_id, members)
+                counts['channels'] += self.insert_channel(conn, channel_id)
+                conn.commit()
+
+                if (index + 1) % 100 == 0 or index + 1 == num_channels:
+                    logger.info("Сгенерировано каналов: %s из %s", index + 1, num_channels, extra=counts)
+
+        finally:
+            conn.close()
+
+        # Индексы и агрегаты обзорной панели строятся по загруженным данным
+        self.create_schema()
+        conn = self.connect()
+        try:
+            refresh_rollups(conn)
+        finally:
+            conn.close()
+        return counts
+
+    def user_columns(self, user_ids: np.ndarray) -> Tuple[list, list, list]:
+        """username, first_name, last_name: у трети пользователей нет username"""
+        usernames = [f'user{user_id}' if user_id % 3 else None for user_id in user_ids.tolist()]
+        first = self.rng.integers(0, len(FIRST_NAMES), size=len(user_ids))
+        last = self.rng.integers(0, len(LAST_NAMES), size=len(user_ids))
+        return usernames, [FIRST_NAMES[i] for i in first.tolist()], [LAST_NAMES[i] for i in last.tolist()]
+
+    def insert_members(self, conn, channel_id: int, members: np.ndarray, weights: np.ndarray) -> int:
+        """channel_members: активные участники и около 10% отписавшихся"""
+        for begin, end in chunks(len(members)):
+            user_ids = members[begin:end]
+            count = len(user_ids)
+            joined = event_times(self.rng, count, self.start_date, weights)
+            self.rng.shuffle(joined)
+            active = self.rng.random(count) >= 0.1
+            left = joined + self.rng.integers(1, 30 * MICROSECONDS_PER_DAY, size=count).astype('timedelta64[us]')
+            left_dates = [None if is_active else date for is_active, date in zip(active.tolist(), to_sql_dates(left))]
+            usernames, first_names, last_names = self.user_columns(user_ids)
+            conn.executemany('''
+                INSERT INTO channel_members
+                (channel_id, user_id, username, first_name, last_name, joined_date, left_date, is_active)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', zip([channel_id] * count, user_ids.tolist(), usernames, first_names, last_names,
+                     to_sql_dates(joined), left_dates, active.astype(int).tolist()))
+        return len(members)
+
+    def change_batch(self, members: np.ndarray, count: int, weights: np.ndarray, user_pool: int):
+        """Пользователи, типы и даты изменений: подписки чуть чаще отписок"""
+        # Отписываются в основном текущие участники, подписываются новые
+        is_join = self.rng.random(count) < 0.55
+        user_ids = np.where(
+            is_join | (len(members) == 0),
+            self.rng.integers(1, user_pool + 1, size=count),
+            members[self.rng.integers(0, max(len(members), 1), size=count)] if len(members) else 0,
+        )
+        change_types = np.where(is_join, 'joined', 'left').tolist()
+        return user_ids, change_types, event_times(self.rng, count, self.start_date, weights)
+
+    def insert_member_changes(self, conn, channel_id: int, members: np.ndarray, count: int,
+                              weights: np.ndarray, user_pool: int) -> int:
+        user_ids, change_types, times = self.change_batch(members, count, weights, user_pool)
+        for begin, end in chunks(count):
+            conn.executemany('''
+                INSERT INTO member_changes (channel_id, user_id, change_type, change_date)
+                VALUES (?, ?, ?, ?)
+            ''', zip([channel_id] * (end - begin), user_ids[begin:end].tolist(),
+                     change_types[begin:end], to_sql_dates(times[begin:end])))
+        return count
+
+    def insert_real_time_changes(self, conn, channel_id: int, members: np.ndarray, count: int,
+                                 weights: np.ndarray, user_pool: int) -> int:
+        """real_time_changes: ключи msg:N уникальны, около 2% строк восстановлены сверкой"""
+        user_ids, change_types, times = self.change_batch(members, count, weights, user_pool)
+        for begin, end in chunks(count):
+            size = end - begin
+            batch_users = user_ids[begin:end]
+            usernames, first_names, last_names = self.user_columns(batch_users)
+            reconciled = (self.rng.random(size) < 0.02).astype(int).tolist()
+            keys = [None if is_reconciled else f'msg:{self.next_message_id + i}'
+                    for i, is_reconciled in enumerate(reconciled)]
+            self.next_message_id += size
+            conn.executemany('''
+                INSERT INTO real_time_changes
+                (channel_id, user_id, change_type, change_date, username, first_name, last_name,
+                 event_key, is_reconciled)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', zip([channel_id] * size, batch_users.tolist(), change_types[begin:end],
+                     to_sql_dates(times[begin:end]), usernames, first_names, last_names, keys, reconciled))
+        return count
+
+    def insert_channel(self, conn, channel_id: int) -> int:
+        """Справочник каналов: username совпадает с username в снимках"""
+        conn.execute('INSERT INTO channels (channel_id, channel_username, updated_at) VALUES (?, ?, ?)',
+                     (channel_id, f'channel{channel_id}', self.start_date + timedelta(days=self.days)))
+        return 1
+
+    def insert_snapshots(self, conn, channel_id: int, member_count: int, weights: np.ndarray) -> int:
+        """Ежедневные снимки: число участников растет к текущему размеру вслед за активностью"""
+        growth = np.cumsum(weights)
+        counts = np.round(member_count * (0.8 + 0.2 * growth)).astype(int)
+        dates = np.datetime64(self.start_date, 'us') + (
+            np.arange(self.days) * MICROSECONDS_PER_DAY + 12 * MICROSECONDS_PER_HOUR).astype('timedelta64[us]')
+        conn.executemany('''
+            INSERT INTO channel_snapshots (channel_id, channel_username, member_count, snapshot_date)
+            VALUES (?, ?, ?, ?)
+        ''', zip([channel_id] * self.days, [f'channel{channel_id}'] * self.days, counts.tolist(), to_sql_dates(dates)))
+        return self.days
+
+    def insert_member_state(self, conn, channel_id: int, members: np.ndarray) -> int:
+        """Сохраненный состав согласован с последним изменением канала"""
+        # Изменения канала только что вставлены, поэтому последний id таблицы — его (поиск по rowid)
+        last_change_id = conn.execute('SELECT MAX(id) FROM real_time_changes').fetchone()[0] or 0
+        conn.execute('''
+            INSERT OR REPLACE INTO member_state (channel_id, member_ids, member_count, last_change_id, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (channel_id, pack_ids(members), len(members), last_change_id,
+              self.start_date + timedelta(days=self.days)))
+        return 1
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Генератор синтетической базы статистики каналов')
+    parser.add_argument('--db', default='synthetic_stats.db', help='файл базы (перезаписывается)')
+    parser.add_argument('--size', default='10MB', help='примерный размер базы: 10MB .. 10GB')
+    parser.add_argument('--channels', type=int, help='число каналов (по умолчанию из размера)')
+    parser.add_argument('--members', type=int, help='строк channel_members (вместо расчета из --size)')
+    parser.add_argument('--changes', type=int, help='строк member_changes')
+    parser.add_argument('--events', type=int, help='строк real_time_changes')
+    parser.add_argument('--days', type=int, default=180, help='глубина истории в днях')
+    parser.add_argument('--end-date', type=datetime.fromisoformat,
+                        help='последний день истории, YYYY-MM-DD (по умолчанию сегодня)')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    setup_logging()
+
+    members, changes, events = plan_rows(parse_size(args.size))
+    members = args.members if args.members is not None else members
+    changes = args.changes if args.changes is not None else changes
+    events = args.events if args.events is not None else events
+
+    if os.path.exists(args.db):
+        os.remove(args.db)
+
+    generator = SyntheticDataGenerator(args.db, seed=args.seed, days=args.days, end_date=args.end_date)
+    counts = generator.generate(members, changes, events, num_channels=args.channels)
+    logger.info("База %s создана: %.1f МБ", args.db, os.path.getsize(args.db) / 1024 ** 2, extra=counts)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""
+Онлайн-лента изменений для панели
+
+Монитор публикует события обычной фиксацией транзакции в real_time_changes.
+LiveFeed держит курсор по id и проверяет PRAGMA data_version: счетчик
+меняется только после фиксации в другом соединении, поэтому опрос без новых
+событий не читает таблицу. LiveCounters применяет новые строки как приращения
+к накопленным счетчикам, не пересчитывая их запросом по всей истории.
+"""
+
+import sqlite3
+from collections import Counter, deque
+from datetime import datetime, timedelta
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple
+
+from storage import default_db_path
+
+# Окно поминутного графика и число последних событий в ленте
+LIVE_WINDOW_MINUTES = 60
+LIVE_RECENT_EVENTS = 50
+LIVE_BATCH_SIZE = 5000
+
+
+class LiveChange(NamedTuple):
+    """Строка real_time_changes с id для курсора ленты"""
+    id: int
+    channel_id: int
+    user_id: int
+    change_type: str
+    change_date: str
+    username: Optional[str]
+    first_name: Optional[str]
+    last_name: Optional[str]
+
+
+LIVE_CHANGE_SQL = f'''
+    SELECT {', '.join(LiveChange._fields)}
+    FROM real_time_changes
+    WHERE id > ?
+    ORDER BY id
+    LIMIT ?
+'''
+
+
+def minute_of(change_date: str) -> str:
+    """Начало минуты для отметки времени из SQLite ('2024-01-01 12:34')"""
+    return str(change_date)[:16]
+
+
+class LiveFeed:
+    """Чтение изменений, появившихся после последнего опроса"""
+
+    def __init__(self, db_path: Optional[str] = None, batch_size: int = LIVE_BATCH_SIZE):
+        self.db_path = db_path or default_db_path()
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True, check_same_thread=False)
+        self.last_id = 0
+        self.version: Optional[int] = None
+
+    def start_from(self, since: datetime) -> int:
+        """Курсор перед первым изменением после since
+
+        id растут вместе со временем записи, поэтому таблица читается с конца
+        по первичному ключу до первой более старой строки.
+        """
+        since_text = str(since)
+        last_id = self.conn.execute('SELECT COALESCE(MAX(id), 0) FROM real_time_changes').fetchone()[0]
+        for change_id, change_date in self.conn.execute(
+                'SELECT id, change_date FROM real_time_changes ORDER BY id DESC'):
+            if str(change_date) < since_text:
+                break
+            last_id = change_id - 1
+        self.last_id = last_id
+        return self.last_id
+
+    def poll(self) -> List[LiveChange]:
+        """Новые изменения (не больше batch_size) или пустой список без чтения таблицы"""
+        version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+        if version == self.version:
+            return []
+
+        rows = [LiveChange(*row) for row in self.conn.execute(LIVE_CHANGE_SQL, (self.last_id, self.batch_size))]
+        if rows:
+            self.last_id = rows[-1].id
+        # Версия запоминается, только когда все новые строки прочитаны
+        if len(rows) < self.batch_size:
+            self.version = version
+        return rows
+
+    def close(self):
+        self.conn.close()
+
+
+class LiveCounters:
+    """Счетчики онлайн-панели, обновляемые приращениями"""
+
+    def __init__(self, window_minutes: int = LIVE_WINDOW_MINUTES, recent_events: int = LIVE_RECENT_EVENTS):
+        self.window_minutes = window_minutes
+        self.joined: Counter = Counter()
+        self.left: Counter = Counter()
+        self.per_minute: Dict[str, List[int]] = {}
+        self.recent: Deque[LiveChange] = deque(maxlen=recent_events)
+        self.applied = 0
+
+    def apply(self, rows: List[LiveChange]) -> int:
+        """Добавление новых изменений; возвращает число примененных строк"""
+        for row in rows:
+            counts = self.per_minute.setdefault(minute_of(row.change_date), [0, 0])
+            if row.change_type == 'joined':
+                self.joined[row.channel_id] += 1
+                counts[0] += 1
+            elif row.change_type == 'left':
+                self.left[row.channel_id] += 1
+                counts[1] += 1
+            self.recent.append(row)
+        self.applied += len(rows)
+        return len(rows)
+
+    def prune(self, now: datetime):
+        """Удаление минут, вышедших из окна графика"""
+        cutoff = minute_of((now - timedelta(minutes=self.window_minutes)).strftime('%Y-%m-%d %H:%M'))
+        for minute in [minute for minute in self.per_minute if minute < cutoff]:
+            del self.per_minute[minute]
+
+    def timeline(self) -> List[Tuple[str, int, int]]:
+        """(минута, подписки, отписки) в хронологическом порядке"""
+        return [(minute, counts[0], counts[1]) for minute, counts in sorted(self.per_minute.items())]
+
+    def by_channel(self, limit: int = 20) -> List[Tuple[int, int, int]]:
+        """(channel_id, подписки, отписки) для самых активных каналов"""
+        channels = set(self.joined) | set(self.left)
+        top = sorted(channels, key=lambda channel_id: self.joined[channel_id] + self.left[channel_id], reverse=True)
+        return [(channel_id, self.joined[channel_id], self.left[channel_id]) for channel_id in top[:limit]]
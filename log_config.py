@@ -0,0 +1,139 @@
+"""
+Структурированное асинхронное логирование в JSON
+"""
+
+import os
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+import itertools
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+# Логгер событий подписки/отписки (высокий объем, поддерживает выборку)
+EVENTS_LOGGER = 'telegram_monitor.events'
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_output: Optional[logging.Handler] = None
+
+_RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись; поля из extra= попадают в объект"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает каждую N-ю запись; предупреждения и ошибки проходят всегда"""
+
+    def __init__(self, every: int = 1):
+        super().__init__()
+        self.every = max(every, 1)
+        self.counter = itertools.count()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.every == 1:
+            return True
+        return next(self.counter) % self.every == 0
+
+
+def parse_levels(spec: str) -> Dict[str, str]:
+    """Разбор уровней по модулям: 'telegram_monitor=DEBUG,export_data=WARNING'"""
+    levels = {}
+    for item in spec.split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_loggers(log_queue, level: Optional[str] = None, module_levels: Optional[Dict[str, str]] = None,
+                      event_sample_every: Optional[int] = None):
+    """Направление корневого логгера в очередь и настройка уровней и выборки
+
+    Параметры по умолчанию берутся из LOG_LEVEL, LOG_LEVELS и EVENT_LOG_SAMPLE.
+    """
+    level = level or os.getenv('LOG_LEVEL', 'INFO')
+    if module_levels is None:
+        module_levels = parse_levels(os.getenv('LOG_LEVELS', ''))
+    if event_sample_every is None:
+        event_sample_every = int(os.getenv('EVENT_LOG_SAMPLE', '1'))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level.upper())
+
+    for name, module_level in module_levels.items():
+        logging.getLogger(name).setLevel(module_level)
+
+    events_logger = logging.getLogger(EVENTS_LOGGER)
+    for existing in [f for f in events_logger.filters if isinstance(f, SamplingFilter)]:
+        events_logger.removeFilter(existing)
+    events_logger.addFilter(SamplingFilter(event_sample_every))
+
+
+def setup_logging(level: Optional[str] = None, module_levels: Optional[Dict[str, str]] = None,
+                  event_sample_every: Optional[int] = None, stream=None) -> logging.handlers.QueueListener:
+    """Настройка логирования процесса: запись через очередь в фоновом потоке
+
+    Обработчики событий только кладут запись в очередь, сериализация в JSON
+    и вывод выполняются потоком QueueListener.
+    """
+    global _listener, _output
+
+    shutdown_logging()
+
+    _output = logging.StreamHandler(stream)
+    _output.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, _output, respect_handler_level=True)
+    _listener.start()
+
+    configure_loggers(log_queue, level, module_levels, event_sample_every)
+    return _listener
+
+
+def start_process_log_listener(ctx):
+    """Очередь логов для дочерних процессов и поток, выводящий их записи
+
+    Дочерний процесс вызывает configure_loggers(очередь) и пишет только в
+    очередь; вывод остается за главным процессом, строки не перемешиваются.
+    """
+    log_queue = ctx.Queue()
+    output = _output
+    if output is None:
+        output = logging.StreamHandler()
+        output.setFormatter(JsonFormatter())
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    return log_queue, listener
+
+
+def shutdown_logging():
+    """Сброс очереди логов перед завершением процесса"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Массивы ID участников в файлах, открываемых через mmap
+
+Для каждого канала в каталоге <база>_members хранится файл <channel_id>.npy —
+отсортированный массив int64 уникальных ID активных участников из
+channel_members (тот же состав, что считает get_current_stats). Файл
+открывается np.load(mmap_mode='r'): операции над множествами читают страницы
+файла напрямую, без копирования в память процесса, а несколько процессов
+делят одни и те же страницы кэша ОС.
+
+Массивы дополняются после каждого сбора строками channel_members с id больше
+отметки в rollup_state. Файл заменяется атомарно (os.replace), поэтому уже
+открытые отображения продолжают видеть прежнюю версию.
+
+Синхронизация: python member_arrays.py --sync
+Общие участники: python member_arrays.py common channel1 channel2
+"""
+
+import os
+import sys
+import logging
+import argparse
+import sqlite3
+from multiprocessing import Pool
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from member_ids import ID_DTYPE
+from channel_rollups import init_rollups, read_watermark, table_exists
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_SOURCE = 'member_arrays'
+
+
+def member_arrays_dir(db_path: str) -> str:
+    """Каталог массивов рядом с базой"""
+    return os.path.splitext(db_path)[0] + '_members'
+
+
+class MemberArrays:
+    """Отсортированные массивы ID по каналам в файлах .npy"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, channel_id: int) -> str:
+        return os.path.join(self.directory, f'{channel_id}.npy')
+
+    def open(self, channel_id: int) -> np.ndarray:
+        """Массив канала только для чтения (пустой, если файла нет)"""
+        try:
+            return np.load(self.path(channel_id), mmap_mode='r')
+        except FileNotFoundError:
+            return np.empty(0, dtype=ID_DTYPE)
+
+    def channels(self) -> List[int]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(int(name[:-4]) for name in os.listdir(self.directory)
+                      if name.endswith('.npy') and name[:-4].lstrip('-').isdigit())
+
+    def write(self, channel_id: int, member_ids: np.ndarray):
+        """Атомарная замена массива канала (member_ids — отсортированные уникальные)"""
+        os.makedirs(self.directory, exist_ok=True)
+        target = self.path(channel_id)
+        temporary = f'{target}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as f:
+            np.save(f, np.ascontiguousarray(member_ids, dtype=ID_DTYPE))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, target)
+
+    def add(self, channel_id: int, user_ids: np.ndarray) -> int:
+        """Добавление ID в массив канала; возвращает число новых ID"""
+        current = self.open(channel_id)
+        user_ids = np.unique(np.asarray(user_ids, dtype=ID_DTYPE))
+        fresh = difference(user_ids, current)
+        if len(fresh):
+            # Слияние двух отсортированных массивов: вставка новых ID по позициям
+            self.write(channel_id, np.insert(current, np.searchsorted(current, fresh), fresh))
+        return len(fresh)
+
+
+def contains(members: np.ndarray, user_ids: np.ndarray) -> np.ndarray:
+    """Маска: какие из user_ids есть в отсортированном members"""
+    user_ids = np.asarray(user_ids, dtype=ID_DTYPE)
+    if not len(members):
+        return np.zeros(len(user_ids), dtype=bool)
+    position = np.searchsorted(members, user_ids)
+    np.minimum(position, len(members) - 1, out=position)
+    return members[position] == user_ids
+
+
+def intersection(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Общие ID двух отсортированных массивов (поиск меньшего в большем)"""
+    small, large = (a, b) if len(a) <= len(b) else (b, a)
+    return np.asarray(small[contains(large, small)])
+
+
+def difference(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """ID из a, которых нет в b (оба отсортированы)"""
+    return np.asarray(a[~contains(b, a)])
+
+
+def sync_member_arrays(conn, arrays: MemberArrays) -> Dict[int, int]:
+    """Добавление участников, записанных после прошлой синхронизации
+
+    Отметка пишется в rollup_state; транзакцией управляет вызывающий код.
+    Возвращает число новых ID по каналам.
+    """
+    init_rollups(conn)
+    if not table_exists(conn, 'channel_members'):
+        return {}
+    start = read_watermark(conn, WATERMARK_SOURCE)
+    end = conn.execute('SELECT COALESCE(MAX(id), 0) FROM channel_members').fetchone()[0]
+    if end <= start:
+        return {}
+
+    rows = np.array(conn.execute('''
+        SELECT channel_id, user_id FROM channel_members
+        WHERE id > ? AND id <= ? AND is_active = 1
+    ''', (start, end)).fetchall(), dtype=np.int64).reshape(-1, 2)
+    added = {}
+    if len(rows):
+        rows = rows[np.argsort(rows[:, 0], kind='stable')]
+        channel_ids, first = np.unique(rows[:, 0], return_index=True)
+        for channel_id, user_ids in zip(channel_ids.tolist(), np.split(rows[:, 1], first[1:])):
+            added[channel_id] = arrays.add(channel_id, user_ids)
+    conn.execute('INSERT OR REPLACE INTO rollup_state (source, last_id) VALUES (?, ?)', (WATERMARK_SOURCE, end))
+    return added
+
+
+# Каталог массивов в рабочих процессах пула (задается инициализатором)
+_worker_arrays: Optional[MemberArrays] = None
+
+
+def _init_worker(directory: str):
+    global _worker_arrays
+    _worker_arrays = MemberArrays(directory)
+
+
+def _pair_intersection(pair: Tuple[int, int]) -> Tuple[int, int, int]:
+    a, b = (_worker_arrays.open(channel_id) for channel_id in pair)
+    return pair[0], pair[1], len(intersection(a, b))
+
+
+def pairwise_intersections(arrays: MemberArrays, pairs: Sequence[Tuple[int, int]],
+                           processes: Optional[int] = None) -> List[Tuple[int, int, int]]:
+    """(channel_a, channel_b, общих участников) для пар каналов в пуле процессов
+
+    В процессы передаются только номера каналов: каждый отображает те же
+    файлы, и страницы массивов читаются из общего кэша ОС.
+    """
+    if processes == 1 or len(pairs) < 2:
+        _init_worker(arrays.directory)
+        return [_pair_intersection(pair) for pair in pairs]
+    with Pool(processes, initializer=_init_worker, initargs=(arrays.directory,)) as pool:
+        return pool.map(_pair_intersection, pairs, chunksize=max(1, len(pairs) // (4 * (processes or os.cpu_count() or 1))))
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    from storage import default_db_path
+
+    parser = argparse.ArgumentParser(description='Массивы ID участников каналов (mmap)')
+    parser.add_argument('command', nargs='?', choices=('common',), help='common — общие участники двух каналов')
+    parser.add_argument('channels', nargs='*', help='username каналов')
+    parser.add_argument('--db', default=default_db_path(), help='база SQLite сборщика')
+    parser.add_argument('--sync', action='store_true', help='дополнить массивы по channel_members')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from log_config import setup_logging
+    from channel_rollups import resolve_channel_id
+
+    args = parse_args(argv)
+    setup_logging()
+    arrays = MemberArrays(member_arrays_dir(args.db))
+    conn = sqlite3.connect(args.db, timeout=30)
+    try:
+        if args.sync:
+            added = sync_member_arrays(conn, arrays)
+            conn.commit()
+            print(f"Обновлено каналов: {len(added)}, новых ID: {sum(added.values()):,}")
+        if args.command == 'common':
+            if len(args.channels) != 2:
+                print("Укажите два канала", file=sys.stderr)
+                return 2
+            channel_ids = [resolve_channel_id(conn, channel) for channel in args.channels]
+            if None in channel_ids:
+                print("Канал не найден", file=sys.stderr)
+                return 1
+            a, b = (arrays.open(channel_id) for channel_id in channel_ids)
+            print(f"Общих участников: {len(intersection(a, b)):,} (из {len(a):,} и {len(b):,})")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,46 @@
+"""
+Компактные массивы ID участников и операции над ними
+"""
+
+import zlib
+from typing import Iterable, Tuple
+import numpy as np
+
+ID_DTYPE = np.int64
+
+
+def to_id_array(ids: Iterable[int]) -> np.ndarray:
+    """Отсортированный массив уникальных ID"""
+    arr = np.fromiter(ids, dtype=ID_DTYPE)
+    return np.unique(arr)
+
+
+def pack_ids(arr: np.ndarray, level: int = -1) -> bytes:
+    """Упаковка отсортированного массива ID: дельта-кодирование + zlib"""
+    deltas = np.diff(arr.astype(ID_DTYPE, copy=False), prepend=ID_DTYPE(0))
+    return zlib.compress(deltas.astype('<i8').tobytes(), level)
+
+
+def unpack_ids(blob: bytes) -> np.ndarray:
+    """Распаковка массива ID, упакованного pack_ids"""
+    if not blob:
+        return np.empty(0, dtype=ID_DTYPE)
+    deltas = np.frombuffer(zlib.decompress(blob), dtype='<i8')
+    return np.cumsum(deltas, dtype=ID_DTYPE)
+
+
+def diff_ids(old: np.ndarray, new: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Разница двух отсортированных наборов ID: (добавленные, удаленные)"""
+    added = np.setdiff1d(new, old, assume_unique=True)
+    removed = np.setdiff1d(old, new, assume_unique=True)
+    return added, removed
+
+
+def mix64(ids: np.ndarray, seed: int = 0x9E3779B97F4A7C15) -> np.ndarray:
+    """Перемешивание 64-битных ID для хеш-структур (финализатор splitmix64)"""
+    x = np.asarray(ids).astype(np.uint64) ^ np.uint64(seed)
+    with np.errstate(over='ignore'):
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
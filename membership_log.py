@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Журнал изменений состава каналов
+
+Каждый сбор участников добавляет в файл канала (<база>_membership/<channel_id>.bin)
+запись с отсортированными массивами добавленных и удаленных ID
+(дельта-кодирование + zlib, как member_state), а в таблицу membership_log —
+ссылку на нее: смещение и длины. Время от времени вместо разницы пишется
+полный состав (контрольная точка), поэтому состав на любую дату
+восстанавливается из ближайшей предыдущей контрольной точки и нескольких
+разниц после нее.
+
+Состав на дату: python membership_log.py channel --at 2024-05-01T12:00
+"""
+
+import os
+import sys
+import logging
+import argparse
+import sqlite3
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from member_ids import pack_ids, unpack_ids, diff_ids
+
+logger = logging.getLogger(__name__)
+
+# Контрольная точка не реже чем через CHECKPOINT_EVERY разниц и когда
+# разницы после нее занимают больше CHECKPOINT_RATIO от ее размера
+CHECKPOINT_EVERY = 30
+CHECKPOINT_RATIO = 0.5
+
+
+class MembershipEntry(NamedTuple):
+    """Строка membership_log: kind — 'checkpoint' (полный состав) или 'delta'"""
+    id: int
+    channel_id: int
+    taken_at: str
+    kind: str
+    segment: str
+    position: int
+    added_length: int
+    removed_length: int
+    member_count: int
+
+
+ENTRY_SQL = f'SELECT {", ".join(MembershipEntry._fields)} FROM membership_log'
+
+
+def init_membership_log(conn):
+    """Таблица ссылок на записи журнала (вызывается из init_database сборщика)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS membership_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel_id INTEGER,
+            taken_at TIMESTAMP,
+            kind TEXT,
+            segment TEXT,
+            position INTEGER,
+            added_length INTEGER,
+            removed_length INTEGER,
+            member_count INTEGER
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_membership_log_channel ON membership_log (channel_id, taken_at)')
+
+
+def membership_log_dir(db_path: str) -> str:
+    """Каталог файлов журнала рядом с базой"""
+    return os.path.splitext(db_path)[0] + '_membership'
+
+
+class MembershipLog:
+    """Запись и воспроизведение журнала состава каналов"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def append(self, channel_id: int, *blobs: bytes) -> Tuple[str, int]:
+        """Дописывание записи в файл канала; возвращает (имя файла, смещение)
+
+        Файл пишется до фиксации строки в базе: при сбое остается только
+        запись без ссылки, которую никто не читает.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        segment = f'{channel_id}.bin'
+        with open(os.path.join(self.directory, segment), 'ab') as f:
+            position = f.tell()
+            for blob in blobs:
+                f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        return segment, position
+
+    def read(self, entry: MembershipEntry) -> Tuple[np.ndarray, np.ndarray]:
+        """(добавленные, удаленные) ID записи; для контрольной точки — (состав, пусто)"""
+        with open(os.path.join(self.directory, entry.segment), 'rb') as f:
+            f.seek(entry.position)
+            data = f.read(entry.added_length + entry.removed_length)
+        return unpack_ids(data[:entry.added_length]), unpack_ids(data[entry.added_length:])
+
+    def entries(self, conn, channel_id: int, moment: Optional[datetime] = None) -> List[MembershipEntry]:
+        """Последняя контрольная точка до moment и разницы после нее"""
+        moment_filter, params = ('AND taken_at <= ?', [moment]) if moment is not None else ('', [])
+        checkpoint = conn.execute(f'''
+            {ENTRY_SQL}
+            WHERE channel_id = ? AND kind = 'checkpoint' {moment_filter}
+            ORDER BY id DESC LIMIT 1
+        ''', [channel_id] + params).fetchone()
+        if checkpoint is None:
+            return []
+        deltas = conn.execute(f'''
+            {ENTRY_SQL}
+            WHERE channel_id = ? AND id > ? AND kind = 'delta' {moment_filter}
+            ORDER BY id
+        ''', [channel_id, checkpoint[0]] + params).fetchall()
+        return [MembershipEntry(*checkpoint)] + [MembershipEntry(*row) for row in deltas]
+
+    def members_at(self, conn, channel_id: int, moment: Optional[datetime] = None) -> Optional[np.ndarray]:
+        """Отсортированные ID участников на момент moment (None — последний сбор)
+
+        None, если до moment канал не собирался.
+        """
+        return self.replay(self.entries(conn, channel_id, moment))
+
+    def replay(self, entries: List[MembershipEntry]) -> Optional[np.ndarray]:
+        """Состав после контрольной точки entries[0] и разниц за ней"""
+        if not entries:
+            return None
+        members, _ = self.read(entries[0])
+        for entry in entries[1:]:
+            added, removed = self.read(entry)
+            members = np.union1d(np.setdiff1d(members, removed, assume_unique=True), added)
+        return members
+
+    def record(self, conn, channel_id: int, member_ids: np.ndarray, taken_at: Optional[datetime] = None,
+               complete: bool = True) -> Optional[MembershipEntry]:
+        """Запись результата сбора; транзакцией управляет вызывающий код
+
+        member_ids — отсортированные уникальные ID. При неполном сборе
+        (сервер вернул не всех участников) отсутствие ID не считается
+        отпиской: записываются только добавленные. None, если состав не изменился.
+        """
+        taken_at = taken_at or datetime.now()
+        entries = self.entries(conn, channel_id)
+        previous = self.replay(entries)
+
+        if previous is None:
+            kind, members, added, removed = 'checkpoint', member_ids, member_ids, member_ids[:0]
+        else:
+            added, removed = diff_ids(previous, member_ids)
+            if not complete:
+                removed = removed[:0]
+            if not len(added) and not len(removed):
+                return None
+            members = np.union1d(np.setdiff1d(previous, removed, assume_unique=True), added)
+            delta_bytes = sum(entry.added_length + entry.removed_length for entry in entries[1:])
+            checkpoint_bytes = entries[0].added_length
+            kind = 'checkpoint' if (len(entries) > CHECKPOINT_EVERY
+                                    or delta_bytes > CHECKPOINT_RATIO * checkpoint_bytes) else 'delta'
+
+        if kind == 'checkpoint':
+            blobs = (pack_ids(members), b'')
+        else:
+            blobs = (pack_ids(added), pack_ids(removed))
+        segment, position = self.append(channel_id, *blobs)
+        cursor = conn.execute('''
+            INSERT INTO membership_log
+            (channel_id, taken_at, kind, segment, position, added_length, removed_length, member_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (channel_id, taken_at, kind, segment, position, len(blobs[0]), len(blobs[1]), len(members)))
+        logger.debug("Запись журнала состава канала", extra={
+            'channel_id': channel_id, 'kind': kind, 'added': len(added), 'removed': len(removed),
+        })
+        return MembershipEntry(cursor.lastrowid, channel_id, str(taken_at), kind, segment, position,
+                               len(blobs[0]), len(blobs[1]), len(members))
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    from storage import default_db_path
+
+    parser = argparse.ArgumentParser(description='Состав канала на дату по журналу сборов')
+    parser.add_argument('channel', help='username канала')
+    parser.add_argument('--db', default=default_db_path(), help='база SQLite сборщика')
+    parser.add_argument('--at', type=datetime.fromisoformat, help='момент, YYYY-MM-DDTHH:MM (по умолчанию последний сбор)')
+    parser.add_argument('--output', help='файл для списка ID (по одному в строке)')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from channel_rollups import resolve_channel_id
+
+    args = parse_args(argv)
+    conn = sqlite3.connect(args.db, timeout=30)
+    try:
+        channel_id = resolve_channel_id(conn, args.channel)
+        if channel_id is None:
+            print(f"Канал {args.channel} не найден", file=sys.stderr)
+            return 1
+        members = MembershipLog(membership_log_dir(args.db)).members_at(conn, channel_id, args.at)
+    finally:
+        conn.close()
+
+    if members is None:
+        print(f"До {args.at or 'текущего момента'} канал {args.channel} не собирался")
+        return 1
+    if args.output:
+        np.savetxt(args.output, members, fmt='%d')
+    print(f"Участников канала {args.channel}: {len(members):,}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""
+Метрики монитора и сборщика в формате Prometheus
+"""
+
+import os
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+from telethon.errors import FloodWaitError
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек (секунды)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    """Монотонный счетчик
+
+    Изменяется только из одного потока (цикла событий или процесса записи),
+    поэтому обходится без блокировок: инкремент — одно присваивание.
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def samples(self) -> List[Tuple[str, float]]:
+        return [(self.name, self.value)]
+
+
+class Gauge(Counter):
+    """Значение, которое может расти и уменьшаться"""
+
+    kind = 'gauge'
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами, без выделения памяти при наблюдении"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    @contextmanager
+    def time(self):
+        """Замер длительности блока кода"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self) -> List[Tuple[str, float]]:
+        result = []
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            result.append((f'{self.name}_bucket{{le="{bound}"}}', cumulative))
+        cumulative += self.counts[-1]
+        result.append((f'{self.name}_bucket{{le="+Inf"}}', cumulative))
+        result.append((f'{self.name}_sum', self.sum))
+        result.append((f'{self.name}_count', cumulative))
+        return result
+
+
+class MetricsRegistry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self.register(Counter(name, documentation))
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self.register(Gauge(name, documentation))
+
+    def histogram(self, name: str, documentation: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, buckets))
+
+    def render(self) -> str:
+        """Текстовый формат экспозиции Prometheus"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for sample_name, value in metric.samples():
+                lines.append(f'{sample_name} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+EVENTS_RECEIVED = REGISTRY.counter('telegram_monitor_events_received_total', 'Получено событий подписки/отписки')
+EVENTS_WRITTEN = REGISTRY.counter('telegram_monitor_events_written_total', 'Записано событий в базу')
+EVENTS_DUPLICATE = REGISTRY.counter('telegram_monitor_events_duplicate_total', 'Отброшено повторно доставленных событий')
+DB_WRITE_SECONDS = REGISTRY.histogram('telegram_monitor_db_write_seconds', 'Длительность пакетной записи в базу')
+QUEUE_DEPTH = REGISTRY.gauge('telegram_monitor_queue_depth', 'Пакетов событий в очередях между процессами')
+API_REQUEST_SECONDS = REGISTRY.histogram('telegram_api_request_seconds', 'Длительность запросов к Telegram API')
+FLOOD_WAITS = REGISTRY.counter('telegram_api_flood_waits_total', 'Получено ограничений FloodWait')
+FLOOD_WAIT_SECONDS = REGISTRY.counter('telegram_api_flood_wait_seconds_total', 'Суммарное время ожидания FloodWait')
+COLLECTION_PAGES = REGISTRY.counter('telegram_collection_pages_total', 'Получено страниц участников')
+JOIN_BURSTS = REGISTRY.counter('telegram_monitor_join_bursts_total', 'Обнаружено всплесков подписок')
+
+
+async def api_call(client, request):
+    """Запрос к Telegram API с замером задержки и учетом FloodWait
+
+    Если у клиента есть rate_limiter (см. scheduler.RateLimiter), запрос ждет
+    его разрешения, а FloodWait приостанавливает все запросы через него.
+    """
+    limiter = getattr(client, 'rate_limiter', None)
+    if limiter is not None:
+        await limiter.acquire()
+    start = time.perf_counter()
+    try:
+        return await client(request)
+    except FloodWaitError as e:
+        FLOOD_WAITS.inc()
+        FLOOD_WAIT_SECONDS.inc(e.seconds)
+        if limiter is not None:
+            limiter.pause(e.seconds)
+        raise
+    finally:
+        API_REQUEST_SECONDS.observe(time.perf_counter() - start)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Обработчик /metrics"""
+
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: Optional[int] = None, host: str = '127.0.0.1') -> Optional[ThreadingHTTPServer]:
+    """Запуск HTTP-сервера метрик в фоновом потоке (порт из METRICS_PORT)"""
+    if port is None:
+        port = int(os.getenv('METRICS_PORT', '0'))
+    if not port:
+        return None
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return server
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+HTTP API для чтения статистики каналов
+
+Запуск: python read_api.py --db telegram_stats.db --port 8080
+
+    GET /api/channels/{username}/stats?days=30
+    GET /api/channels/{username}/growth?days=7
+    GET /api/channels/{username}/changes?hours=24&limit=100&offset=0
+    GET /api/channels/{username}/export.csv?days=30
+
+Запросы выполняются в пуле потоков на постоянных соединениях только для
+чтения. Ответы кэшируются по версии данных (последним id таблиц изменений и
+снимков) и минуте запроса: ETag не меняется, пока монитор ничего не записал,
+и клиент с If-None-Match получает 304 без обращения к базе за данными.
+"""
+
+import os
+import sys
+import csv
+import io
+import json
+import asyncio
+import hashlib
+import logging
+import argparse
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+from channel_rollups import resolve_channel_id, table_exists
+from log_config import setup_logging
+from storage import default_db_path
+
+logger = logging.getLogger(__name__)
+
+READ_POOL_SIZE = 4
+RESPONSE_CACHE_SIZE = 256
+EXPORT_BATCH_SIZE = 5000
+MAX_PAGE_SIZE = 1000
+
+# Таблицы, которые читают обработчики: их последние id образуют версию данных
+VERSIONED_TABLES = ('real_time_changes', 'channel_snapshots')
+
+CHANGE_COLUMNS = ('change_type', 'change_date', 'username', 'first_name', 'last_name')
+
+
+class ChannelNotFound(Exception):
+    pass
+
+
+def connect_read_only(db_path: str) -> sqlite3.Connection:
+    """Соединение только для чтения, пригодное для передачи между потоками пула"""
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, check_same_thread=False, timeout=30)
+    conn.execute('PRAGMA query_only = 1')
+    return conn
+
+
+class ReadPool:
+    """Пул соединений для чтения: соединение выдается одному запросу за раз"""
+
+    def __init__(self, db_path: str, size: int = READ_POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self.executor = ThreadPoolExecutor(size, thread_name_prefix='read-api')
+        self.connections: Optional[asyncio.Queue] = None
+
+    async def open(self):
+        self.connections = asyncio.Queue()
+        for _ in range(self.size):
+            self.connections.put_nowait(connect_read_only(self.db_path))
+
+    async def run(self, func: Callable, *args):
+        """Выполнение func(conn, *args) в потоке пула"""
+        conn = await self.connections.get()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, conn, *args)
+        finally:
+            self.connections.put_nowait(conn)
+
+    async def close(self):
+        while self.connections is not None and not self.connections.empty():
+            self.connections.get_nowait().close()
+        self.executor.shutdown(wait=False)
+
+
+def data_version(conn) -> Tuple[int, ...]:
+    """Последние id читаемых таблиц (поиск по первичному ключу, без просмотра таблиц)"""
+    tables = [table for table in VERSIONED_TABLES if table_exists(conn, table)]
+    if not tables:
+        return ()
+    return conn.execute(
+        'SELECT ' + ', '.join(f'(SELECT COALESCE(MAX(id), 0) FROM {table})' for table in tables)
+    ).fetchone()
+
+
+def require_channel(conn, channel_username: str) -> int:
+    channel_id = resolve_channel_id(conn, channel_username)
+    if channel_id is None:
+        raise ChannelNotFound(channel_username)
+    return channel_id
+
+
+def query_stats(conn, channel_username: str, since: datetime, days: int) -> Dict:
+    """Подписки и отписки за период и последний снимок канала"""
+    channel_id = require_channel(conn, channel_username)
+    counts = dict(conn.execute('''
+        SELECT change_type, COUNT(*)
+        FROM real_time_changes
+        WHERE channel_id = ? AND change_date >= ?
+        GROUP BY change_type
+    ''', (channel_id, since)).fetchall())
+    snapshot = conn.execute('''
+        SELECT member_count, snapshot_date
+        FROM channel_snapshots
+        WHERE channel_id = ?
+        ORDER BY id DESC
+        LIMIT 1
+    ''', (channel_id,)).fetchone() or (0, None)
+
+    joined, left = counts.get('joined', 0), counts.get('left', 0)
+    return {
+        'channel_username': channel_username,
+        'channel_id': channel_id,
+        'period_days': days,
+        'joined_count': joined,
+        'left_count': left,
+        'net_growth': joined - left,
+        'current_members': snapshot[0],
+        'last_snapshot_date': snapshot[1],
+    }
+
+
+def query_growth(conn, channel_username: str, since: datetime) -> List[Dict]:
+    """Численность канала по дням по снимкам"""
+    channel_id = require_channel(conn, channel_username)
+    rows = conn.execute('''
+        SELECT
+            DATE(snapshot_date) as date,
+            AVG(member_count) as avg_members,
+            MAX(member_count) as max_members,
+            MIN(member_count) as min_members
+        FROM channel_snapshots
+        WHERE channel_id = ? AND snapshot_date >= ?
+        GROUP BY DATE(snapshot_date)
+        ORDER BY date
+    ''', (channel_id, since)).fetchall()
+    return [dict(zip(('date', 'avg_members', 'max_members', 'min_members'), row)) for row in rows]
+
+
+def query_changes(conn, channel_username: str, since: datetime, limit: int, offset: int) -> Dict:
+    """Страница недавних изменений канала (новые первыми)"""
+    channel_id = require_channel(conn, channel_username)
+    rows = conn.execute(f'''
+        SELECT {', '.join(CHANGE_COLUMNS)}, COUNT(*) OVER () AS total
+        FROM real_time_changes
+        WHERE channel_id = ? AND change_date >= ?
+        ORDER BY change_date DESC, id DESC
+        LIMIT ? OFFSET ?
+    ''', (channel_id, since, limit, offset)).fetchall()
+    total = rows[0][-1] if rows else conn.execute(
+        'SELECT COUNT(*) FROM real_time_changes WHERE channel_id = ? AND change_date >= ?', (channel_id, since)
+    ).fetchone()[0]
+    return {'total': total, 'items': [dict(zip(CHANGE_COLUMNS, row[:-1])) for row in rows]}
+
+
+def open_export_cursor(conn, channel_username: str, since: datetime) -> sqlite3.Cursor:
+    channel_id = require_channel(conn, channel_username)
+    return conn.execute(f'''
+        SELECT {', '.join(CHANGE_COLUMNS)}
+        FROM real_time_changes
+        WHERE channel_id = ? AND change_date >= ?
+        ORDER BY change_date DESC, id DESC
+    ''', (channel_id, since))
+
+
+def fetch_csv_batch(conn, cursor: sqlite3.Cursor) -> Optional[bytes]:
+    """Следующая порция CSV или None, когда строки закончились"""
+    rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+    if not rows:
+        return None
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode('utf-8')
+
+
+def int_param(request: web.Request, name: str, default: int, maximum: Optional[int] = None) -> int:
+    try:
+        value = int(request.query.get(name, default))
+    except ValueError:
+        raise web.HTTPBadRequest(text=f'{name} должен быть целым числом')
+    if value < 0 or (maximum is not None and value > maximum):
+        raise web.HTTPBadRequest(text=f'{name} вне допустимого диапазона')
+    return value
+
+
+def window_start(delta: timedelta) -> datetime:
+    """Начало периода с точностью до минуты: в пределах минуты ответ не меняется"""
+    return (datetime.now() - delta).replace(second=0, microsecond=0)
+
+
+class ReadApi:
+    """Обработчики API с кэшем ответов по версии данных"""
+
+    def __init__(self, db_path: Optional[str] = None, pool_size: int = READ_POOL_SIZE,
+                 cache_size: int = RESPONSE_CACHE_SIZE):
+        self.pool = ReadPool(db_path or default_db_path(), pool_size)
+        self.cache_size = cache_size
+        self.cache: 'OrderedDict[str, bytes]' = OrderedDict()
+        self.pending: Dict[str, asyncio.Future] = {}
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/api/channels/{username}/stats', self.stats)
+        app.router.add_get('/api/channels/{username}/growth', self.growth)
+        app.router.add_get('/api/channels/{username}/changes', self.changes)
+        app.router.add_get('/api/channels/{username}/export.csv', self.export_csv)
+        app.on_startup.append(lambda app: self.pool.open())
+        app.on_cleanup.append(lambda app: self.pool.close())
+        return app
+
+    async def etag_for(self, request: web.Request, since: datetime) -> str:
+        version = await self.pool.run(data_version)
+        key = f'{request.path}?{sorted(request.query.items())}|{since.isoformat()}|{version}'
+        return '"' + hashlib.blake2b(key.encode(), digest_size=12).hexdigest() + '"'
+
+    async def cached_json(self, request: web.Request, since: datetime, func: Callable, *args) -> web.Response:
+        """Ответ из кэша по ETag; одинаковые одновременные запросы считаются один раз"""
+        etag = await self.etag_for(request, since)
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if etag in request.headers.getall('If-None-Match', []):
+            return web.Response(status=304, headers=headers)
+
+        body = self.cache.get(etag)
+        if body is not None:
+            self.cache.move_to_end(etag)
+        elif etag in self.pending:
+            body = await asyncio.shield(self.pending[etag])
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self.pending[etag] = future
+            try:
+                result = await self.pool.run(func, *args)
+                body = json.dumps(result, ensure_ascii=False, default=str).encode('utf-8')
+                future.set_result(body)
+            except BaseException as e:
+                future.set_exception(e)
+                # Исключение передано ожидающим; без них future не должен ругаться в лог
+                future.exception()
+                raise
+            finally:
+                del self.pending[etag]
+            self.cache[etag] = body
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return web.Response(body=body, content_type='application/json', headers=headers)
+
+    async def stats(self, request: web.Request) -> web.Response:
+        days = int_param(request, 'days', 30)
+        since = window_start(timedelta(days=days))
+        return await self.cached_json(request, since, query_stats, request.match_info['username'], since, days)
+
+    async def growth(self, request: web.Request) -> web.Response:
+        since = window_start(timedelta(days=int_param(request, 'days', 7)))
+        return await self.cached_json(request, since, query_growth, request.match_info['username'], since)
+
+    async def changes(self, request: web.Request) -> web.Response:
+        since = window_start(timedelta(hours=int_param(request, 'hours', 24)))
+        limit = int_param(request, 'limit', 100, MAX_PAGE_SIZE)
+        offset = int_param(request, 'offset', 0)
+        return await self.cached_json(request, since, query_changes, request.match_info['username'],
+                                      since, limit, offset)
+
+    async def export_csv(self, request: web.Request) -> web.StreamResponse:
+        """Потоковый CSV: в памяти держится одна порция строк"""
+        since = window_start(timedelta(days=int_param(request, 'days', 30)))
+        etag = await self.etag_for(request, since)
+        if etag in request.headers.getall('If-None-Match', []):
+            return web.Response(status=304, headers={'ETag': etag})
+
+        # Курсор принадлежит соединению, поэтому оно удерживается до конца выгрузки
+        conn = await self.pool.connections.get()
+        run = asyncio.get_running_loop().run_in_executor
+        try:
+            cursor = await run(self.pool.executor, open_export_cursor, conn, request.match_info['username'], since)
+            response = web.StreamResponse(headers={
+                'ETag': etag,
+                'Content-Type': 'text/csv; charset=utf-8',
+                'Content-Disposition': f'attachment; filename="{request.match_info["username"]}_changes.csv"',
+            })
+            await response.prepare(request)
+            await response.write((','.join(CHANGE_COLUMNS) + '\r\n').encode('utf-8'))
+            while True:
+                chunk = await run(self.pool.executor, fetch_csv_batch, conn, cursor)
+                if chunk is None:
+                    break
+                await response.write(chunk)
+            await run(self.pool.executor, cursor.close)
+            await response.write_eof()
+            return response
+        finally:
+            self.pool.connections.put_nowait(conn)
+
+
+@web.middleware
+async def error_middleware(request: web.Request, handler):
+    try:
+        return await handler(request)
+    except ChannelNotFound as e:
+        return web.json_response({'error': f'Канал не найден: {e}'}, status=404)
+    except web.HTTPException as e:
+        if e.status >= 400:
+            return web.json_response({'error': e.text}, status=e.status)
+        raise
+    except sqlite3.Error as e:
+        logger.exception("Ошибка чтения базы для %s", request.path)
+        return web.json_response({'error': str(e)}, status=500)
+
+
+def create_app(db_path: Optional[str] = None, pool_size: int = READ_POOL_SIZE) -> web.Application:
+    api = ReadApi(db_path, pool_size)
+    app = api.make_app()
+    app.middlewares.append(error_middleware)
+    return app
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='HTTP API для чтения статистики каналов')
+    parser.add_argument('--db', default=default_db_path(), help='путь к базе (по умолчанию TELEGRAM_STATS_DB)')
+    parser.add_argument('--host', default=os.getenv('READ_API_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('READ_API_PORT', '8080')))
+    parser.add_argument('--pool-size', type=int, default=READ_POOL_SIZE, help='соединений и потоков чтения')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    setup_logging()
+    if not os.path.exists(args.db):
+        logger.error("База %s не найдена", args.db)
+        return 1
+    logger.info("API статистики на http://%s:%s", args.host, args.port)
+    web.run_app(create_app(args.db, args.pool_size), host=args.host, port=args.port, print=None)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -83,6 +83,18 @@ def run_monitor():
     except KeyboardInterrupt:
         print("\n👋 Мониторинг остановлен")
 
+def run_scheduler():
+    """Запуск регулярного сбора по расписанию"""
+    channels = input("Каналы через пробел: ").split()
+    if not channels:
+        print("❌ Не указаны каналы")
+        return
+    print("⏰ Запуск планировщика (снимки каждый час, сбор участников ночью, отчеты в 03:00)...")
+    try:
+        subprocess.run([sys.executable, 'scheduler.py', *channels, '--monitor'])
+    except KeyboardInterrupt:
+        print("\n👋 Планировщик остановлен")
+
 def show_menu():
     """Показать меню выбора"""
     print("\n" + "="*50)
@@ -93,6 +105,7 @@ def show_menu():
     print("3. 📦 Установить зависимости")
     print("4. ✅ Проверить настройки")
     print("5. 📖 Показать справку")
+    print("6. ⏰ Запустить сбор по расписанию")
     print("0. 🚪 Выход")
     print("="*50)
 
@@ -109,6 +122,7 @@ def show_help():
     print("- telegram_stats.py - основное веб-приложение")
     print("- telegram_monitor.py - мониторинг в реальном времени")
     print("- export_data.py - экспорт данных")
+    print("- scheduler.py - сбор по расписанию")
     print("- requirements.txt - зависимости")
     print("- README.md - подробная документация")
 
@@ -137,7 +151,7 @@ def main():
     # Основной цикл меню
     while True:
         show_menu()
-        choice = input("\nВыберите действие (0-5): ").strip()
+        choice = input("\nВыберите действие (0-6): ").strip()
         
         if choice == '1':
             run_streamlit()
@@ -153,6 +167,8 @@ def main():
             check_env_file()
         elif choice == '5':
             show_help()
+        elif choice == '6':
+            run_scheduler()
         elif choice == '0':
             print("👋 До свидания!")
             break
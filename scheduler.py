@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+"""
+Планировщик регулярных задач сбора
+
+Задачи описываются расписанием в формате cron («0 * * * *» — каждый час),
+приоритетом и лимитом одновременных запусков. Все задачи процесса работают
+через один клиент Telegram и один ограничитель частоты запросов: api_call
+берет разрешение у client.rate_limiter, и запросы с меньшим значением
+приоритета обслуживаются первыми. Запросы вне задач (живой мониторинг,
+сверка состава) идут с PRIORITY_LIVE, поэтому массовый сбор не вытесняет их.
+
+Состояние задач хранится в таблице scheduler_jobs. Если процесс не работал
+в момент запуска, задача с catch_up=True выполняется один раз сразу после
+старта (пропущенные запуски не накапливаются).
+
+Запуск: python scheduler.py channel1 channel2 [--monitor] [--members "30 1 * * *"]
+"""
+
+import sys
+import heapq
+import asyncio
+import logging
+import argparse
+import itertools
+import sqlite3
+import time
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_LIVE = 0
+PRIORITY_SNAPSHOTS = 20
+PRIORITY_ADMIN_LOG = 30
+PRIORITY_MEMBERS = 60
+PRIORITY_EXPORT = 80
+
+# Приоритет запросов к API в текущей задаче (наследуется дочерними задачами asyncio)
+current_priority: ContextVar[int] = ContextVar('current_priority', default=PRIORITY_LIVE)
+
+CRON_ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+}
+# (минимум, максимум) полей: минута, час, день месяца, месяц, день недели (0 — воскресенье)
+CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+# Поиск следующего запуска ограничен: «30 февраля» никогда не наступит
+CRON_SEARCH_DAYS = 366 * 5
+# Планировщик просыпается не реже раза в минуту (перевод часов, засыпание машины)
+MAX_SLEEP_SECONDS = 60
+
+
+def parse_cron_field(text: str, low: int, high: int) -> Set[int]:
+    """Значения поля cron: *, */n, a-b, a-b/n, списки через запятую"""
+    values = set()
+    for part in text.split(','):
+        base, _, step = part.partition('/')
+        if base == '*':
+            start, end = low, high
+        elif '-' in base:
+            start, end = (int(value) for value in base.split('-', 1))
+        else:
+            start = end = int(base)
+            if step:
+                end = high
+        step = int(step) if step else 1
+        # Воскресенье можно записать и как 7
+        if high == 6 and end == 7:
+            end = 6
+            values.add(0)
+        if not low <= start <= end <= high or step < 1:
+            raise ValueError(f"Недопустимое поле cron: {text}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """Расписание из пяти полей cron по местному времени"""
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        fields = CRON_ALIASES.get(expression, expression).split()
+        if len(fields) != 5:
+            raise ValueError(f"Ожидается пять полей cron: {expression}")
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            parse_cron_field(text, low, high) for text, (low, high) in zip(fields, CRON_FIELDS)
+        )
+        # Как в cron: если ограничены и день месяца, и день недели, подходит любой из них
+        self.any_day = fields[2] == '*' or fields[4] == '*'
+
+    def __repr__(self):
+        return f'CronSchedule({self.expression!r})'
+
+    def day_matches(self, moment: datetime) -> bool:
+        day = moment.day in self.days
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        return day and weekday if self.any_day else day or weekday
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Ближайший запуск строго после moment"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=CRON_SEARCH_DAYS)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                month = candidate.replace(day=1, hour=0, minute=0)
+                candidate = (month + timedelta(days=32)).replace(day=1)
+            elif not self.day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"Расписание {self.expression} не срабатывает")
+
+
+class PriorityGate:
+    """Семафор, отдающий освободившиеся места ожидающим по приоритету"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.in_use = 0
+        self.waiters = []
+        self.counter = itertools.count()
+
+    async def acquire(self, priority: Optional[int] = None):
+        if self.in_use < self.capacity and not self.waiters:
+            self.in_use += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        priority = current_priority.get() if priority is None else priority
+        heapq.heappush(self.waiters, (priority, next(self.counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Место уже передано этой задаче: возвращаем его следующему
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                # Место переходит ожидающему, число занятых не меняется
+                future.set_result(None)
+                return
+        self.in_use -= 1
+
+
+class RateLimiter:
+    """Ограничитель частоты запросов (маркерное ведро) с очередью по приоритету
+
+    rate — запросов в секунду в среднем, burst — сколько можно сделать подряд.
+    pause() останавливает все запросы, например на время FloodWait.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.queue = []
+        self.counter = itertools.count()
+        self.changed = asyncio.Event()
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.notify()
+
+    async def acquire(self, priority: Optional[int] = None):
+        entry = (current_priority.get() if priority is None else priority, next(self.counter))
+        heapq.heappush(self.queue, entry)
+        try:
+            while True:
+                now = time.monotonic()
+                self.refill(now)
+                delay = None
+                if self.queue[0] == entry:
+                    delay = max(self.paused_until - now, (1 - self.tokens) / self.rate, 0)
+                    if delay == 0:
+                        self.tokens -= 1
+                        return
+                # Первый в очереди ждет маркер, остальные — смены первого
+                changed = self.changed
+                try:
+                    await asyncio.wait_for(changed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.queue.remove(entry)
+            heapq.heapify(self.queue)
+            self.notify()
+
+
+class Job:
+    """Регулярная задача: action — корутинная функция без аргументов"""
+
+    def __init__(self, name: str, schedule: str, action: Callable[[], Awaitable], priority: int = 50,
+                 max_concurrency: int = 1, catch_up: bool = True):
+        self.name = name
+        self.schedule = CronSchedule(schedule)
+        self.action = action
+        self.priority = priority
+        self.max_concurrency = max_concurrency
+        self.catch_up = catch_up
+        self.running = 0
+        self.next_run: Optional[datetime] = None
+
+
+class JobState(NamedTuple):
+    """Строка scheduler_jobs"""
+    name: str
+    schedule: str
+    last_scheduled: Optional[str]
+    last_started: Optional[str]
+    last_finished: Optional[str]
+    last_status: Optional[str]
+    last_error: Optional[str]
+    runs: int
+    failures: int
+
+
+def init_scheduler(conn):
+    """Таблица состояния задач планировщика"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS scheduler_jobs (
+            name TEXT PRIMARY KEY,
+            schedule TEXT,
+            last_scheduled TIMESTAMP,
+            last_started TIMESTAMP,
+            last_finished TIMESTAMP,
+            last_status TEXT, -- 'running', 'ok', 'failed', 'skipped'
+            last_error TEXT,
+            runs INTEGER DEFAULT 0,
+            failures INTEGER DEFAULT 0
+        )
+    ''')
+
+
+def load_job_states(conn) -> Dict[str, JobState]:
+    return {row[0]: JobState(*row) for row in conn.execute(f'SELECT {", ".join(JobState._fields)} FROM scheduler_jobs')}
+
+
+class Scheduler:
+    """Запуск задач по расписанию; max_running — сколько задач выполняется одновременно"""
+
+    def __init__(self, db_path: str, jobs: List[Job] = (), max_running: int = 2):
+        self.db_path = db_path
+        self.jobs: Dict[str, Job] = {}
+        self.gate = PriorityGate(max_running)
+        self.tasks: Set[asyncio.Task] = set()
+        self.stopping = asyncio.Event()
+        conn = sqlite3.connect(db_path)
+        try:
+            init_scheduler(conn)
+            conn.commit()
+        finally:
+            conn.close()
+        for job in jobs:
+            self.add(job)
+
+    def add(self, job: Job):
+        if job.name in self.jobs:
+            raise ValueError(f"Задача {job.name} уже добавлена")
+        self.jobs[job.name] = job
+
+    def record(self, job: Job, **fields):
+        """Обновление строки задачи; runs/failures передаются как приращения"""
+        increments = {key: fields.pop(key) for key in ('runs', 'failures') if key in fields}
+        columns = ['schedule', *fields]
+        values = [job.schedule.expression, *fields.values()]
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute(f'''
+                INSERT INTO scheduler_jobs (name, {", ".join(columns)}, runs, failures)
+                VALUES (?, {", ".join("?" * len(columns))}, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET
+                    {", ".join(f"{column} = excluded.{column}" for column in columns)},
+                    runs = runs + excluded.runs, failures = failures + excluded.failures
+            ''', [job.name, *values, increments.get('runs', 0), increments.get('failures', 0)])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def plan(self, now: datetime):
+        """Первые запуски по сохраненному состоянию: пропущенный запуск выполняется сразу"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            states = load_job_states(conn)
+        finally:
+            conn.close()
+        for job in self.jobs.values():
+            state = states.get(job.name)
+            job.next_run = job.schedule.next_after(now)
+            if state is None or state.last_scheduled is None or state.schedule != job.schedule.expression:
+                continue
+            missed = job.schedule.next_after(datetime.fromisoformat(state.last_scheduled))
+            if missed <= now and job.catch_up:
+                logger.info("Задача %s пропустила запуск %s, выполняется сейчас", job.name, missed,
+                            extra={'job': job.name})
+                job.next_run = missed
+
+    def start_due(self, now: datetime):
+        for job in self.jobs.values():
+            if job.next_run > now:
+                continue
+            scheduled = job.next_run
+            job.next_run = job.schedule.next_after(now)
+            if job.running >= job.max_concurrency:
+                logger.warning("Задача %s еще выполняется, запуск %s пропущен", job.name, scheduled,
+                               extra={'job': job.name})
+                self.record(job, last_scheduled=scheduled, last_status='skipped')
+                continue
+            task = asyncio.create_task(self.run_job(job, scheduled))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run_job(self, job: Job, scheduled: datetime):
+        """Выполнение задачи с ее приоритетом для общего лимита задач и запросов к API"""
+        job.running += 1
+        try:
+            await self.gate.acquire(job.priority)
+            try:
+                current_priority.set(job.priority)
+                started = datetime.now()
+                self.record(job, last_scheduled=scheduled, last_started=started, last_status='running')
+                logger.info("Задача %s запущена", job.name, extra={'job': job.name})
+                try:
+                    await job.action()
+                except asyncio.CancelledError:
+                    self.record(job, last_finished=datetime.now(), last_status='failed', last_error='отменена')
+                    raise
+                except Exception as e:
+                    logger.exception("Ошибка в задаче %s", job.name, extra={'job': job.name})
+                    self.record(job, last_finished=datetime.now(), last_status='failed', last_error=str(e),
+                                runs=1, failures=1)
+                else:
+                    self.record(job, last_finished=datetime.now(), last_status='ok', last_error=None, runs=1)
+                    logger.info("Задача %s выполнена за %.1f с", job.name,
+                                (datetime.now() - started).total_seconds(), extra={'job': job.name})
+            finally:
+                self.gate.release()
+        finally:
+            job.running -= 1
+
+    async def run(self):
+        """Цикл планировщика до вызова stop(); выполняющиеся задачи отменяются"""
+        self.plan(datetime.now())
+        try:
+            while not self.stopping.is_set():
+                now = datetime.now()
+                self.start_due(now)
+                if not self.jobs:
+                    delay = MAX_SLEEP_SECONDS
+                else:
+                    next_run = min(job.next_run for job in self.jobs.values())
+                    delay = min(max((next_run - now).total_seconds(), 0), MAX_SLEEP_SECONDS)
+                try:
+                    await asyncio.wait_for(self.stopping.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in list(self.tasks):
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def stop(self):
+        self.stopping.set()
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    from storage import default_db_path
+
+    parser = argparse.ArgumentParser(description='Регулярный сбор статистики каналов по расписанию')
+    parser.add_argument('channels', nargs='+', help='username каналов')
+    parser.add_argument('--db', default=default_db_path(), help='база SQLite')
+    parser.add_argument('--snapshots', default='@hourly', help='расписание снимков числа участников ("" — отключить)')
+    parser.add_argument('--members', default='30 1 * * *', help='расписание полного сбора участников')
+    parser.add_argument('--export', default='0 3 * * *', help='расписание сводных отчетов')
+    parser.add_argument('--admin-log', default='', help='расписание чтения журнала администраторов '
+                                                          '(для своих каналов, например "*/15 * * * *")')
+    parser.add_argument('--monitor', action='store_true', help='вести живой мониторинг в том же процессе')
+    parser.add_argument('--rate', type=float, default=5.0, help='запросов к API в секунду на все задачи')
+    parser.add_argument('--burst', type=int, default=10, help='запросов подряд без ожидания')
+    parser.add_argument('--max-running', type=int, default=2, help='задач одновременно')
+    return parser.parse_args(argv)
+
+
+def build_jobs(args, monitor, collector) -> List[Job]:
+    """Стандартные задачи: снимки, полный сбор участников, сводные отчеты, журнал администраторов"""
+    from export_data import DataExporter
+    from admin_log import ingest_admin_logs
+
+    async def snapshots():
+        for channel in args.channels:
+            await monitor.take_snapshot(channel)
+
+    async def members():
+        results = await collector.collect_channels(args.channels, concurrency=2)
+        failed = [result.channel_username for result in results if not result.ok]
+        if failed:
+            raise RuntimeError(f"Не собраны каналы: {', '.join(failed)}")
+
+    async def export():
+        exporter = DataExporter(args.db)
+        loop = asyncio.get_running_loop()
+        for channel in args.channels:
+            await loop.run_in_executor(None, exporter.create_summary_report, channel)
+
+    async def admin_log():
+        channels = [await monitor.client.get_entity(channel) for channel in args.channels]
+        await ingest_admin_logs(monitor.client, args.db, channels)
+
+    specs = [
+        ('snapshots', args.snapshots, snapshots, PRIORITY_SNAPSHOTS),
+        ('admin_log', args.admin_log, admin_log, PRIORITY_ADMIN_LOG),
+        ('members', args.members, members, PRIORITY_MEMBERS),
+        ('export', args.export, export, PRIORITY_EXPORT),
+    ]
+    return [Job(name, schedule, action, priority) for name, schedule, action, priority in specs if schedule]
+
+
+async def run(args):
+    from telegram_monitor import TelegramChannelMonitor
+    from stats_collector import StatsCollector
+
+    monitor = TelegramChannelMonitor(args.db)
+    collector = StatsCollector(args.db)
+    await monitor.connect()
+    # Один клиент и один ограничитель на все задачи и живой мониторинг
+    monitor.client.rate_limiter = RateLimiter(args.rate, args.burst)
+    collector.client = monitor.client
+
+    scheduler = Scheduler(args.db, build_jobs(args, monitor, collector), args.max_running)
+    tasks = [asyncio.create_task(scheduler.run())]
+    if args.monitor:
+        tasks.append(asyncio.create_task(monitor.start_monitoring(args.channels)))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        scheduler.stop()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await monitor.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from log_config import setup_logging
+
+    args = parse_args(argv)
+    setup_logging()
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        logger.info("Планировщик остановлен")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
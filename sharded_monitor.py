@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+Мониторинг каналов с распределением обработки событий по процессам
+"""
+
+import os
+import asyncio
+import logging
+import queue
+import sqlite3
+import time
+import multiprocessing as mp
+from datetime import datetime
+from typing import List, Dict, Optional
+from telethon import events, utils
+from telethon.extensions import BinaryReader
+from telethon.tl import types
+from telegram_monitor import TelegramChannelMonitor, ChangeRow, write_changes, log_change, start_metrics_server
+from event_dedup import RecentEventCache
+from metrics import EVENTS_RECEIVED, EVENTS_WRITTEN, EVENTS_DUPLICATE, DB_WRITE_SECONDS, QUEUE_DEPTH
+from log_config import configure_loggers, setup_logging, start_process_log_listener
+
+logger = logging.getLogger(__name__)
+
+# Маркер остановки для процессов-обработчиков и процесса записи
+STOP = None
+
+# Обновления, из которых извлекаются подписки и отписки
+RAW_UPDATE_TYPES = (types.UpdateChannelParticipant, types.UpdateNewChannelMessage)
+
+
+def shard_for(channel_id: int, num_shards: int) -> int:
+    """Номер шарда для канала: все события канала попадают в один процесс"""
+    return channel_id % num_shards
+
+
+def raw_channel_id(update) -> Optional[int]:
+    """ID канала (без префикса -100) для сырого обновления"""
+    if isinstance(update, types.UpdateChannelParticipant):
+        return update.channel_id
+    message = getattr(update, 'message', None)
+    if isinstance(message, types.MessageService) and isinstance(message.peer_id, types.PeerChannel):
+        return message.peer_id.channel_id
+    return None
+
+
+def raw_user_ids(update) -> List[int]:
+    """ID пользователей, чье членство меняет сырое обновление"""
+    if isinstance(update, types.UpdateChannelParticipant):
+        return [update.user_id]
+    message = update.message
+    action = message.action
+    if isinstance(action, types.MessageActionChatAddUser):
+        return list(action.users)
+    if isinstance(action, types.MessageActionChatDeleteUser):
+        return [action.user_id]
+    if isinstance(action, (types.MessageActionChatJoinedByLink, types.MessageActionChatJoinedByRequest)) \
+            and message.from_id:
+        return [utils.get_peer_id(message.from_id, add_mark=False)]
+    return []
+
+
+def changes_from_update(update, users: Dict[int, tuple], received_at: datetime) -> List[ChangeRow]:
+    """Строки изменений из сырого обновления (та же классификация, что у ChatAction)"""
+    if isinstance(update, types.UpdateChannelParticipant):
+        # Повышения и понижения приходят с обоими участниками и не считаются
+        if bool(update.new_participant) == bool(update.prev_participant):
+            return []
+        change_type = 'joined' if update.new_participant else 'left'
+        changed = [(update.user_id, change_type)]
+        channel_id = update.channel_id
+        key = f"qts:{update.qts}"
+    else:
+        message = update.message
+        action = message.action
+        sender_id = utils.get_peer_id(message.from_id, add_mark=False) if message.from_id else None
+        if isinstance(action, types.MessageActionChatAddUser):
+            changed = [(user_id, 'joined') for user_id in action.users]
+        elif isinstance(action, (types.MessageActionChatJoinedByLink, types.MessageActionChatJoinedByRequest)):
+            changed = [(sender_id, 'joined')] if sender_id else []
+        elif isinstance(action, types.MessageActionChatDeleteUser):
+            changed = [(action.user_id, 'left')]
+        else:
+            return []
+        channel_id = message.peer_id.channel_id
+        key = f"msg:{message.id}"
+
+    return [
+        ChangeRow(channel_id, user_id, change_type, received_at, *users.get(user_id, (None, None, None)), event_key=key)
+        for user_id, change_type in changed
+    ]
+
+
+def shard_worker(shard_id: int, in_queue, out_queue, log_queue=None):
+    """Процесс-обработчик шарда: разбор и классификация обновлений своих каналов
+
+    Приемник передает сериализованные TL-обновления; разбор, извлечение
+    строк изменений и логирование выполняются здесь, параллельно по шардам.
+    """
+    if log_queue is not None:
+        configure_loggers(log_queue)
+
+    while True:
+        batch = in_queue.get()
+        if batch is STOP:
+            out_queue.put(STOP)
+            break
+
+        rows = []
+        for data, users, received_at in batch:
+            try:
+                update = BinaryReader(data).tgread_object()
+                rows.extend(changes_from_update(update, users, received_at))
+            except Exception:
+                logger.exception("Ошибка при обработке обновления в шарде %s", shard_id)
+
+        for row in rows:
+            log_change(row, shard=shard_id)
+
+        if rows:
+            out_queue.put(rows)
+
+
+def flush_pending(conn, pending: List[ChangeRow], recent_events: RecentEventCache, stats_queue=None) -> bool:
+    """Попытка записи накопленных изменений; False, если запись нужно повторить"""
+    try:
+        start = time.perf_counter()
+        written = write_changes(conn, pending, recent_events)
+        if stats_queue is not None:
+            # Метрики процесса записи передаются в главный процесс раз на пакет
+            stats_queue.put((len(written), len(pending) - len(written), time.perf_counter() - start))
+        return True
+    except sqlite3.OperationalError as e:
+        # Блокировка базы другим процессом: изменения остаются в очереди записи
+        conn.rollback()
+        logger.warning("Запись %s изменений отложена: %s", len(pending), e)
+        return False
+    except sqlite3.Error as e:
+        conn.rollback()
+        logger.error("Ошибка при записи %s изменений, пакет пропущен: %s", len(pending), e)
+        return True
+
+
+def writer_process(db_path: str, out_queue, num_shards: int, batch_size: int, flush_interval: float,
+                   stats_queue=None, final_retries: int = 10, log_queue=None):
+    """Центральный процесс записи: пакетная вставка изменений от всех шардов"""
+    if log_queue is not None:
+        configure_loggers(log_queue)
+
+    # Дедупликация выполняется здесь: ключ запоминается только после фиксации записи
+    recent_events = RecentEventCache()
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+
+    pending = []
+    stopped = 0
+    last_flush = time.monotonic()
+
+    try:
+        while stopped < num_shards:
+            try:
+                item = out_queue.get(timeout=flush_interval)
+            except queue.Empty:
+                item = []
+
+            if item is STOP:
+                stopped += 1
+            else:
+                pending.extend(item)
+
+            if pending and (len(pending) >= batch_size
+                            or time.monotonic() - last_flush >= flush_interval):
+                if flush_pending(conn, pending, recent_events, stats_queue):
+                    pending = []
+                last_flush = time.monotonic()
+
+        # Дозапись остатка при остановке
+        for _ in range(final_retries):
+            if not pending or flush_pending(conn, pending, recent_events, stats_queue):
+                pending = []
+                break
+            time.sleep(1)
+
+        if pending:
+            logger.error("Не удалось записать %s изменений при остановке", len(pending))
+    finally:
+        conn.close()
+
+
+class ShardedChannelMonitor(TelegramChannelMonitor):
+    """Монитор, распределяющий каналы по процессам-обработчикам
+
+    Сессия Telegram принадлежит одному клиенту, поэтому прием и декодирование
+    MTProto остаются в главном процессе. Он только раскладывает сырые
+    обновления по шардам (channel_id % num_shards); разбор, классификация
+    и форматирование выполняются в процессах шардов, дедупликация и пакетная
+    запись в базу — в отдельном процессе записи.
+    """
+
+    def __init__(self, num_shards: Optional[int] = None, batch_size: int = 500, flush_interval: float = 0.05,
+                 stop_timeout: float = 30.0, db_path: Optional[str] = None):
+        super().__init__(db_path)
+        self.num_shards = num_shards or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stop_timeout = stop_timeout
+        self.out_queue = None
+        self.stats_queue = None
+        self.log_queue = None
+        self.log_listener = None
+        self.shard_queues = []
+        self.shard_processes = []
+        self.writer = None
+        self.pending: Dict[int, List[tuple]] = {}
+
+    def start_workers(self):
+        """Запуск процессов-обработчиков и процесса записи"""
+        ctx = mp.get_context('spawn')
+        self.out_queue = ctx.Queue()
+        self.stats_queue = ctx.Queue()
+        self.log_queue, self.log_listener = start_process_log_listener(ctx)
+
+        self.writer = ctx.Process(
+            target=writer_process,
+            args=(self.db_path, self.out_queue, self.num_shards, self.batch_size, self.flush_interval,
+                  self.stats_queue, 10, self.log_queue),
+            name='monitor-writer'
+        )
+        self.writer.start()
+
+        for shard_id in range(self.num_shards):
+            in_queue = ctx.Queue()
+            worker = ctx.Process(
+                target=shard_worker,
+                args=(shard_id, in_queue, self.out_queue, self.log_queue),
+                name=f'monitor-shard-{shard_id}'
+            )
+            worker.start()
+            self.shard_queues.append(in_queue)
+            self.shard_processes.append(worker)
+            self.pending[shard_id] = []
+
+        logger.info("Запущено шардов: %s", self.num_shards)
+
+    def dispatch_update(self, update):
+        """Постановка сырого обновления в очередь шарда его канала"""
+        channel_id = raw_channel_id(update)
+        if channel_id is None or channel_id not in self.monitored_channels:
+            return
+
+        # Событие еще не записано, но уже отражено в составе, получаемом сверкой
+        if channel_id in self.reconciling:
+            self.note_live_changes(channel_id, raw_user_ids(update))
+
+        # Профили пользователей из сущностей обновления, чтобы шарду не нужен был клиент
+        entities = getattr(update, '_entities', None) or {}
+        users = {
+            entity.id: (entity.username, entity.first_name, entity.last_name)
+            for entity in entities.values() if isinstance(entity, types.User)
+        }
+
+        EVENTS_RECEIVED.inc()
+        shard_id = shard_for(channel_id, self.num_shards)
+        pending = self.pending[shard_id]
+        pending.append((bytes(update), users, datetime.now()))
+        if len(pending) >= self.batch_size:
+            self.flush_shard(shard_id)
+
+    def flush_shard(self, shard_id: int):
+        """Отправка накопленных обновлений в процесс шарда"""
+        batch = self.pending[shard_id]
+        if batch:
+            self.pending[shard_id] = []
+            self.shard_queues[shard_id].put(batch)
+
+    def queued_batches(self) -> int:
+        """Пакетов в очередях между процессами (приблизительно)"""
+        try:
+            return sum(q.qsize() for q in self.shard_queues) + self.out_queue.qsize()
+        except NotImplementedError:
+            # qsize недоступен на macOS
+            return 0
+
+    def collect_writer_stats(self):
+        """Перенос метрик процесса записи в метрики главного процесса"""
+        while True:
+            try:
+                written, duplicates, seconds = self.stats_queue.get_nowait()
+            except queue.Empty:
+                break
+            EVENTS_WRITTEN.inc(written)
+            EVENTS_DUPLICATE.inc(duplicates)
+            DB_WRITE_SECONDS.observe(seconds)
+
+    async def flush_loop(self):
+        """Периодическая отправка накопленных обновлений по шардам"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            for shard_id in self.pending:
+                self.flush_shard(shard_id)
+            self.collect_writer_stats()
+            QUEUE_DEPTH.set(self.queued_batches())
+
+    @staticmethod
+    def join_process(process, timeout: float):
+        """Ожидание завершения процесса с принудительной остановкой по таймауту"""
+        process.join(timeout)
+        if process.is_alive():
+            logger.warning("Процесс %s не завершился за %s с, останавливаем", process.name, timeout)
+            process.terminate()
+            process.join()
+
+    def stop_workers(self):
+        """Остановка процессов с дозаписью накопленных изменений"""
+        for shard_id, shard_queue in enumerate(self.shard_queues):
+            self.flush_shard(shard_id)
+            shard_queue.put(STOP)
+
+        for process in self.shard_processes:
+            self.join_process(process, self.stop_timeout)
+
+        if self.writer is not None:
+            # Если шард завершился аварийно, его STOP не придет
+            if any(process.exitcode != 0 for process in self.shard_processes):
+                for _ in range(self.num_shards):
+                    self.out_queue.put(STOP)
+            self.join_process(self.writer, self.stop_timeout)
+
+        if self.log_listener is not None:
+            self.log_listener.stop()
+
+        self.out_queue = None
+        self.stats_queue = None
+        self.log_queue = None
+        self.log_listener = None
+        self.shard_queues = []
+        self.shard_processes = []
+        self.writer = None
+        self.pending = {}
+
+    async def start_monitoring(self, channel_usernames: List[str]):
+        """Начало мониторинга каналов с обработкой событий в шардах"""
+        if not self.client:
+            await self.connect()
+
+        self.start_workers()
+
+        @self.client.on(events.Raw(types=list(RAW_UPDATE_TYPES)))
+        async def handle_raw_update(update):
+            try:
+                self.dispatch_update(update)
+            except Exception:
+                logger.exception("Ошибка при обработке обновления")
+
+        await self.resolve_channels(channel_usernames)
+        start_metrics_server()
+
+        flush_task = asyncio.create_task(self.flush_loop())
+        reconcile_task = self.start_reconciliation()
+        # pts живых обновлений не отмечается: их запись идет в других процессах,
+        # и догрузка начинается с pts, сохраненного прошлой догрузкой
+        catch_up_task = self.start_catch_up()
+
+        logger.info("Мониторинг запущен", extra={'channels': len(self.monitored_channels), 'shards': self.num_shards})
+        try:
+            await self.supervise()
+        except KeyboardInterrupt:
+            logger.info("Мониторинг остановлен")
+        finally:
+            flush_task.cancel()
+            reconcile_task.cancel()
+            catch_up_task.cancel()
+            await asyncio.get_running_loop().run_in_executor(None, self.stop_workers)
+            self.save_pts()
+
+
+async def main():
+    """Запуск шардированного мониторинга"""
+    setup_logging()
+    num_shards = int(os.getenv('MONITOR_SHARDS', '0')) or None
+    monitor = ShardedChannelMonitor(num_shards=num_shards)
+
+    # Список каналов для мониторинга
+    channels_to_monitor = [
+        "shemaxpoetry",
+        "durov",
+        "telegram",
+    ]
+
+    try:
+        await monitor.start_monitoring(channels_to_monitor)
+    except Exception:
+        logger.exception("Ошибка при запуске мониторинга")
+    finally:
+        await monitor.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
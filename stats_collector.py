@@ -0,0 +1,389 @@
+"""
+Сборщик участников каналов без зависимости от интерфейса
+
+Результаты возвращаются значениями, ход сбора — через обратный вызов
+on_progress или асинхронный итератор iter_collect_members. Streamlit-приложение
+(telegram_stats.py) только отображает их.
+"""
+
+import os
+import asyncio
+import logging
+import sqlite3
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Dict, List, NamedTuple, Optional, Tuple
+from telethon import TelegramClient
+from telethon.tl.functions.channels import GetParticipantsRequest
+from telethon.tl.types import ChannelParticipantsSearch
+from dotenv import load_dotenv
+from metrics import COLLECTION_PAGES, api_call
+from channel_rollups import init_rollups, remember_channel, resolve_channel_id
+from storage import default_db_path
+from user_profiles import init_profiles, record_profiles
+from cohorts import init_cohorts
+from audience_overlap import init_audiences, refresh_audiences
+from member_ids import to_id_array
+from membership_log import MembershipLog, init_membership_log, membership_log_dir
+from member_arrays import MemberArrays, member_arrays_dir, sync_member_arrays
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Загружаем переменные окружения
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 200
+
+
+class CollectionProgress(NamedTuple):
+    """Ход сбора: stage — 'page' после каждой страницы, 'done' или 'error' в конце"""
+    channel_username: str
+    stage: str
+    collected: int
+    total: Optional[int] = None
+    error: Optional[str] = None
+
+
+class CollectionResult(NamedTuple):
+    """Итог сбора участников канала"""
+    channel_username: str
+    channel_id: Optional[int]
+    collected: int
+    total: Optional[int]
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+ProgressCallback = Callable[[CollectionProgress], None]
+
+
+class StatsCollector:
+    """Сбор участников каналов и чтение накопленной статистики"""
+
+    def __init__(self, db_path: Optional[str] = None, session_name: str = 'session_name'):
+        self.api_id = os.getenv('TELEGRAM_API_ID')
+        self.api_hash = os.getenv('TELEGRAM_API_HASH')
+        self.phone = os.getenv('TELEGRAM_PHONE')
+        self.client = None
+        self.db_path = db_path or default_db_path()
+        self.session_name = session_name
+        self.init_database()
+
+    def init_database(self):
+        """Инициализация базы данных"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        # Таблица для хранения участников канала
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS channel_members (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel_id INTEGER,
+                user_id INTEGER,
+                username TEXT,
+                first_name TEXT,
+                last_name TEXT,
+                joined_date TIMESTAMP,
+                left_date TIMESTAMP,
+                is_active BOOLEAN DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Таблица для хранения истории изменений
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS member_changes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel_id INTEGER,
+                user_id INTEGER,
+                change_type TEXT, -- 'joined' или 'left'
+                change_date TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Статистика считается по одному каналу
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_channel_members_channel ON channel_members (channel_id, is_active)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_member_changes_channel ON member_changes (channel_id, change_date)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_channel_members_user ON channel_members (channel_id, user_id)')
+
+        # Справочник каналов и агрегаты обзорной панели
+        init_rollups(conn)
+        init_profiles(conn)
+        init_cohorts(conn)
+        init_audiences(conn)
+        init_membership_log(conn)
+
+        conn.commit()
+        conn.close()
+
+    async def connect(self):
+        """Подключение к Telegram API"""
+        if not all([self.api_id, self.api_hash, self.phone]):
+            raise ValueError("Необходимо указать TELEGRAM_API_ID, TELEGRAM_API_HASH и TELEGRAM_PHONE в .env файле")
+
+        self.client = TelegramClient(self.session_name, self.api_id, self.api_hash)
+        await self.client.start(phone=self.phone)
+
+        if not await self.client.is_user_authorized():
+            await self.client.send_code_request(self.phone)
+            code = input('Введите код подтверждения: ')
+            await self.client.sign_in(self.phone, code)
+
+    async def get_channel_info(self, channel_username: str):
+        """Получение информации о канале (исключение при ошибке)"""
+        if not self.client:
+            await self.connect()
+        return await self.client.get_entity(channel_username)
+
+    async def collect_members(self, channel_username: str,
+                              on_progress: Optional[ProgressCallback] = None) -> CollectionResult:
+        """Сбор участников канала с сохранением в базу
+
+        Ошибки не поднимаются, а возвращаются в CollectionResult.error и
+        передаются в on_progress со stage='error'.
+        """
+        collected, total, channel_id = 0, None, None
+
+        def report(stage: str, error: Optional[str] = None):
+            if on_progress is not None:
+                on_progress(CollectionProgress(channel_username, stage, collected, total, error))
+
+        try:
+            channel = await self.get_channel_info(channel_username)
+            channel_id = channel.id
+
+            # Получаем всех участников канала
+            participants = []
+            offset = 0
+
+            while True:
+                participants_chunk = await api_call(self.client, GetParticipantsRequest(
+                    channel=channel,
+                    filter=ChannelParticipantsSearch(''),
+                    offset=offset,
+                    limit=PAGE_SIZE,
+                    hash=0
+                ))
+                COLLECTION_PAGES.inc()
+                total = getattr(participants_chunk, 'count', total)
+
+                if not participants_chunk.users:
+                    break
+
+                participants.extend(participants_chunk.users)
+                offset += len(participants_chunk.users)
+                collected = len(participants)
+                report('page')
+
+                if len(participants_chunk.users) < PAGE_SIZE:
+                    break
+
+            # Если сервер отдал не всех участников, отсутствующие не считаются отписавшимися
+            self.save_members(channel_id, participants, channel_username,
+                              complete=total is None or len(participants) >= total)
+        except Exception as e:
+            logger.exception("Ошибка при сборе участников канала %s", channel_username)
+            report('error', str(e))
+            return CollectionResult(channel_username, channel_id, collected, total, str(e))
+
+        logger.info("Собрано %s участников канала %s", collected, channel_username,
+                    extra={'channel_id': channel_id, 'members': collected})
+        report('done')
+        return CollectionResult(channel_username, channel_id, collected, total)
+
+    def save_members(self, channel_id: int, participants: list, channel_username: Optional[str] = None,
+                     complete: bool = True):
+        """Сохранение участников в базу данных одной транзакцией
+
+        Разница с прошлым сбором дописывается в журнал состава (membership_log),
+        новые ID — в массивы участников для mmap (member_arrays).
+        """
+        current_time = datetime.now()
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            if channel_username:
+                remember_channel(conn, channel_id, channel_username)
+            conn.executemany('''
+                INSERT OR REPLACE INTO channel_members
+                (channel_id, user_id, username, first_name, last_name, joined_date, is_active)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [
+                (channel_id, participant.id, participant.username, participant.first_name,
+                 participant.last_name, current_time, 1)
+                for participant in participants
+            ])
+            # История профилей: запись только для изменившихся, постранично
+            changed = 0
+            for begin in range(0, len(participants), PAGE_SIZE):
+                changed += record_profiles(conn, [
+                    (participant.id, participant.username, participant.first_name, participant.last_name)
+                    for participant in participants[begin:begin + PAGE_SIZE]
+                ], current_time, channel_id)
+            # Составы для пересечения аудиторий дополняются только что записанными участниками
+            refresh_audiences(conn)
+            sync_member_arrays(conn, MemberArrays(member_arrays_dir(self.db_path)))
+            MembershipLog(membership_log_dir(self.db_path)).record(
+                conn, channel_id, to_id_array(participant.id for participant in participants), current_time, complete)
+            conn.commit()
+            logger.debug("Изменившихся профилей: %s", changed, extra={'channel_id': channel_id})
+        finally:
+            conn.close()
+
+    async def iter_collect_members(self, channel_username: str) -> AsyncIterator[CollectionProgress]:
+        """Сбор участников как асинхронный поток событий хода сбора"""
+        progress: asyncio.Queue = asyncio.Queue()
+        task = asyncio.ensure_future(self.collect_members(channel_username, progress.put_nowait))
+        try:
+            while True:
+                event = await progress.get()
+                yield event
+                if event.stage in ('done', 'error'):
+                    break
+        finally:
+            if not task.done():
+                task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def collect_channels(self, channel_usernames: List[str], concurrency: int = 4,
+                               on_progress: Optional[ProgressCallback] = None) -> List[CollectionResult]:
+        """Сбор нескольких каналов через один клиент с ограничением параллельности"""
+        if not self.client:
+            await self.connect()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def collect(channel_username: str) -> CollectionResult:
+            async with semaphore:
+                return await self.collect_members(channel_username, on_progress)
+
+        return await asyncio.gather(*(collect(channel_username) for channel_username in channel_usernames))
+
+    def get_member_changes(self, channel_username: str, start_date: datetime, end_date: datetime) -> 'pd.DataFrame':
+        """Получение изменений участников за период"""
+        import pandas as pd
+
+        conn = sqlite3.connect(self.db_path)
+
+        query = '''
+            SELECT
+                mc.change_type,
+                mc.change_date,
+                cm.username,
+                cm.first_name,
+                cm.last_name
+            FROM member_changes mc
+            JOIN channel_members cm ON mc.user_id = cm.user_id
+            WHERE mc.change_date BETWEEN ? AND ?
+            ORDER BY mc.change_date
+        '''
+
+        df = pd.read_sql_query(query, conn, params=[start_date, end_date])
+        conn.close()
+        return df
+
+    def get_daily_changes(self, channel_username: str, start_date: datetime, end_date: datetime) -> 'pd.DataFrame':
+        """Подписки и отписки канала по дням (агрегация в SQLite)"""
+        import pandas as pd
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            channel_id = resolve_channel_id(conn, channel_username)
+            return pd.read_sql_query('''
+                SELECT
+                    DATE(change_date) AS date,
+                    SUM(change_type = 'joined') AS joined,
+                    SUM(change_type = 'left') AS "left"
+                FROM member_changes
+                WHERE channel_id = ? AND change_date BETWEEN ? AND ?
+                GROUP BY DATE(change_date)
+                ORDER BY date
+            ''', conn, params=[channel_id, start_date, end_date])
+        finally:
+            conn.close()
+
+    def get_member_changes_page(self, channel_username: str, start_date: datetime, end_date: datetime,
+                                limit: int = 100, offset: int = 0) -> Tuple['pd.DataFrame', int]:
+        """Страница изменений участников канала и общее число изменений за период"""
+        import pandas as pd
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            channel_id = resolve_channel_id(conn, channel_username)
+            params = [channel_id, start_date, end_date]
+            total = conn.execute(
+                'SELECT COUNT(*) FROM member_changes WHERE channel_id = ? AND change_date BETWEEN ? AND ?', params
+            ).fetchone()[0]
+
+            # Сначала выбирается страница, затем к ее строкам подтягиваются имена
+            df = pd.read_sql_query('''
+                WITH page AS (
+                    SELECT id, channel_id, user_id, change_type, change_date
+                    FROM member_changes
+                    WHERE channel_id = ? AND change_date BETWEEN ? AND ?
+                    ORDER BY change_date, id
+                    LIMIT ? OFFSET ?
+                )
+                SELECT
+                    page.change_type,
+                    page.change_date,
+                    cm.username,
+                    cm.first_name,
+                    cm.last_name
+                FROM page
+                LEFT JOIN channel_members cm ON cm.id = (
+                    SELECT MAX(id) FROM channel_members
+                    WHERE channel_id = page.channel_id AND user_id = page.user_id
+                )
+                ORDER BY page.change_date, page.id
+            ''', conn, params=params + [limit, offset])
+        finally:
+            conn.close()
+        return df, total
+
+    def get_current_stats(self, channel_username: str) -> Dict:
+        """Получение текущей статистики канала"""
+        import pandas as pd
+
+        conn = sqlite3.connect(self.db_path)
+        channel_id = resolve_channel_id(conn, channel_username)
+
+        # Общее количество участников
+        total_members = pd.read_sql_query(
+            'SELECT COUNT(*) as count FROM channel_members WHERE channel_id = ? AND is_active = 1',
+            conn,
+            params=[channel_id]
+        ).iloc[0]['count']
+
+        # Участники за последние 30 дней
+        thirty_days_ago = datetime.now() - timedelta(days=30)
+        new_members = pd.read_sql_query(
+            'SELECT COUNT(*) as count FROM channel_members WHERE channel_id = ? AND joined_date >= ? AND is_active = 1',
+            conn,
+            params=[channel_id, thirty_days_ago]
+        ).iloc[0]['count']
+
+        # Участники, покинувшие за последние 30 дней
+        left_members = pd.read_sql_query(
+            'SELECT COUNT(*) as count FROM member_changes WHERE channel_id = ? AND change_type = "left" AND change_date >= ?',
+            conn,
+            params=[channel_id, thirty_days_ago]
+        ).iloc[0]['count']
+
+        conn.close()
+
+        return {
+            'total_members': total_members,
+            'new_members_30d': new_members,
+            'left_members_30d': left_members,
+            'net_growth_30d': new_members - left_members
+        }
+
+    async def close(self):
+        """Закрытие соединения"""
+        if self.client:
+            await self.client.disconnect()
@@ -1,25 +1,165 @@
 import os
+import random
 import asyncio
+import logging
 import sqlite3
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
-import pandas as pd
-from telethon import TelegramClient, events
+from typing import TYPE_CHECKING, List, Dict, Optional, NamedTuple
+import numpy as np
+from telethon import TelegramClient, events, utils
 from telethon.tl.types import Channel, User, UpdateChannel
 from telethon.tl.functions.channels import GetParticipantsRequest
 from telethon.tl.types import ChannelParticipantsSearch
 from dotenv import load_dotenv
+from member_ids import to_id_array, pack_ids, unpack_ids, diff_ids
+from event_dedup import RecentEventCache, event_key
+from metrics import (
+    EVENTS_RECEIVED, EVENTS_WRITTEN, EVENTS_DUPLICATE, DB_WRITE_SECONDS, COLLECTION_PAGES, JOIN_BURSTS,
+    api_call, start_metrics_server
+)
+from log_config import EVENTS_LOGGER, setup_logging
+from channel_rollups import init_rollups, remember_channel
+from storage import default_db_path
+from user_profiles import init_profiles, record_profiles
+from burst_detector import BurstDetector, init_bursts, save_bursts
+from distinct_users import init_sketches, update_sketches
+from channel_difference import (
+    CATCH_UP_CONCURRENCY, catch_up_channels, init_channel_pts, load_channel_pts, save_channel_pts
+)
+
+if TYPE_CHECKING:
+    # pandas нужен только отчетам; живой мониторинг его не загружает
+    import pandas as pd
 
 load_dotenv('telega.env')
 
+logger = logging.getLogger(__name__)
+events_logger = logging.getLogger(EVENTS_LOGGER)
+
+class ChangeRow(NamedTuple):
+    """Строка изменения в real_time_changes (порядок полей совпадает с INSERT_CHANGE_SQL)"""
+    channel_id: int
+    user_id: int
+    change_type: str
+    change_date: datetime
+    username: Optional[str]
+    first_name: Optional[str]
+    last_name: Optional[str]
+    event_key: Optional[str] = None
+    is_reconciled: bool = False
+
+INSERT_CHANGE_SQL = f'''
+    INSERT OR IGNORE INTO real_time_changes 
+    ({', '.join(ChangeRow._fields)})
+    VALUES ({', '.join('?' * len(ChangeRow._fields))})
+'''
+
+# Период проверки затихших всплесков подписок, секунд
+BURST_CHECK_SECONDS = 15
+
+# Паузы между попытками переподключения: экспоненциально, со случайным разбросом
+RECONNECT_BASE_SECONDS = 1
+RECONNECT_MAX_SECONDS = 300
+
+
+def reconnect_delay(attempt: int) -> float:
+    """Пауза перед попыткой attempt (с нуля): случайная в пределах удвоенной предыдущей"""
+    return random.uniform(0, min(RECONNECT_MAX_SECONDS, RECONNECT_BASE_SECONDS * 2 ** attempt))
+
+
+def write_changes(conn, rows: List[ChangeRow], recent_events: Optional[RecentEventCache] = None) -> List[ChangeRow]:
+    """Запись изменений с отбрасыванием уже записанных событий
+
+    Ключи событий попадают в кэш только после успешной фиксации транзакции,
+    чтобы неудачная запись не помечала событие как обработанное.
+    Возвращает фактически переданные на запись строки.
+    """
+    received = len(rows)
+    if recent_events is not None:
+        rows = [row for row in rows if dedup_key(row) not in recent_events]
+    EVENTS_DUPLICATE.inc(received - len(rows))
+    if not rows:
+        return rows
+    
+    with DB_WRITE_SECONDS.time():
+        conn.executemany(INSERT_CHANGE_SQL, rows)
+        # Восстановленные сверкой отписки приходят без профиля
+        profiles: Dict[int, list] = {}
+        for row in rows:
+            if row.username or row.first_name or row.last_name:
+                profiles.setdefault(row.channel_id, []).append((row.user_id, row.username, row.first_name, row.last_name))
+        for channel_id, users in profiles.items():
+            record_profiles(conn, users, channel_id=channel_id)
+        # Скетчи уникальных пользователей по дням: день как DATE(change_date) в агрегатах
+        update_sketches(conn, [(row.channel_id, row.change_date.strftime('%Y-%m-%d'), row.change_type, row.user_id)
+                               for row in rows])
+        conn.commit()
+    EVENTS_WRITTEN.inc(len(rows))
+    
+    if recent_events is not None:
+        for row in rows:
+            key = dedup_key(row)
+            if key is not None:
+                recent_events.add(key)
+    return rows
+
+
+def dedup_key(row: ChangeRow) -> Optional[tuple]:
+    """Ключ идемпотентности изменения; None, если у обновления нет стабильного ключа"""
+    if row.event_key is None:
+        return None
+    return (row.channel_id, row.user_id, row.change_type, row.event_key)
+
+
+def log_change(row: ChangeRow, **fields):
+    """Запись изменения в лог событий (с выборкой, см. EVENT_LOG_SAMPLE)"""
+    if not events_logger.isEnabledFor(logging.INFO):
+        return
+    events_logger.info(
+        "%s %s", row.username or row.first_name or row.user_id, row.change_type,
+        extra={
+            'channel_id': row.channel_id,
+            'user_id': row.user_id,
+            'change_type': row.change_type,
+            'event_key': row.event_key,
+            **fields,
+        }
+    )
+
+
+class ReconnectAwareClient(TelegramClient):
+    """TelegramClient, уведомляющий об автоматических переподключениях
+
+    Telethon переподключается внутри MTProtoSender незаметно для
+    is_connected(); единственный сигнал — вызов _handle_auto_reconnect.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reconnect_callbacks = []
+    
+    async def _handle_auto_reconnect(self):
+        await super()._handle_auto_reconnect()
+        for callback in getattr(self, 'reconnect_callbacks', []):
+            callback()
+
+
 class TelegramChannelMonitor:
-    def __init__(self):
+    def __init__(self, db_path: Optional[str] = None):
         self.api_id = os.getenv('TELEGRAM_API_ID')
         self.api_hash = os.getenv('TELEGRAM_API_HASH')
         self.phone = os.getenv('TELEGRAM_PHONE')
         self.client = None
-        self.db_path = 'telegram_stats.db'
+        self.db_path = db_path or default_db_path()
         self.monitored_channels = set()
+        self.channel_entities = {}
+        self.recent_events = RecentEventCache()
+        self.reconciling: Dict[int, set] = {}
+        self.reconcile_requested = None
+        self.burst_detector = BurstDetector()
+        self.channel_pts: Dict[int, int] = {}
+        self.catch_up_requested = None
+        self.stopping = False
         self.init_database()
     
     def init_database(self):
@@ -54,6 +194,37 @@ class TelegramChannelMonitor:
             )
         ''')
         
+        # Последний известный состав канала для сверки после простоя
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS member_state (
+                channel_id INTEGER PRIMARY KEY,
+                member_ids BLOB,
+                member_count INTEGER,
+                last_change_id INTEGER,
+                updated_at TIMESTAMP
+            )
+        ''')
+        
+        # Миграция: флаг изменений, восстановленных сверкой
+        columns = [row[1] for row in cursor.execute('PRAGMA table_info(real_time_changes)')]
+        if 'is_reconciled' not in columns:
+            cursor.execute('ALTER TABLE real_time_changes ADD COLUMN is_reconciled BOOLEAN DEFAULT 0')
+        if 'event_key' not in columns:
+            cursor.execute('ALTER TABLE real_time_changes ADD COLUMN event_key TEXT')
+        
+        # Повторно доставленные обновления отбрасываются индексом (NULL-ключи не сравниваются)
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_real_time_changes_event
+            ON real_time_changes (channel_id, user_id, change_type, event_key)
+        ''')
+        
+        # Справочник каналов и агрегаты обзорной панели
+        init_rollups(conn)
+        init_profiles(conn)
+        init_bursts(conn)
+        init_sketches(conn)
+        init_channel_pts(conn)
+        
         conn.commit()
         conn.close()
     
@@ -62,7 +233,7 @@ class TelegramChannelMonitor:
         if not all([self.api_id, self.api_hash, self.phone]):
             raise ValueError("Необходимо указать TELEGRAM_API_ID, TELEGRAM_API_HASH и TELEGRAM_PHONE в .env файле")
         
-        self.client = TelegramClient('monitor_session', self.api_id, self.api_hash)
+        self.client = ReconnectAwareClient('monitor_session', self.api_id, self.api_hash)
         await self.client.start(phone=self.phone)
         
         if not await self.client.is_user_authorized():
@@ -78,69 +249,434 @@ class TelegramChannelMonitor:
         # Регистрируем обработчики событий
         @self.client.on(events.ChatAction)
         async def handle_chat_action(event):
-            if event.chat_id in self.monitored_channels:
+            if self.is_monitored(event):
                 await self.process_chat_action(event)
         
-        # Получаем информацию о каналах
+        await self.resolve_channels(channel_usernames)
+        start_metrics_server()
+        
+        # Сверка состава и догрузка пропущенных обновлений идут в фоне, не задерживая поток событий
+        reconcile_task = self.start_reconciliation()
+        catch_up_task = self.start_catch_up()
+        burst_task = asyncio.create_task(self.burst_loop())
+        
+        # Запускаем мониторинг
+        logger.info("Мониторинг запущен", extra={'channels': len(self.monitored_channels)})
+        try:
+            await self.supervise()
+        except KeyboardInterrupt:
+            logger.info("Мониторинг остановлен")
+        finally:
+            reconcile_task.cancel()
+            catch_up_task.cancel()
+            burst_task.cancel()
+            self.save_bursts(self.burst_detector.close_all())
+            self.save_pts()
+    
+    async def supervise(self):
+        """Работа до вызова close(): после обрыва соединения — переподключение с паузами
+
+        После каждого восстановленного соединения запрашивается догрузка
+        пропущенных обновлений и сверка состава; обработчики событий
+        остаются зарегистрированными, перезапуск процесса не нужен.
+        """
+        attempt = 0
+        while not self.stopping:
+            try:
+                if not self.client.is_connected():
+                    await self.client.connect()
+                    logger.info("Соединение восстановлено после %s попыток", attempt + 1)
+                    attempt = 0
+                    self.catch_up_requested.set()
+                    if self.reconcile_requested is not None:
+                        self.reconcile_requested.set()
+                await self.client.run_until_disconnected()
+                if self.stopping:
+                    break
+                logger.warning("Соединение с Telegram потеряно")
+                continue
+            except (ConnectionError, OSError) as e:
+                delay = reconnect_delay(attempt)
+                logger.warning("Нет соединения с Telegram (%s), повтор через %.1f с", e, delay,
+                               extra={'attempt': attempt + 1})
+                attempt += 1
+                await asyncio.sleep(delay)
+    
+    async def resolve_channels(self, channel_usernames: List[str]):
+        """Получение информации о каналах и добавление их в мониторинг"""
         for username in channel_usernames:
             try:
                 channel = await self.client.get_entity(username)
                 self.monitored_channels.add(channel.id)
-                print(f"Начат мониторинг канала: {username}")
+                self.channel_entities[channel.id] = channel
+                self.remember_channel(channel.id, username)
+                logger.info("Начат мониторинг канала %s", username, extra={'channel_id': channel.id})
             except Exception as e:
-                print(f"Ошибка при получении канала {username}: {e}")
+                logger.error("Ошибка при получении канала %s: %s", username, e)
+    
+    def remember_channel(self, channel_id: int, channel_username: str):
+        """Сохранение username канала для обзорной панели"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                remember_channel(conn, channel_id, channel_username)
+        finally:
+            conn.close()
+    
+    def is_monitored(self, event) -> bool:
+        """Проверка, относится ли событие к отслеживаемому каналу"""
+        # event.chat_id содержит маркированный id (-100...), а в monitored_channels хранится channel.id
+        return utils.resolve_id(event.chat_id)[0] in self.monitored_channels
+    
+    @staticmethod
+    def extract_change(event) -> Optional[ChangeRow]:
+        """Извлечение строки изменения из события ChatAction"""
+        # Определяем тип изменения
+        if event.user_added or event.user_joined:
+            change_type = 'joined'
+        elif event.user_kicked or event.user_left:
+            change_type = 'left'
+        else:
+            return None
         
-        # Запускаем мониторинг
-        print("Мониторинг запущен. Нажмите Ctrl+C для остановки.")
+        # Получаем информацию о пользователе
+        user = event.user
+        if not user:
+            return None
+        
+        # channel_id храним без префикса -100, как в channel_snapshots
+        channel_id, _ = utils.resolve_id(event.chat_id)
+        
+        return ChangeRow(
+            channel_id=channel_id,
+            user_id=user.id,
+            change_type=change_type,
+            change_date=datetime.now(),
+            username=user.username,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            event_key=event_key(event)
+        )
+    
+    def save_changes(self, rows: List[ChangeRow]) -> List[ChangeRow]:
+        """Пакетное сохранение изменений в базу данных без повторно доставленных событий"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
         try:
-            await self.client.run_until_disconnected()
-        except KeyboardInterrupt:
-            print("\nМониторинг остановлен.")
+            return write_changes(conn, rows, self.recent_events)
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def format_change(row: ChangeRow) -> str:
+        """Форматирование изменения для вывода"""
+        action_text = "подписался" if row.change_type == 'joined' else "отписался"
+        user_info = f"@{row.username}" if row.username else f"{row.first_name} {row.last_name or ''}"
+        return f"[{row.change_date.strftime('%Y-%m-%d %H:%M:%S')}] {user_info} {action_text}"
     
     async def process_chat_action(self, event):
         """Обработка изменений в чате"""
         try:
-            # Определяем тип изменения
-            if event.user_added:
-                change_type = 'joined'
-            elif event.user_kicked or event.user_left:
-                change_type = 'left'
-            else:
+            row = self.extract_change(event)
+            if row is None:
                 return
+            EVENTS_RECEIVED.inc()
+            
+            self.note_live_changes(row.channel_id, [row.user_id])
             
-            # Получаем информацию о пользователе
-            user = event.user
-            if not user:
+            # Сохраняем изменение в базу данных; повторная доставка отбрасывается
+            written = self.save_changes([row])
+            # pts продвигается только после записи: иначе догрузка пропустила бы событие
+            self.note_pts(row.channel_id, getattr(getattr(event, 'original_update', None), 'pts', None))
+            if not written:
                 return
             
-            # Сохраняем изменение в базу данных
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            log_change(row)
+            self.observe_burst(row)
             
-            cursor.execute('''
-                INSERT INTO real_time_changes 
-                (channel_id, user_id, change_type, change_date, username, first_name, last_name)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                event.chat_id,
-                user.id,
-                change_type,
-                datetime.now(),
-                user.username,
-                user.first_name,
-                user.last_name
+        except Exception:
+            logger.exception("Ошибка при обработке изменения")
+    
+    def observe_burst(self, row: ChangeRow):
+        """Передача записанной подписки детектору всплесков (без обращения к базе)"""
+        # Подписки, восстановленные сверкой, получают одно время и дали бы ложный всплеск
+        if row.change_type != 'joined' or row.is_reconciled:
+            return
+        burst = self.burst_detector.observe(row.channel_id, row.user_id, row.change_date.timestamp())
+        if burst is not None:
+            JOIN_BURSTS.inc()
+            logger.warning("Всплеск подписок в канале", extra={
+                'channel_id': burst.channel_id, 'joins': burst.peak, 'threshold': round(burst.threshold, 1),
+                'baseline_per_minute': round(burst.baseline, 2),
+            })
+    
+    async def burst_loop(self):
+        """Закрытие затихших всплесков и сохранение их участников"""
+        while True:
+            await asyncio.sleep(BURST_CHECK_SECONDS)
+            try:
+                self.save_bursts(self.burst_detector.expire(datetime.now().timestamp()))
+            except Exception:
+                logger.exception("Ошибка при сохранении всплесков подписок")
+    
+    def save_bursts(self, bursts):
+        if not bursts:
+            return
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            save_bursts(conn, bursts)
+            conn.commit()
+        finally:
+            conn.close()
+        for burst in bursts:
+            logger.info("Всплеск подписок завершен", extra={
+                'channel_id': burst.channel_id, 'joins': burst.joins, 'peak': burst.peak,
+            })
+    
+    async def fetch_members(self, channel):
+        """Получение текущего состава канала
+
+        Возвращает (user_id -> (username, first_name, last_name), общее число участников).
+        """
+        members = {}
+        total = 0
+        offset = 0
+        limit = 200
+        
+        while True:
+            participants_chunk = await api_call(self.client, GetParticipantsRequest(
+                channel=channel,
+                filter=ChannelParticipantsSearch(''),
+                offset=offset,
+                limit=limit,
+                hash=0
             ))
+            COLLECTION_PAGES.inc()
+            
+            total = max(total, getattr(participants_chunk, 'count', 0))
+            if not participants_chunk.users:
+                break
             
+            for user in participants_chunk.users:
+                members[user.id] = (user.username, user.first_name, user.last_name)
+            offset += len(participants_chunk.users)
+            
+            if len(participants_chunk.users) < limit:
+                break
+        
+        return members, total
+    
+    def note_live_changes(self, channel_id: int, user_ids):
+        """Учет живых событий канала, пришедших во время его сверки"""
+        live_users = self.reconciling.get(channel_id)
+        if live_users is not None:
+            live_users.update(user_ids)
+    
+    def read_change_boundary(self) -> int:
+        """Последний записанный id в real_time_changes"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            return conn.execute('SELECT COALESCE(MAX(id), 0) FROM real_time_changes').fetchone()[0]
+        finally:
+            conn.close()
+    
+    def load_member_state(self, conn, channel_id: int, until_change_id: int):
+        """Последний известный состав канала с учетом изменений, записанных после него"""
+        row = conn.execute(
+            'SELECT member_ids, last_change_id FROM member_state WHERE channel_id = ?',
+            (channel_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        
+        member_ids = unpack_ids(row[0])
+        
+        # Последнее изменение каждого пользователя после сохранения состава
+        live_changes = conn.execute('''
+            SELECT user_id, change_type FROM real_time_changes
+            WHERE id IN (
+                SELECT MAX(id) FROM real_time_changes
+                WHERE channel_id = ? AND id > ? AND id <= ?
+                GROUP BY user_id
+            )
+        ''', (channel_id, row[1] or 0, until_change_id)).fetchall()
+        
+        if live_changes:
+            joined = to_id_array(user_id for user_id, change_type in live_changes if change_type == 'joined')
+            left = to_id_array(user_id for user_id, change_type in live_changes if change_type == 'left')
+            member_ids = np.setdiff1d(np.union1d(member_ids, joined), left, assume_unique=True)
+        
+        return member_ids
+    
+    def apply_reconciliation(self, channel_id: int, members: Dict[int, tuple], until_change_id: int,
+                             live_users=frozenset()) -> Dict:
+        """Сравнение состава с последним известным и запись восстановленных изменений
+
+        Выполняется вне цикла событий: разбор массивов и запись в SQLite
+        не должны задерживать обработку живых обновлений.
+        """
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            current_ids = to_id_array(members.keys())
+            previous_ids = self.load_member_state(conn, channel_id, until_change_id)
+            
+            rows = []
+            if previous_ids is not None:
+                added, removed = diff_ids(previous_ids, current_ids)
+                
+                # Изменения, записанные во время получения участников, уже отражены
+                # в current_ids и записаны как живые: повторно их не добавляем
+                during_fetch = conn.execute('''
+                    SELECT DISTINCT user_id FROM real_time_changes
+                    WHERE channel_id = ? AND id > ? AND is_reconciled = 0
+                ''', (channel_id, until_change_id)).fetchall()
+                touched = to_id_array(set(live_users).union(user_id for (user_id,) in during_fetch))
+                added = np.setdiff1d(added, touched, assume_unique=True)
+                removed = np.setdiff1d(removed, touched, assume_unique=True)
+                
+                now = datetime.now()
+                for user_id in added.tolist():
+                    rows.append(ChangeRow(channel_id, user_id, 'joined', now, *members[user_id], is_reconciled=True))
+                for user_id in removed.tolist():
+                    rows.append(ChangeRow(channel_id, user_id, 'left', now, None, None, None, is_reconciled=True))
+            
+            conn.executemany(INSERT_CHANGE_SQL, rows)
+            conn.execute('''
+                INSERT OR REPLACE INTO member_state
+                (channel_id, member_ids, member_count, last_change_id, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (channel_id, pack_ids(current_ids), len(current_ids), until_change_id, datetime.now()))
             conn.commit()
+        finally:
             conn.close()
+        
+        return {
+            'channel_id': channel_id,
+            'member_count': len(current_ids),
+            'joined': sum(1 for row in rows if row.change_type == 'joined'),
+            'left': sum(1 for row in rows if row.change_type == 'left'),
+            'baseline': previous_ids is None,
+            'skipped': False
+        }
+    
+    async def reconcile_channel(self, channel) -> Dict:
+        """Сверка состава канала с последним известным и восстановление пропущенных изменений"""
+        loop = asyncio.get_running_loop()
+        
+        # Граница до запроса участников: более поздние события учтем при следующей сверке
+        until_change_id = await loop.run_in_executor(None, self.read_change_boundary)
+        
+        live_users = self.reconciling[channel.id] = set()
+        try:
+            members, total = await self.fetch_members(channel)
             
-            # Выводим информацию об изменении
-            action_text = "подписался" if change_type == 'joined' else "отписался"
-            user_info = f"@{user.username}" if user.username else f"{user.first_name} {user.last_name or ''}"
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {user_info} {action_text}")
+            # Поиск участников ограничен сервером (около 10 тыс.): по неполному
+            # составу нельзя отличить отписку от непоказанного участника
+            if len(members) < total:
+                return {
+                    'channel_id': channel.id,
+                    'member_count': total,
+                    'fetched': len(members),
+                    'skipped': True
+                }
             
-        except Exception as e:
-            print(f"Ошибка при обработке изменения: {e}")
+            return await loop.run_in_executor(
+                None, self.apply_reconciliation, channel.id, members, until_change_id, frozenset(live_users)
+            )
+        finally:
+            del self.reconciling[channel.id]
+    
+    async def reconcile_channels(self):
+        """Сверка всех отслеживаемых каналов"""
+        for channel in list(self.channel_entities.values()):
+            try:
+                result = await self.reconcile_channel(channel)
+                if result['skipped']:
+                    logger.warning("Сверка канала %s пропущена: получено %s из %s участников",
+                                   channel.id, result['fetched'], result['member_count'])
+                elif result['baseline']:
+                    logger.info("Сохранен исходный состав канала %s: %s участников",
+                                channel.id, result['member_count'])
+                else:
+                    logger.info("Сверка канала %s: восстановлено подписок %s, отписок %s",
+                                channel.id, result['joined'], result['left'],
+                                extra={'channel_id': channel.id, 'joined': result['joined'], 'left': result['left']})
+            except Exception:
+                logger.exception("Ошибка при сверке канала %s", channel.id)
+    
+    def start_reconciliation(self) -> asyncio.Task:
+        """Запуск фоновой сверки с повтором после каждого переподключения клиента"""
+        self.reconcile_requested = asyncio.Event()
+        if hasattr(self.client, 'reconnect_callbacks'):
+            self.client.reconnect_callbacks.append(self.reconcile_requested.set)
+        return asyncio.create_task(self.reconcile_loop())
+    
+    def start_catch_up(self) -> asyncio.Task:
+        """Запуск догрузки пропущенных обновлений: при старте и после переподключений"""
+        self.catch_up_requested = asyncio.Event()
+        if hasattr(self.client, 'reconnect_callbacks'):
+            self.client.reconnect_callbacks.append(self.catch_up_requested.set)
+        return asyncio.create_task(self.catch_up_loop())
+    
+    async def catch_up_loop(self):
+        while True:
+            try:
+                await self.catch_up()
+            except Exception:
+                logger.exception("Ошибка при догрузке пропущенных обновлений")
+            await self.catch_up_requested.wait()
+            self.catch_up_requested.clear()
+    
+    async def catch_up(self) -> List[ChangeRow]:
+        """Догрузка изменений каналов после последнего известного pts
+
+        Возвращает записанные строки. Каналы со слишком большой разницей
+        догружаются сверкой состава.
+        """
+        if not self.channel_pts:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            try:
+                self.channel_pts.update(load_channel_pts(conn))
+            finally:
+                conn.close()
+        results = await catch_up_channels(self.client, dict(self.channel_entities), dict(self.channel_pts),
+                                          CATCH_UP_CONCURRENCY)
+        rows = [row for result in results for row in result.rows]
+        written = self.save_changes(rows) if rows else []
+        for row in written:
+            log_change(row, catch_up=True)
+        for result in results:
+            self.note_pts(result.channel_id, result.pts)
+        self.save_pts()
+        
+        too_long = [result.channel_id for result in results if result.too_long]
+        if too_long and self.reconcile_requested is not None:
+            logger.warning("Слишком много пропущенных обновлений, каналы будут сверены", extra={'channels': too_long})
+            self.reconcile_requested.set()
+        if written:
+            logger.info("Догружено пропущенных изменений: %s", len(written), extra={'changes': len(written)})
+        return written
+    
+    def note_pts(self, channel_id: int, pts: Optional[int]):
+        """Последний pts канала (из живых обновлений и догрузки)"""
+        if pts and pts > self.channel_pts.get(channel_id, 0):
+            self.channel_pts[channel_id] = pts
+    
+    def save_pts(self):
+        if not self.channel_pts:
+            return
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            save_channel_pts(conn, self.channel_pts)
+            conn.commit()
+        finally:
+            conn.close()
+    
+    async def reconcile_loop(self):
+        """Сверка при запуске и после каждого переподключения"""
+        while True:
+            await self.reconcile_channels()
+            await self.reconcile_requested.wait()
+            self.reconcile_requested.clear()
     
     async def take_snapshot(self, channel_username: str):
         """Создание снимка текущего состояния канала"""
@@ -151,7 +687,7 @@ class TelegramChannelMonitor:
             channel = await self.client.get_entity(channel_username)
             
             # Получаем количество участников
-            participants = await self.client(GetParticipantsRequest(
+            participants = await api_call(self.client, GetParticipantsRequest(
                 channel=channel,
                 filter=ChannelParticipantsSearch(''),
                 offset=0,
@@ -177,13 +713,15 @@ class TelegramChannelMonitor:
             conn.commit()
             conn.close()
             
-            print(f"Снимок канала {channel_username} создан")
+            logger.info("Снимок канала %s создан", channel_username)
             
         except Exception as e:
-            print(f"Ошибка при создании снимка канала {channel_username}: {e}")
+            logger.error("Ошибка при создании снимка канала %s: %s", channel_username, e)
     
-    def get_recent_changes(self, channel_username: str, hours: int = 24) -> pd.DataFrame:
+    def get_recent_changes(self, channel_username: str, hours: int = 24) -> 'pd.DataFrame':
         """Получение недавних изменений"""
+        import pandas as pd
+        
         conn = sqlite3.connect(self.db_path)
         
         since_time = datetime.now() - timedelta(hours=hours)
@@ -206,8 +744,10 @@ class TelegramChannelMonitor:
         conn.close()
         return df
     
-    def get_growth_trend(self, channel_username: str, days: int = 7) -> pd.DataFrame:
+    def get_growth_trend(self, channel_username: str, days: int = 7) -> 'pd.DataFrame':
         """Получение тренда роста канала"""
+        import pandas as pd
+        
         conn = sqlite3.connect(self.db_path)
         
         since_time = datetime.now() - timedelta(days=days)
@@ -230,6 +770,8 @@ class TelegramChannelMonitor:
     
     def get_channel_statistics(self, channel_username: str, days: int = 30) -> Dict:
         """Получение статистики канала"""
+        import pandas as pd
+        
         conn = sqlite3.connect(self.db_path)
         
         since_time = datetime.now() - timedelta(days=days)
@@ -288,6 +830,8 @@ class TelegramChannelMonitor:
     
     def export_data_to_csv(self, channel_username: str, output_file: str = None):
         """Экспорт данных канала в CSV файл"""
+        import pandas as pd
+        
         if not output_file:
             output_file = f"{channel_username}_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
         
@@ -312,17 +856,19 @@ class TelegramChannelMonitor:
         
         if not df.empty:
             df.to_csv(output_file, index=False, encoding='utf-8')
-            print(f"Данные экспортированы в файл: {output_file}")
+            logger.info("Данные экспортированы в файл: %s", output_file)
         else:
-            print(f"Нет данных для канала {channel_username}")
+            logger.warning("Нет данных для канала %s", channel_username)
     
     async def close(self):
         """Закрытие соединения"""
+        self.stopping = True
         if self.client:
             await self.client.disconnect()
 
 async def main():
     """Основная функция для запуска мониторинга"""
+    setup_logging()
     monitor = TelegramChannelMonitor()
     
     # Список каналов для мониторинга
@@ -336,13 +882,13 @@ async def main():
     ]
     
     if not channels_to_monitor:
-        print("Добавьте каналы для мониторинга в список channels_to_monitor")
+        logger.error("Добавьте каналы для мониторинга в список channels_to_monitor")
         return
     
     try:
         await monitor.start_monitoring(channels_to_monitor)
-    except Exception as e:
-        print(f"Ошибка при запуске мониторинга: {e}")
+    except Exception:
+        logger.exception("Ошибка при запуске мониторинга")
     finally:
         await monitor.close()
 
@@ -1,246 +1,303 @@
 import os
+import time
 import asyncio
+import logging
 import sqlite3
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import streamlit as st
-from telethon import TelegramClient, events
-from telethon.tl.types import Channel, User
-from telethon.tl.functions.channels import GetParticipantsRequest
-from telethon.tl.types import ChannelParticipantsSearch
-from dotenv import load_dotenv
-
-# Загружаем переменные окружения
-load_dotenv()
-
-class TelegramStatsCollector:
-    def __init__(self):
-        self.api_id = os.getenv('TELEGRAM_API_ID')
-        self.api_hash = os.getenv('TELEGRAM_API_HASH')
-        self.phone = os.getenv('TELEGRAM_PHONE')
-        self.client = None
-        self.db_path = 'telegram_stats.db'
-        self.init_database()
+from log_config import setup_logging
+from stats_collector import StatsCollector, CollectionProgress, CollectionResult
+from channel_rollups import ChannelOverviewRow, channel_overview, refresh_rollups, resolve_channel_id, table_exists
+from live_feed import LiveFeed, LiveCounters, LiveChange, LIVE_WINDOW_MINUTES
+from cohorts import COHORT_SOURCES, cohort_frame, cohort_matrix, update_cohort_state
+
+logger = logging.getLogger(__name__)
+
+OVERVIEW_PAGE_SIZE = 50
+DETAIL_PAGE_SIZE = 100
+LIVE_POLL_SECONDS = 2
+RETENTION_WEEKS = 26
+
+OVERVIEW_SORTS = {
+    'Прирост': 'growth',
+    'Отток': 'churn',
+    'Размер': 'size',
+}
+
+OVERVIEW_COLUMNS = {
+    'channel_username': 'Канал',
+    'member_count': 'Участников',
+    'joined': 'Подписались',
+    'left_count': 'Отписались',
+    'net_growth': 'Прирост',
+    'churn_rate': 'Отток, %',
+}
+
+class TelegramStatsCollector(StatsCollector):
+    """Streamlit-адаптер сборщика: показывает ход и итог сбора и графики
+
+    pandas, plotly и streamlit импортируются в методах, поэтому сбор участников
+    без интерфейса (stats_collector.StatsCollector) их не загружает.
+    """
     
-    def init_database(self):
-        """Инициализация базы данных"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Таблица для хранения участников канала
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS channel_members (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                channel_id INTEGER,
-                user_id INTEGER,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                joined_date TIMESTAMP,
-                left_date TIMESTAMP,
-                is_active BOOLEAN DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+    async def collect_members_with_ui(self, channel_username: str) -> CollectionResult:
+        """Сбор участников с индикатором хода и сообщением об итоге"""
+        import streamlit as st
         
-        # Таблица для хранения истории изменений
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS member_changes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                channel_id INTEGER,
-                user_id INTEGER,
-                change_type TEXT, -- 'joined' или 'left'
-                change_date TIMESTAMP,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        progress_bar = st.progress(0.0, text="Сбор участников...")
         
-        conn.commit()
-        conn.close()
-    
-    async def connect(self):
-        """Подключение к Telegram API"""
-        if not all([self.api_id, self.api_hash, self.phone]):
-            raise ValueError("Необходимо указать TELEGRAM_API_ID, TELEGRAM_API_HASH и TELEGRAM_PHONE в .env файле")
+        def on_progress(event: CollectionProgress):
+            if event.stage == 'page' and event.total:
+                progress_bar.progress(min(event.collected / event.total, 1.0),
+                                      text=f"Собрано {event.collected} из {event.total}")
         
-        self.client = TelegramClient('session_name', self.api_id, self.api_hash)
-        await self.client.start(phone=self.phone)
-        
-        if not await self.client.is_user_authorized():
-            await self.client.send_code_request(self.phone)
-            code = input('Введите код подтверждения: ')
-            await self.client.sign_in(self.phone, code)
-    
-    async def get_channel_info(self, channel_username: str) -> Optional[Channel]:
-        """Получение информации о канале"""
         try:
-            channel = await self.client.get_entity(channel_username)
-            return channel
-        except Exception as e:
-            st.error(f"Ошибка при получении информации о канале: {e}")
-            return None
+            result = await self.collect_members(channel_username, on_progress)
+        finally:
+            # Клиент привязан к циклу событий asyncio.run, который завершится вместе с вызовом
+            await self.close()
+            self.client = None
+        
+        progress_bar.empty()
+        if result.ok:
+            st.success(f"Собрано {result.collected} участников канала")
+        else:
+            st.error(f"Ошибка при сборе участников: {result.error}")
+        return result
     
-    async def collect_members(self, channel_username: str):
-        """Сбор участников канала"""
-        channel = await self.get_channel_info(channel_username)
-        if not channel:
-            return
+    def show_overview(self):
+        """Рейтинг каналов по приросту, оттоку и размеру за период
+
+        Фильтр, сортировка и разбиение на страницы выполняются в SQLite по
+        агрегатам channel_rollups; в браузер уходит только текущая страница.
+        """
+        import pandas as pd
+        import streamlit as st
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        st.header("Обзор каналов")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            days = st.selectbox("Период, дней", [7, 30, 90], index=1)
+        with col2:
+            sort = OVERVIEW_SORTS[st.selectbox("Сортировка", list(OVERVIEW_SORTS))]
+        with col3:
+            search = st.text_input("Поиск по username")
+        page = st.number_input("Страница", min_value=1, value=1, step=1)
         
+        start = time.perf_counter()
+        conn = sqlite3.connect(self.db_path, timeout=30)
         try:
-            # Получаем всех участников канала
-            participants = []
-            offset = 0
-            limit = 200
-            
-            while True:
-                participants_chunk = await self.client(GetParticipantsRequest(
-                    channel=channel,
-                    filter=ChannelParticipantsSearch(''),
-                    offset=offset,
-                    limit=limit,
-                    hash=0
-                ))
-                
-                if not participants_chunk.users:
-                    break
-                
-                participants.extend(participants_chunk.users)
-                offset += len(participants_chunk.users)
-                
-                if len(participants_chunk.users) < limit:
-                    break
-            
-            # Сохраняем участников в базу данных
-            current_time = datetime.now()
-            for participant in participants:
-                cursor.execute('''
-                    INSERT OR REPLACE INTO channel_members 
-                    (channel_id, user_id, username, first_name, last_name, joined_date, is_active)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    channel.id,
-                    participant.id,
-                    participant.username,
-                    participant.first_name,
-                    participant.last_name,
-                    current_time,
-                    1
-                ))
-            
-            conn.commit()
-            st.success(f"Собрано {len(participants)} участников канала")
-            
-        except Exception as e:
-            st.error(f"Ошибка при сборе участников: {e}")
+            # Инкрементально: обрабатываются только новые изменения и снимки
+            refresh_rollups(conn)
+            rows, total = channel_overview(conn, days=days, sort=sort, search=search or None,
+                                           limit=OVERVIEW_PAGE_SIZE, offset=(page - 1) * OVERVIEW_PAGE_SIZE)
         finally:
             conn.close()
-    
-    def get_member_changes(self, channel_username: str, start_date: datetime, end_date: datetime) -> pd.DataFrame:
-        """Получение изменений участников за период"""
-        conn = sqlite3.connect(self.db_path)
-        
-        query = '''
-            SELECT 
-                mc.change_type,
-                mc.change_date,
-                cm.username,
-                cm.first_name,
-                cm.last_name
-            FROM member_changes mc
-            JOIN channel_members cm ON mc.user_id = cm.user_id
-            WHERE mc.change_date BETWEEN ? AND ?
-            ORDER BY mc.change_date
-        '''
-        
-        df = pd.read_sql_query(query, conn, params=[start_date, end_date])
-        conn.close()
-        return df
-    
-    def get_current_stats(self, channel_username: str) -> Dict:
-        """Получение текущей статистики канала"""
-        conn = sqlite3.connect(self.db_path)
-        
-        # Общее количество участников
-        total_members = pd.read_sql_query(
-            'SELECT COUNT(*) as count FROM channel_members WHERE is_active = 1', 
-            conn
-        ).iloc[0]['count']
-        
-        # Участники за последние 30 дней
-        thirty_days_ago = datetime.now() - timedelta(days=30)
-        new_members = pd.read_sql_query(
-            'SELECT COUNT(*) as count FROM channel_members WHERE joined_date >= ? AND is_active = 1',
-            conn,
-            params=[thirty_days_ago]
-        ).iloc[0]['count']
+        elapsed_ms = (time.perf_counter() - start) * 1000
         
-        # Участники, покинувшие за последние 30 дней
-        left_members = pd.read_sql_query(
-            'SELECT COUNT(*) as count FROM member_changes WHERE change_type = "left" AND change_date >= ?',
-            conn,
-            params=[thirty_days_ago]
-        ).iloc[0]['count']
-        
-        conn.close()
+        if not rows:
+            st.info("Нет каналов для отображения")
+            return
         
-        return {
-            'total_members': total_members,
-            'new_members_30d': new_members,
-            'left_members_30d': left_members,
-            'net_growth_30d': new_members - left_members
-        }
+        df = pd.DataFrame(rows, columns=ChannelOverviewRow._fields)
+        df['churn_rate'] = (df['churn_rate'] * 100).round(2)
+        st.dataframe(df[list(OVERVIEW_COLUMNS)].rename(columns=OVERVIEW_COLUMNS), hide_index=True)
+        pages = (total + OVERVIEW_PAGE_SIZE - 1) // OVERVIEW_PAGE_SIZE
+        st.caption(f"Каналов: {total}, страница {page} из {pages}, запрос {elapsed_ms:.0f} мс")
     
-    def create_visualizations(self, channel_username: str, start_date: datetime, end_date: datetime):
-        """Создание визуализаций статистики"""
-        df = self.get_member_changes(channel_username, start_date, end_date)
-        
+    def show_live(self):
+        """Онлайн-лента изменений со всех отслеживаемых каналов
+
+        Лента и счетчики живут в session_state между перезапусками скрипта:
+        при каждом опросе читаются только строки после курсора LiveFeed.
+        """
+        import pandas as pd
+        import plotly.graph_objects as go
+        import streamlit as st
+
+        st.header("Онлайн")
+        autorefresh = st.sidebar.checkbox("Автообновление", value=True, key='live_autorefresh')
+        with sqlite3.connect(self.db_path) as conn:
+            if not table_exists(conn, 'real_time_changes'):
+                st.info("Онлайн-лента появится после запуска монитора (telegram_monitor.py)")
+                return
+
+        if 'live_feed' not in st.session_state:
+            feed = LiveFeed(self.db_path)
+            feed.start_from(datetime.now() - timedelta(minutes=LIVE_WINDOW_MINUTES))
+            st.session_state.live_feed = feed
+            st.session_state.live_counters = LiveCounters()
+            st.session_state.live_names = {}
+        feed, counters, names = st.session_state.live_feed, st.session_state.live_counters, st.session_state.live_names
+
+        received = counters.apply(feed.poll())
+        counters.prune(datetime.now())
+
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Подписались", sum(counters.joined.values()))
+        with col2:
+            st.metric("Отписались", sum(counters.left.values()))
+        with col3:
+            st.metric("Новых событий", received)
+
+        timeline = counters.timeline()
+        if timeline:
+            minutes, joined, left = zip(*timeline)
+            fig = go.Figure()
+            fig.add_trace(go.Bar(x=minutes, y=joined, name='Подписались', marker_color='green'))
+            fig.add_trace(go.Bar(x=minutes, y=[-count for count in left], name='Отписались', marker_color='red'))
+            fig.update_layout(title=f'Изменения по минутам за {LIVE_WINDOW_MINUTES} мин',
+                              barmode='relative', xaxis_title='Время', yaxis_title='Количество')
+            st.plotly_chart(fig, use_container_width=True)
+
+        by_channel = counters.by_channel()
+        unknown = [channel_id for channel_id, _, _ in by_channel if channel_id not in names]
+        if unknown:
+            with sqlite3.connect(self.db_path) as conn:
+                names.update(conn.execute(
+                    f"SELECT channel_id, channel_username FROM channels WHERE channel_id IN ({', '.join('?' * len(unknown))})",
+                    unknown
+                ).fetchall())
+        if by_channel:
+            st.subheader("Активные каналы")
+            st.dataframe(pd.DataFrame(
+                [(names.get(channel_id, channel_id), joined, left) for channel_id, joined, left in by_channel],
+                columns=['Канал', 'Подписались', 'Отписались']
+            ), hide_index=True)
+
+        if counters.recent:
+            st.subheader("Последние события")
+            recent = pd.DataFrame(reversed(counters.recent), columns=LiveChange._fields)
+            recent['channel_id'] = recent['channel_id'].map(lambda channel_id: names.get(channel_id, channel_id))
+            st.dataframe(recent[['change_date', 'channel_id', 'change_type', 'username', 'first_name']], hide_index=True)
+
+        if autorefresh:
+            time.sleep(LIVE_POLL_SECONDS)
+            st.rerun()
+
+    def show_retention(self):
+        """Удержание подписчиков по недельным когортам
+
+        Состояние когорт обновляется только новыми изменениями, в браузер
+        уходит готовая матрица долей.
+        """
+        import io
+        import plotly.graph_objects as go
+        import streamlit as st
+
+        st.header("Удержание по когортам")
+        with sqlite3.connect(self.db_path) as conn:
+            channels = [name for (name,) in conn.execute(
+                'SELECT channel_username FROM channels ORDER BY channel_username COLLATE NOCASE')]
+        if not channels:
+            st.info("Нет каналов: соберите участников или запустите монитор")
+            return
+
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            channel_username = st.selectbox("Канал", channels)
+        with col2:
+            weeks = st.slider("Недель удержания", min_value=4, max_value=52, value=RETENTION_WEEKS)
+        with col3:
+            source = st.selectbox("Источник изменений", COHORT_SOURCES)
+
+        start = time.perf_counter()
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            channel_id = resolve_channel_id(conn, channel_username)
+            matrix = cohort_matrix(update_cohort_state(conn, channel_id, source), max_weeks=weeks)
+        finally:
+            conn.close()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        df = cohort_frame(matrix)
         if df.empty:
+            st.warning("Нет подписок для построения когорт")
+            return
+
+        week_columns = [column for column in df.columns if column.startswith('week_')]
+        fig = go.Figure(data=go.Heatmap(
+            z=df[week_columns].values * 100,
+            x=list(range(len(week_columns))),
+            y=df['cohort'].dt.strftime('%Y-%m-%d') + ' (' + df['users'].astype(str) + ')',
+            colorscale='Greens', zmin=0, zmax=100, colorbar=dict(title='%'),
+        ))
+        fig.update_layout(title=f'Удержание подписчиков @{channel_username}',
+                          xaxis_title='Недель после подписки', yaxis_title='Неделя подписки (пользователей)',
+                          yaxis=dict(autorange='reversed'), height=max(400, 18 * len(df)))
+        st.plotly_chart(fig, use_container_width=True)
+        st.caption(f"Когорт: {len(df)}, пользователей: {int(df['users'].sum())}, расчет {elapsed_ms:.0f} мс")
+
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button("Скачать CSV", df.to_csv(index=False).encode('utf-8'),
+                               file_name=f'cohorts_{channel_username}.csv', mime='text/csv')
+        with col2:
+            buffer = io.BytesIO()
+            df.to_parquet(buffer, index=False)
+            st.download_button("Скачать Parquet", buffer.getvalue(),
+                               file_name=f'cohorts_{channel_username}.parquet', mime='application/octet-stream')
+
+    def create_visualizations(self, channel_username: str, start_date: datetime, end_date: datetime):
+        """Создание визуализаций статистики
+
+        В браузер уходят только дневные суммы, прореженные до ширины графика,
+        и одна страница детальной таблицы.
+        """
+        import numpy as np
+        import pandas as pd
+        import plotly.graph_objects as go
+        import streamlit as st
+        from downsampling import MAX_CHART_POINTS, lttb
+
+        daily_changes = self.get_daily_changes(channel_username, start_date, end_date)
+
+        if daily_changes.empty:
             st.warning("Нет данных для отображения за выбранный период")
             return
-        
+
         # График изменений по дням
-        df['date'] = pd.to_datetime(df['change_date']).dt.date
-        daily_changes = df.groupby(['date', 'change_type']).size().unstack(fill_value=0)
-        
+        dates = pd.to_datetime(daily_changes['date'])
+        x = dates.values.astype('datetime64[D]').astype(np.int64)
+
         fig1 = go.Figure()
-        if 'joined' in daily_changes.columns:
-            fig1.add_trace(go.Scatter(x=daily_changes.index, y=daily_changes['joined'], 
-                                    mode='lines+markers', name='Подписались', line=dict(color='green')))
-        if 'left' in daily_changes.columns:
-            fig1.add_trace(go.Scatter(x=daily_changes.index, y=daily_changes['left'], 
-                                    mode='lines+markers', name='Отписались', line=dict(color='red')))
-        
+        for column, name, color in (('joined', 'Подписались', 'green'), ('left', 'Отписались', 'red')):
+            points = lttb(x, daily_changes[column].values, MAX_CHART_POINTS)
+            fig1.add_trace(go.Scatter(x=dates.iloc[points], y=daily_changes[column].iloc[points],
+                                      mode='lines+markers' if len(points) < 100 else 'lines',
+                                      name=name, line=dict(color=color)))
+
         fig1.update_layout(title='Динамика подписок и отписок по дням',
                           xaxis_title='Дата', yaxis_title='Количество')
         st.plotly_chart(fig1)
-        
+        if len(daily_changes) > MAX_CHART_POINTS:
+            st.caption(f"Показано {MAX_CHART_POINTS} из {len(daily_changes)} дней")
+
         # Круговая диаграмма общего соотношения
-        total_joined = len(df[df['change_type'] == 'joined'])
-        total_left = len(df[df['change_type'] == 'left'])
-        
-        fig2 = go.Figure(data=[go.Pie(labels=['Подписались', 'Отписались'], 
+        total_joined = int(daily_changes['joined'].sum())
+        total_left = int(daily_changes['left'].sum())
+
+        fig2 = go.Figure(data=[go.Pie(labels=['Подписались', 'Отписались'],
                                      values=[total_joined, total_left],
-                                     colors=['green', 'red'])])
+                                     marker=dict(colors=['green', 'red']))])
         fig2.update_layout(title='Общее соотношение подписок и отписок')
         st.plotly_chart(fig2)
-        
-        # Таблица с детальной информацией
+
+        # Таблица с детальной информацией (постранично)
         st.subheader("Детальная информация об изменениях")
-        st.dataframe(df)
-    
-    async def close(self):
-        """Закрытие соединения"""
-        if self.client:
-            await self.client.disconnect()
+        pages = max((total_joined + total_left + DETAIL_PAGE_SIZE - 1) // DETAIL_PAGE_SIZE, 1)
+        page = st.number_input("Страница таблицы", min_value=1, max_value=pages, value=1, step=1)
+        df, total = self.get_member_changes_page(channel_username, start_date, end_date,
+                                                 limit=DETAIL_PAGE_SIZE, offset=(page - 1) * DETAIL_PAGE_SIZE)
+        st.dataframe(df, hide_index=True)
+        st.caption(f"Изменений: {total}, страница {page} из {pages}")
 
 def main():
+    import streamlit as st
+    
+    # Streamlit перезапускает скрипт при каждом действии: логирование настраивается один раз
+    if not logging.getLogger().handlers:
+        setup_logging()
     st.set_page_config(page_title="Telegram Channel Statistics", layout="wide")
     st.title("📊 Статистика Telegram канала")
     
@@ -250,6 +307,18 @@ def main():
     # Боковая панель для настроек
     st.sidebar.header("Настройки")
     
+    # Обзор, онлайн-лента и удержание читают только базу и не требуют подключения к Telegram
+    section = st.sidebar.radio("Раздел", ["Канал", "Обзор каналов", "Онлайн", "Удержание"])
+    if section == "Обзор каналов":
+        collector.show_overview()
+        return
+    if section == "Онлайн":
+        collector.show_live()
+        return
+    if section == "Удержание":
+        collector.show_retention()
+        return
+    
     # Проверка наличия переменных окружения
     if not all([os.getenv('TELEGRAM_API_ID'), os.getenv('TELEGRAM_API_HASH'), os.getenv('TELEGRAM_PHONE')]):
         st.sidebar.error("⚠️ Необходимо настроить переменные окружения в файле .env")
@@ -277,8 +346,7 @@ def main():
     with col1:
         if st.button("🔍 Собрать данные"):
             if channel_username:
-                with st.spinner("Сбор данных..."):
-                    asyncio.run(collector.collect_members(channel_username))
+                asyncio.run(collector.collect_members_with_ui(channel_username))
             else:
                 st.error("Введите username канала")
     
@@ -311,7 +379,10 @@ def main():
             st.metric("Чистый прирост", stats['net_growth_30d'])
         
         # Визуализации
+        # Флаг в session_state: смена страницы таблицы перезапускает скрипт
         if st.button("Обновить графики"):
+            st.session_state.show_charts = True
+        if st.session_state.get('show_charts'):
             collector.create_visualizations(channel_username, start_date, end_date)
 
 if __name__ == "__main__":
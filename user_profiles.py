@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+История профилей участников (username, имя, фамилия)
+
+user_profiles хранит хеш текущего профиля каждого пользователя,
+user_profiles_history — строку на каждое фактическое изменение. Страница
+полученных пользователей сравнивается с сохраненными хешами одним запросом,
+поэтому объем записи зависит от числа изменений, а не от частоты сбора.
+
+Поиск: python user_profiles.py durov  или  python user_profiles.py 12345
+"""
+
+import sys
+import hashlib
+import logging
+from datetime import datetime
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Пользователей в одном запросе сравнения (меньше лимита параметров SQLite)
+PROFILE_CHUNK = 500
+
+
+class ProfileChange(NamedTuple):
+    """Строка user_profiles_history"""
+    user_id: int
+    username: Optional[str]
+    first_name: Optional[str]
+    last_name: Optional[str]
+    observed_at: str
+    channel_id: Optional[int]
+
+
+def init_profiles(conn):
+    """Таблицы профилей (вызывается из init_database сборщика и монитора)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_profiles (
+            user_id INTEGER PRIMARY KEY,
+            profile_hash INTEGER,
+            updated_at TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_profiles_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            observed_at TIMESTAMP,
+            channel_id INTEGER
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_user_profiles_history_user ON user_profiles_history (user_id, id)')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_profiles_history_username
+        ON user_profiles_history (username COLLATE NOCASE)
+    ''')
+
+
+def profile_hash(username: Optional[str], first_name: Optional[str], last_name: Optional[str]) -> int:
+    """64-битный хеш профиля со знаком (помещается в INTEGER SQLite)"""
+    text = '\x1f'.join('\x00' if value is None else value for value in (username, first_name, last_name))
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+
+def record_profiles(conn, users: Iterable[Tuple[int, Optional[str], Optional[str], Optional[str]]],
+                    observed_at: Optional[datetime] = None, channel_id: Optional[int] = None) -> int:
+    """Запись изменившихся профилей; возвращает число записанных изменений
+
+    users — кортежи (user_id, username, first_name, last_name). Транзакцией
+    управляет вызывающий код: запись идет в том же коммите, что и участники.
+    """
+    observed_at = observed_at or datetime.now()
+    # Последний профиль пользователя в пачке
+    latest = {user[0]: (user, profile_hash(*user[1:])) for user in users}
+    user_ids = list(latest)
+
+    changed = []
+    for begin in range(0, len(user_ids), PROFILE_CHUNK):
+        chunk = user_ids[begin:begin + PROFILE_CHUNK]
+        known = dict(conn.execute(
+            f"SELECT user_id, profile_hash FROM user_profiles WHERE user_id IN ({', '.join('?' * len(chunk))})",
+            chunk
+        ).fetchall())
+        changed.extend(latest[user_id] for user_id in chunk if known.get(user_id) != latest[user_id][1])
+
+    if not changed:
+        return 0
+    conn.executemany('''
+        INSERT INTO user_profiles_history (user_id, username, first_name, last_name, observed_at, channel_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(*user, observed_at, channel_id) for user, _ in changed])
+    conn.executemany('''
+        INSERT INTO user_profiles (user_id, profile_hash, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET profile_hash = excluded.profile_hash, updated_at = excluded.updated_at
+    ''', [(user[0], digest, observed_at) for user, digest in changed])
+    return len(changed)
+
+
+def profile_history(conn, user_id: int) -> List[ProfileChange]:
+    """Все известные профили пользователя в порядке наблюдения"""
+    return [ProfileChange(*row) for row in conn.execute('''
+        SELECT user_id, username, first_name, last_name, observed_at, channel_id
+        FROM user_profiles_history
+        WHERE user_id = ?
+        ORDER BY id
+    ''', (user_id,))]
+
+
+def users_with_username(conn, username: str) -> List[int]:
+    """Пользователи, когда-либо носившие username (без учета регистра)"""
+    return [user_id for (user_id,) in conn.execute('''
+        SELECT DISTINCT user_id FROM user_profiles_history
+        WHERE username = ? COLLATE NOCASE
+    ''', (username.lstrip('@'),))]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    import sqlite3
+    from storage import default_db_path
+
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print("Использование: python user_profiles.py <username или user_id>", file=sys.stderr)
+        return 2
+    conn = sqlite3.connect(default_db_path())
+    try:
+        query = argv[0]
+        user_ids = [int(query)] if query.isdigit() else users_with_username(conn, query)
+        if not user_ids:
+            print(f"Пользователь {query} не найден")
+        for user_id in user_ids:
+            print(f"user_id {user_id}:")
+            for change in profile_history(conn, user_id):
+                name = ' '.join(part for part in (change.first_name, change.last_name) if part)
+                print(f"  {change.observed_at}  @{change.username or '-'}  {name}")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())